@@ -15,6 +15,8 @@ from functools import wraps
 import logging
 import copy
 from django.core.serializers.json import DjangoJSONEncoder
+from products.utils.cache import UNCACHEABLE, get_or_set_cache
+from .ratelimit import SLIDING_WINDOW, check_rate_limit
 import json
 
 logger = logging.getLogger(__name__)
@@ -25,58 +27,31 @@ class CacheHandler:
     """
     
     @staticmethod
-    def get_or_set(cache_key, data_func, timeout=3600):
+    def get_or_set(cache_key, data_func, timeout=3600, **policy):
         """
-        Get data from cache or set it if not present
+        Get data from cache or set it if not present, with the single-flight
+        and early refresh protection of products.utils.cache.get_or_set_cache
         
         Args:
             cache_key: Key to store/retrieve cache data
             data_func: Callable that returns the data if not in cache
             timeout: Cache timeout in seconds
+            **policy: StampedePolicy overrides for this key
             
         Returns:
             The cached or newly generated data
         """
+        computed = {}
+
+        def compute():
+            # Callers get the original data; the cache gets a cleaned copy
+            data = computed['data'] = data_func()
+            cacheable = CacheHandler._cacheable(data)
+            return UNCACHEABLE if cacheable is None and data is not None else cacheable
+
         try:
-            data = cache.get(cache_key)
-            
-            if data is None:
-                data = data_func()
-                if data:
-                    # Make a copy to avoid modifying the original
-                    cacheable_data = copy.copy(data)
-                    
-                    # Remove non-serializable items
-                    if isinstance(cacheable_data, dict):
-                        # Remove request object and other non-serializable items
-                        cacheable_data.pop('request', None)
-                        cacheable_data.pop('view', None)
-                        
-                        # Handle form instances
-                        form_keys = [k for k in cacheable_data.keys() if 'form' in k.lower()]
-                        for key in form_keys:
-                            if hasattr(cacheable_data[key], 'initial'):
-                                cacheable_data[key] = cacheable_data[key].initial
-                        
-                        # Handle model instances by converting to dict
-                        for key, value in cacheable_data.items():
-                            if hasattr(value, '_meta'):  # Django model instance
-                                cacheable_data[key] = {
-                                    'id': value.id,
-                                    'str': str(value)
-                                }
-                    
-                    # Try to cache the cleaned data
-                    try:
-                        # Verify data is serializable
-                        json.dumps(cacheable_data, cls=DjangoJSONEncoder)
-                        cache.set(cache_key, cacheable_data, timeout)
-                    except (TypeError, ValueError) as e:
-                        logger.warning(f"Could not serialize cache data: {str(e)}")
-                        
-                return data
-            
-            return data
+            cached = get_or_set_cache(cache_key, compute, timeout=timeout, **policy)
+            return computed['data'] if 'data' in computed else cached
             
         except Exception as e:
             logger.error(f"Cache error for key {cache_key}: {str(e)}")
@@ -84,22 +59,47 @@ class CacheHandler:
             return data_func()
 
     @staticmethod
-    def check_rate_limit(user_id, action, limit=10, period=60):
-        """Check rate limit for an action"""
-        cache_key = CacheKeyBuilder.rate_limit(user_id, action)
-        try:
-            if cache.get(cache_key) is None:
-                cache.set(cache_key, 0, period)
+    def _cacheable(data):
+        """Serializable copy of data for caching, or None if it cannot be cached"""
+        if not data:
+            # None and empty results are cached as they are
+            return data
+
+        # Make a copy to avoid modifying the original
+        cacheable_data = copy.copy(data)
+        
+        # Remove non-serializable items
+        if isinstance(cacheable_data, dict):
+            # Remove request object and other non-serializable items
+            cacheable_data.pop('request', None)
+            cacheable_data.pop('view', None)
             
-            current = cache.get(cache_key, 0)
-            if current >= limit:
-                return False
-                
-            cache.incr(cache_key, 1)
-            return True
-        except Exception as e:
-            logger.error(f"Rate limiting error: {e}")
-            return True  # Fail open if cache is down
+            # Handle form instances
+            form_keys = [k for k in cacheable_data.keys() if 'form' in k.lower()]
+            for key in form_keys:
+                if hasattr(cacheable_data[key], 'initial'):
+                    cacheable_data[key] = cacheable_data[key].initial
+            
+            # Handle model instances by converting to dict
+            for key, value in cacheable_data.items():
+                if hasattr(value, '_meta'):  # Django model instance
+                    cacheable_data[key] = {
+                        'id': value.id,
+                        'str': str(value)
+                    }
+        
+        # Verify data is serializable
+        try:
+            json.dumps(cacheable_data, cls=DjangoJSONEncoder)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Could not serialize cache data: {str(e)}")
+            return None
+        return cacheable_data
+
+    @staticmethod
+    def check_rate_limit(user_id, action='request', limit=10, period=60, algorithm=SLIDING_WINDOW):
+        """Check rate limit for an action"""
+        return bool(check_rate_limit(action, user_id, limit, period, algorithm))
 
     @staticmethod
     def invalidate_user_caches(user_id):
@@ -0,0 +1,257 @@
+"""
+Shared rate limiting for views, services and middleware.
+
+Every decision is a single atomic operation: a Lua script on Redis (one
+round trip, so concurrent requests cannot slip past the limit between a
+read and a write), or a locked in-process update when Redis is not the
+cache backend or is unreachable. The in-process fallback only limits per
+worker process, which is acceptable for local runs and short outages.
+"""
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BUCKET = 'token_bucket'
+SLIDING_WINDOW = 'sliding_window'
+
+# KEYS[1] bucket hash; ARGV capacity, refill per second, cost, ttl ms
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2]) / 1000
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', string.format('%.0f', now))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {allowed, tostring(tokens), retry_after}
+"""
+
+# KEYS[1] window hash; ARGV limit, window ms, cost
+SLIDING_WINDOW_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local current_start = now - (now % window)
+local current_field = string.format('%.0f', current_start)
+local previous_field = string.format('%.0f', current_start - window)
+local counts = redis.call('HMGET', KEYS[1], current_field, previous_field)
+local current = tonumber(counts[1]) or 0
+local previous = tonumber(counts[2]) or 0
+local elapsed = now - current_start
+local estimated = previous * (window - elapsed) / window + current
+if estimated + cost > limit then
+    local retry_after = window - elapsed
+    if current + cost <= limit and previous > 0 then
+        retry_after = math.ceil(window * (1 - (limit - cost - current) / previous) - elapsed)
+    end
+    return {0, tostring(limit - estimated), math.max(retry_after, 1)}
+end
+redis.call('HINCRBY', KEYS[1], current_field, cost)
+for _, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if field ~= current_field and field ~= previous_field then
+        redis.call('HDEL', KEYS[1], field)
+    end
+end
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, tostring(limit - estimated - cost), 0}
+"""
+
+
+class RateLimitResult:
+    """Outcome of one check; truthy when the action is allowed"""
+    __slots__ = ('allowed', 'remaining', 'retry_after')
+
+    def __init__(self, allowed, remaining, retry_after):
+        self.allowed = allowed
+        self.remaining = remaining
+        # Seconds until the action would be allowed again
+        self.retry_after = retry_after
+
+    def __bool__(self):
+        return self.allowed
+
+    def __repr__(self):
+        return f"RateLimitResult(allowed={self.allowed}, remaining={self.remaining}, retry_after={self.retry_after})"
+
+
+class LocalBackend:
+    """
+    In-process mirror of the Redis scripts, used as the fallback. Holds at
+    most MAX_KEYS identities; past that the least recently used is dropped,
+    which starts it afresh if it comes back.
+    """
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = OrderedDict()
+
+    @staticmethod
+    def _now_ms():
+        return time.monotonic() * 1000
+
+    def _store(self, key, expires, state):
+        self._state[key] = (expires, state)
+        self._state.move_to_end(key)
+        while len(self._state) > self.MAX_KEYS:
+            self._state.popitem(last=False)
+
+    def token_bucket(self, key, capacity, refill_per_second, cost, ttl_ms):
+        rate = refill_per_second / 1000
+        with self._lock:
+            now = self._now_ms()
+            expires, state = self._state.get(key, (0, None))
+            if state is None or expires <= now:
+                tokens, ts = capacity, now
+            else:
+                tokens, ts = state
+            tokens = min(capacity, tokens + max(0, now - ts) * rate)
+            allowed = tokens >= cost
+            retry_after = 0 if allowed else math.ceil((cost - tokens) / rate)
+            if allowed:
+                tokens -= cost
+            self._store(key, now + ttl_ms, (tokens, now))
+        return allowed, tokens, retry_after
+
+    def sliding_window(self, key, limit, window_ms, cost):
+        with self._lock:
+            now = self._now_ms()
+            current_start = now - (now % window_ms)
+            expires, counts = self._state.get(key, (0, None))
+            if counts is None or expires <= now:
+                counts = {}
+            current = counts.get(current_start, 0)
+            previous = counts.get(current_start - window_ms, 0)
+            elapsed = now - current_start
+            estimated = previous * (window_ms - elapsed) / window_ms + current
+            if estimated + cost > limit:
+                retry_after = window_ms - elapsed
+                if current + cost <= limit and previous > 0:
+                    retry_after = math.ceil(window_ms * (1 - (limit - cost - current) / previous) - elapsed)
+                if key in self._state:
+                    self._state.move_to_end(key)  # Denied keys are in use too
+                return False, limit - estimated, max(retry_after, 1)
+            self._store(key, now + window_ms * 2, {
+                current_start: current + cost,
+                current_start - window_ms: previous,
+            })
+        return True, limit - estimated - cost, 0
+
+
+class RedisBackend:
+    """Runs the Lua scripts through django-redis's client"""
+
+    def __init__(self, client):
+        self._token_bucket = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._sliding_window = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def token_bucket(self, key, capacity, refill_per_second, cost, ttl_ms):
+        allowed, tokens, retry_after = self._token_bucket(keys=[key], args=[capacity, refill_per_second, cost, ttl_ms])
+        return bool(allowed), float(tokens), int(retry_after)
+
+    def sliding_window(self, key, limit, window_ms, cost):
+        allowed, remaining, retry_after = self._sliding_window(keys=[key], args=[limit, window_ms, cost])
+        return bool(allowed), float(remaining), int(retry_after)
+
+
+_local_backend = LocalBackend()
+_redis_backend = None
+_redis_down_until = 0.0
+_backend_lock = threading.Lock()
+
+
+def get_redis_backend():
+    """The Redis backend when the default cache is django-redis, else None"""
+    global _redis_backend
+    if _redis_backend is not None:
+        return _redis_backend
+    if not type(cache).__module__.startswith('django_redis'):
+        return None
+    try:
+        from django_redis import get_redis_connection
+    except ImportError:
+        return None
+    with _backend_lock:
+        if _redis_backend is None:
+            _redis_backend = RedisBackend(get_redis_connection('default'))
+    return _redis_backend
+
+def _run(algorithm, key, *args):
+    global _redis_down_until
+    backend = None
+    if time.monotonic() >= _redis_down_until:
+        backend = get_redis_backend()
+    if backend is not None:
+        try:
+            return getattr(backend, algorithm)(key, *args)
+        except Exception as e:
+            # Serve from memory for a while instead of failing every request
+            _redis_down_until = time.monotonic() + getattr(settings, 'RATE_LIMIT_FALLBACK_SECONDS', 30)
+            logger.warning(f"Rate limiter falling back to local state: {e}")
+    return getattr(_local_backend, algorithm)(key, *args)
+
+
+class RateLimiter:
+    """
+    A named limit of `limit` actions per `period` seconds per identity.
+
+    sliding_window weighs the previous fixed window by how much of it still
+    overlaps the sliding one, so there is no burst at window edges;
+    token_bucket allows bursts of up to `burst` (default `limit`) actions
+    and refills at limit/period per second.
+    """
+
+    def __init__(self, scope, limit, period=60, algorithm=SLIDING_WINDOW, burst=None):
+        if algorithm not in (TOKEN_BUCKET, SLIDING_WINDOW):
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        self.scope = scope
+        self.limit = limit
+        self.period = period
+        self.algorithm = algorithm
+        self.burst = burst or limit
+
+    def key(self, identity):
+        return cache.make_key(f'ratelimit:{self.algorithm}:{self.scope}:{identity}')
+
+    def hit(self, identity, cost=1):
+        """Record an action for identity if the limit allows it"""
+        key = self.key(identity)
+        if self.algorithm == TOKEN_BUCKET:
+            refill_per_second = self.limit / self.period
+            # Once the bucket would be full again its state can be dropped
+            ttl_ms = math.ceil(self.burst / refill_per_second * 1000)
+            allowed, remaining, retry_after_ms = _run(
+                TOKEN_BUCKET, key, self.burst, refill_per_second, cost, ttl_ms
+            )
+        else:
+            allowed, remaining, retry_after_ms = _run(SLIDING_WINDOW, key, self.limit, int(self.period * 1000), cost)
+        return RateLimitResult(allowed, max(0, int(remaining)), math.ceil(retry_after_ms / 1000))
+
+
+def check_rate_limit(scope, identity, limit, period=60, algorithm=SLIDING_WINDOW, cost=1):
+    """Shortcut for RateLimiter(scope, limit, period, algorithm).hit(identity)"""
+    return RateLimiter(scope, limit, period, algorithm).hit(identity, cost)
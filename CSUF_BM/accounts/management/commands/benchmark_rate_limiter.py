@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from accounts.cache.ratelimit import SLIDING_WINDOW, TOKEN_BUCKET, LocalBackend, get_redis_backend
+import statistics
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    help = 'Measure per-check latency of the rate limiter for each algorithm and backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=10000)
+        parser.add_argument('--identities', type=int, default=100)
+
+    def handle(self, *args, **options):
+        backends = [('local', LocalBackend())]
+        redis_backend = get_redis_backend()
+        if redis_backend is not None:
+            backends.append(('redis', redis_backend))
+        else:
+            self.stdout.write('Default cache is not django-redis; measuring the local backend only')
+
+        run_id = uuid.uuid4().hex[:8]
+        for name, backend in backends:
+            for algorithm in (TOKEN_BUCKET, SLIDING_WINDOW):
+                timings = self._measure(backend, algorithm, run_id, options['checks'], options['identities'])
+                timings.sort()
+                self.stdout.write(self.style.SUCCESS(
+                    f'{name:<6} {algorithm:<15} mean {statistics.fmean(timings):8.1f}us  '
+                    f'p50 {timings[len(timings) // 2]:8.1f}us  '
+                    f'p99 {timings[int(len(timings) * 0.99)]:8.1f}us'
+                ))
+
+    @staticmethod
+    def _measure(backend, algorithm, run_id, checks, identities):
+        timings = []
+        check = getattr(backend, algorithm)
+        for i in range(checks):
+            key = f'ratelimit:benchmark:{run_id}:{algorithm}:{i % identities}'
+            args = (1000, 1000 / 60, 1, 60000) if algorithm == TOKEN_BUCKET else (1000, 60000, 1)
+            start = time.perf_counter_ns()
+            check(key, *args)
+            timings.append((time.perf_counter_ns() - start) / 1000)
+        return timings
@@ -4,26 +4,33 @@ import time
 import logging
 from django.http import JsonResponse
 from .cache.handlers import CacheHandler
+from .cache.ratelimit import TOKEN_BUCKET, RateLimiter
 from .cache.keys import CacheKeyBuilder
 
 logger = logging.getLogger(__name__)
 
 
 class RequestRateLimitMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Token bucket: short bursts are fine as long as the minute average holds
+        self.limiter = RateLimiter(
+            'request',
+            limit=getattr(settings, 'MAX_REQUESTS_PER_MINUTE', 120),
+            period=60,
+            algorithm=TOKEN_BUCKET
+        )
+
     def __call__(self, request):
         if request.user.is_authenticated:
-            if not CacheHandler.check_rate_limit(
-                request.user.id, 
-                limit=settings.MAX_REQUESTS_PER_MINUTE,
-                period=60
-            ):
-                return JsonResponse({
+            result = self.limiter.hit(request.user.id)
+            if not result:
+                response = JsonResponse({
                     'error': 'Too many requests. Please try again later.'
                 }, status=429)
-            response = self.get_response(request)
-        else:
-            response = self.get_response(request)
-        return response
+                response['Retry-After'] = str(result.retry_after)
+                return response
+        return self.get_response(request)
 
 class ResponseTimeMiddleware:
     def __init__(self, get_response):
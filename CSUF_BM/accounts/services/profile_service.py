@@ -1,12 +1,12 @@
 from django.db import transaction
 from django.core.exceptions import ValidationError
-from django.core.cache import cache
 from django.core.files.storage import default_storage
 from PIL import Image
 from pathlib import Path
 import uuid
 import logging
 from ..models import UserProfile, Address
+from ..cache.ratelimit import check_rate_limit
 
 logger = logging.getLogger(__name__)
 
@@ -101,21 +101,7 @@ class ProfileService:
     @staticmethod
     def rate_limit_uploads(user_id, limit=10, period=60):
         """Rate limit uploads per user"""
-        cache_key = f"profile_upload_{user_id}"
-        try:
-            # Initialize the cache key if it doesn't exist
-            if cache.get(cache_key) is None:
-                cache.set(cache_key, 0, period)
-            
-            current = cache.get(cache_key, 0)
-            if current >= limit:
-                return False
-                
-            cache.incr(cache_key, 1)
-            return True
-        except Exception as e:
-            logger.error(f"Rate limiting error: {e}")
-            return True  # Fail open if cache is down
+        return bool(check_rate_limit('profile_upload', user_id, limit, period))
 
     @staticmethod
     def _get_or_create_profile(user):
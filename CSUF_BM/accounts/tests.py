@@ -1,3 +1,107 @@
-from django.test import TestCase
+from unittest import mock
+import threading
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from .cache import ratelimit
+from .cache.handlers import CacheHandler
+from .cache.ratelimit import SLIDING_WINDOW, TOKEN_BUCKET, LocalBackend, RateLimiter
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = LocalBackend()
+        self.now = 10_000.0
+        patches = [
+            mock.patch.object(ratelimit, '_local_backend', self.backend),
+            mock.patch.object(ratelimit, 'get_redis_backend', return_value=None),
+            mock.patch.object(LocalBackend, '_now_ms', side_effect=lambda: self.now),
+            mock.patch.object(ratelimit, '_redis_down_until', 0.0),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_sliding_window_weighs_previous_window(self):
+        limiter = RateLimiter('test', limit=3, period=1, algorithm=SLIDING_WINDOW)
+        self.assertEqual([bool(limiter.hit('u1')) for _ in range(4)], [True, True, True, False])
+
+        # Halfway into the next window the previous one still counts for 1.5
+        self.now += 1500
+        self.assertTrue(limiter.hit('u1'))
+        denied = limiter.hit('u1')
+        self.assertFalse(denied)
+        self.assertEqual(denied.retry_after, 1)
+        self.assertTrue(limiter.hit('u2'))
+
+    def test_token_bucket_allows_burst_then_refills(self):
+        limiter = RateLimiter('test', limit=1, period=1, algorithm=TOKEN_BUCKET, burst=2)
+        self.assertTrue(limiter.hit('u1'))
+        self.assertTrue(limiter.hit('u1'))
+        denied = limiter.hit('u1')
+        self.assertFalse(denied)
+        self.assertEqual(denied.retry_after, 1)
+
+        self.now += 1000
+        self.assertTrue(limiter.hit('u1'))
+        self.assertFalse(limiter.hit('u1'))
+
+    def test_concurrent_hits_never_exceed_limit(self):
+        limiter = RateLimiter('test', limit=50, period=60)
+        allowed = []
+
+        def worker():
+            for _ in range(10):
+                if limiter.hit('shared'):
+                    allowed.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(allowed), 50)
+
+    def test_falls_back_to_local_state_when_redis_fails(self):
+        redis_backend = mock.Mock()
+        redis_backend.sliding_window.side_effect = ConnectionError('down')
+        limiter = RateLimiter('test', limit=1, period=60)
+        with mock.patch.object(ratelimit, 'get_redis_backend', return_value=redis_backend):
+            self.assertTrue(limiter.hit('u1'))
+            self.assertFalse(limiter.hit('u1'))
+        # The failed backend is skipped until the fallback period ends
+        self.assertEqual(redis_backend.sliding_window.call_count, 1)
+
+    def test_local_state_is_capped_to_recent_keys(self):
+        self.backend.MAX_KEYS = 3
+        limiter = RateLimiter('test', limit=1, period=60)
+        self.assertTrue(limiter.hit('kept'))
+        for identity in ('a', 'b', 'kept', 'c', 'd'):
+            limiter.hit(identity)
+        self.assertEqual(len(self.backend._state), 3)
+        # Recently used keys survive a flood within their window
+        self.assertFalse(limiter.hit('kept'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheHandlerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_empty_results_are_cached(self):
+        calls = []
+        for _ in range(2):
+            self.assertEqual(CacheHandler.get_or_set('orders', lambda: calls.append(1) or []), [])
+        self.assertEqual(len(calls), 1)
+
+    def test_unserializable_results_are_not_cached(self):
+        calls = []
+
+        def data():
+            calls.append(1)
+            return {'handle': object()}
+
+        for _ in range(2):
+            self.assertIn('handle', CacheHandler.get_or_set('profile', data))
+        self.assertEqual(len(calls), 2)
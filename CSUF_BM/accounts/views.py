@@ -57,6 +57,7 @@ from .models.student import Student
 from .models.profile import UserProfile
 from .services.account_service import AccountCreationService, AccountService, UserCreationService, StudentCreationService
 from .constants import Messages
+from cart.holds import StockHolds
 from cart.models import Cart
 from checkout.models import Order
 from .decorators import (
@@ -68,6 +69,7 @@ from .services.account_service import AccountService
 from .cache.handlers import CacheHandler
 from .cache.keys import CacheKeyBuilder
 from .mixins import UserTypeMixin, RateLimitMixin, CacheMixin
+from .cache.ratelimit import check_rate_limit
 from typing import Optional, Dict, Any
 
 
@@ -91,15 +93,6 @@ class RequestLoggingMiddleware:
         
         return response
 
-# 10/25 to prevent brute force hack attempts, limit keys passage/reset
-def post(self, request, *args, **kwargs):
-    # Rate limit key based on user and action
-    rate_limit_key = f"admin_action_{request.user.id}"
-    if cache.get(rate_limit_key, 0) >= 100:  # 100 actions per minute
-        raise PermissionDenied("Too many actions. Please wait a minute before attempting again.")
-    cache.incr(rate_limit_key, 1)
-    cache.expire(rate_limit_key, 60)  # Reset after 1 minute
-
 class AuthenticationService(ABC):
     @abstractmethod
     def authenticate(self, email, password):
@@ -325,6 +318,7 @@ class LogoutView(View):
         if 'cart_id' in request.session:
             try:
                 cart = Cart.objects.get(id=request.session['cart_id'])
+                StockHolds.release(cart.id)
                 cart.delete()
             except Cart.DoesNotExist:
                 pass
@@ -1007,22 +1001,9 @@ class AdminDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
         if not (request.user.is_superuser or request.user.is_admin):
             raise PermissionDenied("You don't have permission to perform this action.")
         
-        # Rate limiting with proper initialization
-        rate_limit_key = f"admin_action_{request.user.id}"
-        try:
-            # Get current count or initialize to 0 if not exists
-            current_count = cache.get(rate_limit_key, 0)
-            
-            # Check if limit exceeded
-            if current_count >= 100:
-                raise PermissionDenied("Too many actions. Please wait a minute.")
-            
-            # Increment and set with expiry if not exists
-            cache.set(rate_limit_key, current_count + 1, 60)  # 60 seconds timeout
-            
-        except Exception as e:
-            logger.error(f"Rate limiting error: {e}")
-            # Continue processing if cache fails
+        # 10/25 to prevent brute force hack attempts: 100 actions per minute
+        if not check_rate_limit('admin_action', request.user.id, 100, 60):
+            raise PermissionDenied("Too many actions. Please wait a minute.")
         
         action = request.POST.get('action')
         user_id = request.POST.get('user_id')
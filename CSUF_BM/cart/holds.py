@@ -0,0 +1,134 @@
+"""
+Time-limited stock holds for cart lines.
+
+Adding to a cart moves units from a product's available-to-sell count
+(stock - held_stock) into a CartHold row with one conditional UPDATE, so
+two carts can never hold the same unit. Checkout turns a cart's holds
+into stock decrements (CheckoutService.reserve) and the sweeper gives
+expired holds back in bulk. Unlimited (digital) products are not held.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from products.models import Product
+from .models import CartHold
+
+
+class StockHolds:
+
+    @staticmethod
+    def hold_timeout():
+        return timedelta(seconds=getattr(settings, 'CART_HOLD_TIMEOUT', 1800))
+
+    @staticmethod
+    def _take(product_id, wanted):
+        """
+        Move up to wanted units into held_stock. Returns the units taken,
+        or None for unlimited stock. The product row is only read when the
+        full amount is not available.
+        """
+        products = Product.objects.filter(id=product_id)
+        if products.filter(stock__gte=F('held_stock') + wanted).update(held_stock=F('held_stock') + wanted):
+            return wanted
+        row = products.values_list('stock', 'held_stock').first()
+        if row is None:
+            return 0
+        stock, held = row
+        if stock < 0:
+            return None
+        spare = min(wanted, stock - held)
+        if spare > 0 and products.filter(stock__gte=F('held_stock') + spare).update(
+            held_stock=F('held_stock') + spare
+        ):
+            return spare
+        return 0
+
+    @staticmethod
+    def _give_back(product_id, quantity):
+        # Clamped at zero: held_stock is unsigned on MySQL
+        Product.objects.filter(id=product_id).update(held_stock=Case(
+            When(held_stock__gte=quantity, then=F('held_stock') - quantity),
+            default=Value(0),
+        ))
+
+    @staticmethod
+    @transaction.atomic
+    def hold(cart_id, product_id, quantity):
+        """
+        Make the cart's hold on a product cover quantity and restart its
+        timer. Returns the quantity now held, which falls short of
+        quantity when the product cannot cover it. Unlimited products
+        return quantity without holding anything.
+        """
+        expires_at = timezone.now() + StockHolds.hold_timeout()
+        current = CartHold.objects.select_for_update().filter(cart_id=cart_id, product_id=product_id).first()
+        if current is None:
+            current, created = CartHold.objects.get_or_create(
+                cart_id=cart_id, product_id=product_id, defaults={'quantity': 0, 'expires_at': expires_at}
+            )
+            if not created:
+                current = CartHold.objects.select_for_update().get(id=current.id)
+
+        held = current.quantity
+        if quantity > held:
+            taken = StockHolds._take(product_id, quantity - held)
+            if taken is None:
+                current.delete()
+                return quantity
+            held += taken
+        elif quantity < held:
+            StockHolds._give_back(product_id, held - quantity)
+            held = quantity
+
+        if held:
+            current.quantity = held
+            current.expires_at = expires_at
+            current.save(update_fields=['quantity', 'expires_at'])
+        else:
+            current.delete()
+        return held
+
+    @staticmethod
+    def release(cart_id, product_ids=None):
+        """Give back a cart's holds (optionally only for some products)"""
+        holds = CartHold.objects.filter(cart_id=cart_id)
+        if product_ids is not None:
+            holds = holds.filter(product_id__in=product_ids)
+        with transaction.atomic():
+            return StockHolds._release(holds)
+
+    @staticmethod
+    def release_expired(batch_size=500):
+        """
+        Give back holds past their expiry, in batches.
+
+        Returns the number of holds released.
+        """
+        released = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    CartHold.objects.select_for_update(skip_locked=True)
+                    .filter(expires_at__lt=timezone.now())
+                    .values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    return released
+                released += StockHolds._release(CartHold.objects.filter(id__in=ids))
+
+    @staticmethod
+    def _release(holds):
+        """Delete holds and return their units with one UPDATE per product"""
+        rows = list(holds.select_for_update().values_list('id', 'product_id', 'quantity'))
+        if not rows:
+            return 0
+        totals = defaultdict(int)
+        for _, product_id, quantity in rows:
+            totals[product_id] += quantity
+        for product_id in sorted(totals):
+            StockHolds._give_back(product_id, totals[product_id])
+        CartHold.objects.filter(id__in=[row[0] for row in rows]).delete()
+        return len(rows)
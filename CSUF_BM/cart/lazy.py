@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.core import signing
+from django.utils.functional import SimpleLazyObject
+from decimal import Decimal
+from .models import CartSummary, TAX_RATE
+
+CART_COOKIE_NAME = 'cart_summary'
+CART_COOKIE_SALT = 'cart.summary'
+
+
+class EmptyItems:
+    """Stands in for cart.items on a cart that has no database row yet"""
+
+    def all(self):
+        return []
+
+    def count(self):
+        return 0
+
+    def exists(self):
+        return False
+
+
+class EmptyCart:
+    """
+    Read-only cart returned to requests that have never written to a cart.
+    Costs zero queries and behaves like an empty Cart in templates.
+    """
+    id = None
+    pk = None
+    user = None
+    session_key = None
+    items = EmptyItems()
+    tax_rate = TAX_RATE
+    summary = CartSummary()
+
+    def __bool__(self):
+        return False
+
+    def refresh_summary(self):
+        pass
+
+    @property
+    def cart_total(self):
+        return self.summary.cart_total
+
+    @property
+    def tax(self):
+        return self.summary.tax
+
+    @property
+    def total_with_tax(self):
+        return self.summary.total_with_tax
+
+    @property
+    def item_count(self):
+        return self.summary.item_count
+
+
+class CartSnapshot(EmptyCart):
+    """
+    Totals of a small guest cart restored from the signed summary cookie.
+    Only carries what the cart context processor needs.
+    """
+
+    def __init__(self, cart_id, item_count, cart_total):
+        self.id = self.pk = cart_id
+        self.summary = CartSummary(Decimal(cart_total), item_count)
+
+    def __bool__(self):
+        return True
+
+
+def cookie_summary_enabled():
+    return getattr(settings, 'CART_COOKIE_SUMMARY', False)
+
+
+def read_cart_cookie(request):
+    """Return a CartSnapshot from the signed cookie, or None if absent/stale"""
+    if not cookie_summary_enabled():
+        return None
+    value = request.COOKIES.get(CART_COOKIE_NAME)
+    if not value:
+        return None
+    try:
+        data = signing.loads(value, salt=CART_COOKIE_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('cart_id') != request.session.get('cart_id'):
+        return None
+    return CartSnapshot(data['cart_id'], data['count'], data['total'])
+
+
+def write_cart_cookie(request, response):
+    """Refresh or drop the summary cookie after the guest cart changed"""
+    cart = getattr(request, '_changed_cart', None)
+    if cart is None or not cookie_summary_enabled() or request.user.is_authenticated:
+        return
+    summary = cart.summary
+    max_items = getattr(settings, 'CART_COOKIE_MAX_ITEMS', 20)
+    if summary.line_count > max_items:
+        response.delete_cookie(CART_COOKIE_NAME)
+        return
+    value = signing.dumps({
+        'cart_id': cart.id,
+        'count': summary.item_count,
+        'total': str(summary.cart_total),
+    }, salt=CART_COOKIE_SALT)
+    response.set_cookie(
+        CART_COOKIE_NAME, value,
+        max_age=settings.SESSION_COOKIE_AGE, httponly=True, samesite='Lax',
+    )
+
+
+def mark_cart_changed(request, cart):
+    """Record that the cart was written so the middleware can refresh cookies"""
+    cart.refresh_summary()
+    request.cart = cart
+    request._changed_cart = cart
+
+
+def lazy_cart(request, loader):
+    """Defer the cart lookup until something actually reads request.cart"""
+    return SimpleLazyObject(lambda: loader(request))
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_rename_cart_cart_user_id_e6a21d_idx_cart_cart_user_id_b645f9_idx_and_more'),
+        ('products', '0006_product_held_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('cart', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='holds', to='cart.cart')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_holds', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='cart_cartho_expires_e7038b_idx')],
+                'unique_together': {('cart', 'product')},
+            },
+        ),
+    ]
@@ -1,8 +1,48 @@
 from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils.functional import cached_property
 from products.models import Product
 from decimal import Decimal
 
+TAX_RATE = Decimal('10.0')  # percent
+
+
+class CartSummary:
+    """
+    Totals for one cart, computed from a single aggregate query.
+    """
+    __slots__ = ('cart_total', 'item_count', 'line_count')
+
+    def __init__(self, cart_total=Decimal('0.00'), item_count=0, line_count=0):
+        self.cart_total = cart_total
+        self.item_count = item_count
+        self.line_count = line_count
+
+    @classmethod
+    def for_items(cls, items):
+        """Aggregate sum(price * quantity), sum(quantity) and line count"""
+        totals = items.aggregate(
+            cart_total=Coalesce(
+                Sum(F('product__price') * F('quantity'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+                Decimal('0.00'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            item_count=Coalesce(Sum('quantity'), 0),
+            line_count=Count('id'),
+        )
+        return cls(Decimal(totals['cart_total']).quantize(Decimal('0.01')), totals['item_count'], totals['line_count'])
+
+    @property
+    def tax(self):
+        return (self.cart_total * TAX_RATE / 100).quantize(Decimal('0.01'))
+
+    @property
+    def total_with_tax(self):
+        return self.cart_total + self.tax
+
+
 class Cart(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
     session_key = models.CharField(max_length=40, null=True, blank=True)
@@ -19,25 +59,34 @@ class Cart(models.Model):
             return f"Cart for {self.user.username}"
         return f"Guest Cart {self.session_key}"
 
+    @cached_property
+    def summary(self):
+        """Memoized per cart instance, i.e. once per request"""
+        return CartSummary.for_items(self.items.all())
+
+    def refresh_summary(self):
+        """Drop the memoized summary after the cart's items changed"""
+        self.__dict__.pop('summary', None)
+
     @property
     def cart_total(self):
-        return sum(item.subtotal for item in self.items.all()) 
+        return self.summary.cart_total
 
     @property
     def tax_rate(self):
-        return Decimal('10.0')  # 10% tax rate
+        return TAX_RATE  # 10% tax rate
 
     @property
     def tax(self):
-        return (self.cart_total * Decimal('0.1')).quantize(Decimal('0.01'))
+        return self.summary.tax
 
     @property
     def total_with_tax(self):
-        return self.cart_total + self.tax
+        return self.summary.total_with_tax
 
     @property
     def item_count(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.summary.item_count
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
@@ -60,5 +109,40 @@ class CartItem(models.Model):
         return self.product.price * self.quantity
 
     def update_quantity(self, quantity):
-        self.quantity = max(1, min(quantity, self.product.stock))
-        self.save()
\ No newline at end of file
+        """
+        Hold stock for the new quantity and keep what could be held; the
+        line is deleted when nothing could. Returns the quantity kept, so
+        callers can report a shortfall. The hold's conditional UPDATE does
+        the stock check, so the product itself is never loaded.
+        """
+        from .holds import StockHolds
+        held = StockHolds.hold(self.cart_id, self.product_id, quantity)
+        if not held:
+            self.delete()
+            return 0
+        self.quantity = held
+        self.save()
+        return held
+
+
+class CartHold(models.Model):
+    """
+    Stock held for one cart line until expires_at; the ledger behind
+    Product.held_stock. Rows outlive a deleted cart on purpose (no FK
+    constraint or cascade) so the sweeper can give their units back.
+    """
+    cart = models.ForeignKey(
+        Cart, on_delete=models.DO_NOTHING, db_constraint=False, related_name='holds'
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cart_holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('cart', 'product')
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} for cart {self.cart_id} until {self.expires_at}"
\ No newline at end of file
@@ -1,3 +1,169 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+
+from products.models import Category, Product
+from products.utils.queries import QueryBudgetMixin
+from .holds import StockHolds
+from .models import Cart, CartHold, CartItem
+from .views import cart_context_processor, cart_middleware
+
+
+class LazyCartTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Notebook', slug='notebook', price='4.50', image='photos/products/n.jpg',
+            stock=10, category=category,
+        )
+
+    def _anonymous_request(self):
+        request = self.factory.get('/')
+        request.user = AnonymousUser()
+        SessionMiddleware(lambda r: None).process_request(request)
+        return request
+
+    def test_anonymous_read_needs_no_cart_row(self):
+        request = self._anonymous_request()
+        cart_middleware(lambda r: None)(request)
+
+        with self.assertNumQueries(0):
+            context = cart_context_processor(request)
+
+        self.assertEqual(context['cart_item_count'], 0)
+        self.assertFalse(Cart.objects.exists())
+        self.assertNotIn('cart_id', request.session)
+
+    def test_first_write_materializes_cart(self):
+        self.client.get(reverse('cart_detail'))
+        self.assertFalse(Cart.objects.exists())
+
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 2})
+
+        cart = Cart.objects.get()
+        self.assertEqual(self.client.session['cart_id'], cart.id)
+        self.assertEqual(cart.item_count, 2)
+
+
+class CartSummaryTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Books', slug='books')
+        self.cart = Cart.objects.create()
+
+    def _add_products(self, count):
+        start = Product.objects.count()
+        for i in range(start, start + count):
+            product = Product.objects.create(
+                name=f'Book {i}', slug=f'book-{i}', price='10.00', image='photos/products/b.jpg',
+                stock=10, category=self.category,
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_totals_come_from_one_memoized_query(self):
+        self._add_products(3)
+        cart = Cart.objects.get(id=self.cart.id)
+        request = RequestFactory().get('/')
+        request.cart = cart
+
+        with self.assertNumQueries(1):
+            context = cart_context_processor(request)
+            self.assertEqual(cart.item_count, 6)
+
+        self.assertEqual(context['cart_total'], 60)
+        self.assertEqual(context['cart_tax'], 6)
+        self.assertEqual(context['cart_total_with_tax'], 66)
+
+    def test_cart_detail_query_count_is_constant(self):
+        session = self.client.session
+        session['cart_id'] = self.cart.id
+        session.save()
+
+        def cart_detail_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('cart_detail'))
+            self.assertEqual(response.status_code, 200)
+            return len(ctx)
+
+        self._add_products(1)
+        cart_detail_queries()  # Fill the reference data caches first
+        baseline = cart_detail_queries()
+        CartItem.objects.all().delete()
+        self._add_products(5)
+        self.assertEqual(cart_detail_queries(), baseline)
+
+    def test_cart_pages_stay_within_budget(self):
+        session = self.client.session
+        session['cart_id'] = self.cart.id
+        session.save()
+        self._add_products(5)
+        self.assertQueryBudget('cart_detail', max_repeats=1)
+        self.assertQueryBudget('checkout', max_repeats=1)
+
+
+class StockHoldTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Notebook', slug='notebook', price='4.50', image='photos/products/n.jpg',
+            stock=3, category=category,
+        )
+        self.first, self.second = Cart.objects.create(), Cart.objects.create()
+
+    def _available(self):
+        self.product.refresh_from_db()
+        return self.product.available_stock
+
+    def test_holds_never_exceed_stock(self):
+        self.assertEqual(StockHolds.hold(self.first.id, self.product.id, 2), 2)
+        self.assertEqual(StockHolds.hold(self.second.id, self.product.id, 2), 1)
+        self.assertEqual(self._available(), 0)
+        self.assertEqual(StockHolds.hold(self.first.id, self.product.id, 1), 1)
+        self.assertEqual(self._available(), 1)
+        self.assertEqual(StockHolds.release(self.second.id), 1)
+        self.assertEqual((self._available(), self.product.stock), (2, 3))
+
+    def test_sweeper_returns_expired_holds(self):
+        StockHolds.hold(self.first.id, self.product.id, 2)
+        StockHolds.hold(self.second.id, self.product.id, 1)
+        CartHold.objects.filter(cart=self.first).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(StockHolds.release_expired(), 1)
+        self.assertEqual(self._available(), 2)
+        self.assertEqual(list(CartHold.objects.values_list('cart_id', flat=True)), [self.second.id])
+
+    def test_update_quantity_is_capped_without_loading_the_product(self):
+        StockHolds.hold(self.second.id, self.product.id, 1)
+        item = CartItem.objects.create(cart=self.first, product=self.product, quantity=1)
+        item = CartItem.objects.get(id=item.id)
+        with CaptureQueriesContext(connection) as queries:
+            item.update_quantity(5)
+        self.assertEqual(item.quantity, 2)
+        self.assertFalse(any(query['sql'].startswith('SELECT "products_product"."id"') for query in queries))
+
+    def test_update_quantity_drops_a_line_it_cannot_hold(self):
+        StockHolds.hold(self.second.id, self.product.id, 3)
+        item = CartItem.objects.create(cart=self.first, product=self.product, quantity=1)
+        self.assertEqual(item.update_quantity(2), 0)
+        self.assertFalse(CartItem.objects.filter(id=item.id).exists())
+
+        session = self.client.session
+        session['cart_id'] = self.first.id
+        session.save()
+        item = CartItem.objects.create(cart=self.first, product=self.product, quantity=1)
+        response = self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 2}, follow=True)
+        self.assertFalse(CartItem.objects.filter(id=item.id).exists())
+        self.assertIn('no longer available', ' '.join(str(m) for m in response.context['messages']))
+
+    def test_add_to_cart_takes_a_hold(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 5})
+        cart = Cart.objects.get(id=self.client.session['cart_id'])
+        self.assertEqual(cart.items.get().quantity, 3)
+        self.assertEqual(CartHold.objects.get(cart=cart).quantity, 3)
+        self.client.post(reverse('remove_from_cart', args=[cart.items.get().id]))
+        self.assertEqual(self._available(), 3)
@@ -3,7 +3,11 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 from products.models import Product
+from products.utils.copurchase import bought_together_for_cart
+from products.utils.images import image_sources
+from .holds import StockHolds
 from .models import Cart, CartItem
+from .lazy import EmptyCart, lazy_cart, mark_cart_changed, read_cart_cookie, write_cart_cookie
 
 import logging
 logger = logging.getLogger(__name__)
@@ -15,9 +19,8 @@ def cart_context_processor(request):
     try:
         cart = getattr(request, 'cart', None)
         if cart:
-            cart_items = cart.items.all()
             return {
-                'cart_item_count': sum(item.quantity for item in cart_items),
+                'cart_item_count': cart.item_count,
                 'cart_total': cart.cart_total,
                 'cart_tax': cart.tax,
                 'cart_total_with_tax': cart.total_with_tax,
@@ -34,39 +37,71 @@ def cart_context_processor(request):
     
 def cart_middleware(get_response):
     def middleware(request):
-        # Attach cart to request
-        request.cart = get_or_create_cart(request)
+        # Attach a lazy cart; nothing is queried or created until it is read
+        request.cart = lazy_cart(request, get_request_cart)
         response = get_response(request)
+        write_cart_cookie(request, response)
         return response
     return middleware
 
+def get_cart(request):
+    """
+    Look up the existing cart without creating one or touching the session.
+    Visitors that never wrote to a cart get an EmptyCart and no queries.
+    """
+    try:
+        if request.user.is_authenticated:
+            return Cart.objects.filter(user=request.user).first() or EmptyCart()
+
+        cart_id = request.session.get('cart_id')
+        if cart_id:
+            return Cart.objects.filter(id=cart_id).first() or EmptyCart()
+
+    except Exception as e:
+        logger.error(f"Error loading cart: {str(e)}")
+
+    return EmptyCart()
+
+def get_request_cart(request):
+    """Resolve request.cart, preferring the signed summary cookie for guests"""
+    if not request.user.is_authenticated:
+        snapshot = read_cart_cookie(request)
+        if snapshot is not None:
+            return snapshot
+    return get_cart(request)
+
 #10/23 updated to reflect changes
 def get_or_create_cart(request):
     """
-    Get existing cart or create new one
+    Get existing cart or create new one. Only called on cart writes.
     """
     try:
         if request.user.is_authenticated:
             cart, created = Cart.objects.get_or_create(user=request.user)
             if 'cart_id' in request.session:
                 del request.session['cart_id']
+            request.cart = cart
             return cart
             
         cart_id = request.session.get('cart_id')
         if cart_id:
             try:
-                return Cart.objects.get(id=cart_id)
+                cart = Cart.objects.get(id=cart_id)
+                request.cart = cart
+                return cart
             except Cart.DoesNotExist:
                 pass
                 
         cart = Cart.objects.create()
         request.session['cart_id'] = cart.id
+        request.cart = cart
         return cart
         
     except Exception as e:
         logger.error(f"Error creating cart: {str(e)}")
         cart = Cart.objects.create()
         request.session['cart_id'] = cart.id
+        request.cart = cart
         return cart
 
 @require_POST
@@ -75,7 +110,7 @@ def add_to_cart(request, product_id):
     Add product to cart with proper messages
     """
     try:
-        product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.polymorphic().select_related('category'), id=product_id)
         cart = get_or_create_cart(request)
         
         quantity = int(request.POST.get('quantity', 1))
@@ -83,20 +118,20 @@ def add_to_cart(request, product_id):
             messages.error(request, "Please enter a valid quantity.")
             return redirect('product_detail', category_slug=product.category.slug, product_slug=product.slug)
 
-        if not product.is_digital and quantity > product.stock:
-            messages.error(request, f"Sorry, only {product.stock} items available.")
+        # The hold is the stock check: it only grants units no other cart holds
+        in_cart = CartItem.objects.filter(cart=cart, product=product).values_list('quantity', flat=True).first() or 0
+        held = StockHolds.hold(cart.id, product.id, in_cart + quantity)
+        if held <= in_cart:
+            messages.error(request, f"Sorry, no more {product.name} available right now.")
             return redirect('product_detail', category_slug=product.category.slug, product_slug=product.slug)
 
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': 0}
-        )
+        CartItem.objects.update_or_create(cart=cart, product=product, defaults={'quantity': held})
+        mark_cart_changed(request, cart)
 
-        cart_item.quantity += quantity
-        cart_item.save()
-
-        messages.success(request, f"{quantity} {product.name}(s) added to your cart.")
+        if held - in_cart < quantity:
+            messages.warning(request, f"Sorry, only {held - in_cart} {product.name}(s) were available and added to your cart.")
+        else:
+            messages.success(request, f"{quantity} {product.name}(s) added to your cart.")
         
     except Exception as e:
         logger.error(f"Error adding to cart: {str(e)}")
@@ -107,14 +142,21 @@ def add_to_cart(request, product_id):
 def cart_detail(request):
     """View cart with logging"""
     try:
-        cart = request.cart
+        cart = get_cart(request)
+        # Share the instance so the context processor reuses its memoized summary
+        request.cart = cart
+        cart_items = list(cart.items.select_related('product')) if cart else []
         logger.debug(f"Cart detail view - User: {request.user.email if request.user.is_authenticated else 'Guest'}")
         logger.debug(f"Cart ID: {cart.id if cart else 'No cart'}")
-        logger.debug(f"Cart items: {cart.items.count() if cart else 0}")
+        logger.debug(f"Cart items: {len(cart_items)}")
         
+        together = bought_together_for_cart([item.product_id for item in cart_items])
+
         context = {
             'cart': cart,
-            'cart_items': cart.items.all() if cart else [],
+            'cart_items': cart_items,
+            'bought_together': together,
+            'bought_together_images': image_sources([product.image.name for product in together], 'thumbnail'),
         }
         return render(request, 'cart/cart_detail.html', context)
         
@@ -126,19 +168,27 @@ def cart_detail(request):
 @require_POST
 def update_cart(request, item_id):
     cart = get_or_create_cart(request)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    cart_item = get_object_or_404(CartItem.objects.select_related('product'), id=item_id, cart=cart)
     quantity = int(request.POST.get('quantity', 0))
     if quantity > 0:
-        cart_item.update_quantity(quantity)
+        held = cart_item.update_quantity(quantity)
+        if not held:
+            messages.error(request, f"Sorry, {cart_item.product.name} is no longer available and was removed from your cart.")
+        elif held < quantity:
+            messages.warning(request, f"Sorry, only {held} {cart_item.product.name}(s) are available.")
     else:
+        StockHolds.release(cart.id, [cart_item.product_id])
         cart_item.delete()
+    mark_cart_changed(request, cart)
     return redirect('cart_detail')
 
 def remove_from_cart(request, item_id):
-    cart = get_or_create_cart(request)
-    cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
+    cart = get_cart(request)
+    cart_item = get_object_or_404(CartItem, id=item_id, cart_id=cart.id)
     product_name = cart_item.product.name
+    StockHolds.release(cart.id, [cart_item.product_id])
     cart_item.delete()
+    mark_cart_changed(request, cart)
     messages.success(request, f"{product_name} removed from your cart.")
     return redirect('cart_detail')
 
@@ -151,15 +201,21 @@ def merge_carts(request):
             user_cart = get_or_create_cart(request)
             
             if session_cart != user_cart:
+                # The user cart re-holds the merged quantities below
+                StockHolds.release(session_cart.id)
                 for item in session_cart.items.all():
                     user_item, created = CartItem.objects.get_or_create(cart=user_cart, product=item.product)
                     if not created:
                         user_item.quantity += item.quantity
                     else:
                         user_item.quantity = item.quantity
-                    user_item.update_quantity(user_item.quantity)
+                    wanted = user_item.quantity
+                    held = user_item.update_quantity(wanted)
+                    if held < wanted:
+                        messages.warning(request, f"Only {held} of {wanted} {item.product.name}(s) could be kept in your cart.")
                 session_cart.delete()
                 del request.session['cart_id']
+                mark_cart_changed(request, user_cart)
             
             messages.success(request, "Your guest cart has been merged with your account.")
         except Cart.DoesNotExist:
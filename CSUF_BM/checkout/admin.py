@@ -1,3 +1,10 @@
 from django.contrib import admin
+from .models import StockReservation
 
 # Register your models here.
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('order', 'product', 'quantity', 'status', 'expires_at')
+    list_filter = ('status',)
+
+admin.site.register(StockReservation, StockReservationAdmin)
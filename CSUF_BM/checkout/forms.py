@@ -279,4 +279,16 @@ class FakePaymentGateway:
             'amount': order.order_total + order.tax,
             'currency': 'USD',
             'timestamp': datetime.now().isoformat()
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def refund_payment(order, transaction_id):
+        # Return refund details for the captured transaction
+        return {
+            'success': True,
+            'refund_id': f"REFUND_{random.randint(100000, 999999)}",
+            'transaction_id': transaction_id,
+            'amount': order.order_total + order.tax,
+            'currency': 'USD',
+            'timestamp': datetime.now().isoformat()
+        }
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from cart.holds import StockHolds
+from checkout.services.checkout_service import CheckoutService
+
+
+class Command(BaseCommand):
+    help = 'Return stock held by checkouts that never completed payment and by expired cart holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        released = CheckoutService.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservation(s)'))
+        released = StockHolds.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired cart hold(s)'))
@@ -114,4 +114,30 @@ class OrderProduct(models.Model):
     
     #10/23 Added
     def get_total(self):
-        return self.product_price * self.quantity
\ No newline at end of file
+        return self.product_price * self.quantity
+
+class StockReservation(models.Model):
+    """
+    Stock held for an order between the reserve and finalize phases of
+    checkout. Held rows that outlive expires_at are released by the sweeper.
+    """
+    STATUS_CHOICES = (
+        ('HELD', 'Held'),
+        ('COMMITTED', 'Committed'),
+        ('RELEASED', 'Released'),
+    )
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='HELD')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} for {self.order_id} ({self.status})"
@@ -0,0 +1,245 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from accounts.decorators import retry_on_deadlock
+from cart.models import CartHold
+from products.models import Product
+from ..models import Order, OrderProduct, StockReservation
+from ..forms import FakePaymentGateway
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStockError(ValueError):
+    pass
+
+
+class ReservationExpiredError(Exception):
+    pass
+
+
+class RefundFailedError(Exception):
+    pass
+
+
+class CheckoutService:
+    """
+    Two-phase checkout: reserve -> pay -> finalize.
+
+    Stock is taken in a short transaction with conditional UPDATEs, the
+    payment gateway is called with no transaction open, and the order is
+    finalized in a second short transaction. Reservations that are never
+    finalized are returned to stock by release_expired().
+    """
+
+    @staticmethod
+    def reservation_timeout():
+        return timedelta(seconds=getattr(settings, 'CHECKOUT_RESERVATION_TIMEOUT', 900))
+
+    @staticmethod
+    @retry_on_deadlock()
+    @transaction.atomic
+    def reserve(order, cart_items):
+        """
+        Phase 1: persist the pending order and hold stock for every item.
+
+        The cart's holds become stock decrements: each product runs one
+        UPDATE that takes the quantity off stock and the cart's own hold
+        off held_stock, provided the units other carts hold stay covered.
+        Products are updated in id order so concurrent checkouts lock rows
+        consistently. Raises InsufficientStockError and rolls everything
+        back if any product cannot cover its quantity.
+        """
+        order.payment_status = 'PENDING'
+        order.save()
+
+        holds = CartHold.objects.select_for_update().filter(
+            cart_id__in={item.cart_id for item in cart_items},
+            product_id__in=[item.product_id for item in cart_items],
+        )
+        reservations = CheckoutService._take_stock(order, cart_items, dict(holds.values_list('product_id', 'quantity')))
+        holds.delete()
+        return reservations
+
+    @staticmethod
+    @retry_on_deadlock()
+    @transaction.atomic
+    def rereserve(order, cart_items):
+        """
+        Hold stock again for an order whose reservation expired while it
+        was being paid for. Whatever is still held is given back first, so
+        every item is taken afresh. Raises InsufficientStockError, changing
+        nothing, if the stock has gone in the meantime.
+        """
+        reservations = StockReservation.objects.filter(order=order)
+        CheckoutService._release(reservations)
+        reservations.delete()
+        return CheckoutService._take_stock(order, cart_items, {})
+
+    @staticmethod
+    def _take_stock(order, cart_items, held):
+        """Take each item off stock and record its reservation; held maps product ids to the cart's own holds"""
+        expires_at = timezone.now() + CheckoutService.reservation_timeout()
+        reservations = []
+        insufficient_stock_items = []
+
+        for cart_item in sorted(cart_items, key=lambda item: item.product_id):
+            if cart_item.product.stock < 0:
+                continue  # Unlimited stock (digital products)
+
+            own = held.get(cart_item.product_id, 0)
+            # stock + own >= held_stock + qty, written without subtraction
+            # since held_stock is unsigned on MySQL
+            updated = Product.objects.filter(id=cart_item.product_id).alias(
+                covered=F('stock') + own
+            ).filter(
+                covered__gte=F('held_stock') + cart_item.quantity
+            ).update(stock=F('stock') - cart_item.quantity, held_stock=F('held_stock') - own)
+
+            if not updated:
+                insufficient_stock_items.append(cart_item.product.name)
+                continue
+
+            reservations.append(StockReservation(
+                order=order,
+                product_id=cart_item.product_id,
+                quantity=cart_item.quantity,
+                expires_at=expires_at
+            ))
+
+        if insufficient_stock_items:
+            raise InsufficientStockError(f"Insufficient stock for: {', '.join(insufficient_stock_items)}")
+
+        StockReservation.objects.bulk_create(reservations)
+        return reservations
+
+    @staticmethod
+    def pay(order, card_data):
+        """Phase 2: call the gateway while holding no transaction or row locks"""
+        if transaction.get_connection().in_atomic_block:
+            logger.warning(f"Payment for order {order.order_number} is running inside a transaction")
+        return FakePaymentGateway.process_payment(order, card_data)
+
+    @staticmethod
+    @transaction.atomic
+    def finalize(order, cart_items, payment_result, card_data):
+        """
+        Phase 3: commit the held stock and write the order lines.
+
+        Raises ReservationExpiredError if the sweeper released any of the
+        order's holds while the payment was in flight.
+        """
+        reservations = StockReservation.objects.filter(order=order)
+        expected = reservations.count()
+        committed = reservations.filter(status='HELD').update(status='COMMITTED')
+        if committed != expected:
+            raise ReservationExpiredError(f"Stock reservation for order {order.order_number} expired")
+
+        order.payment_status = 'PAID'
+        order.is_ordered = True
+        order.transaction_id = payment_result['transaction_id']
+        order.payment_method = f"{card_data['card_type'].upper()} **** **** **** {card_data['card_number'][-4:]}"
+        order.last_four = card_data['card_number'][-4:]
+        order.save()
+
+        OrderProduct.objects.bulk_create([
+            OrderProduct(
+                order=order,
+                product_id=cart_item.product_id,
+                quantity=cart_item.quantity,
+                product_price=cart_item.product.price,
+                ordered=True
+            )
+            for cart_item in cart_items
+        ])
+        return order
+
+    @staticmethod
+    def recover(order, cart_items, payment_result, card_data):
+        """
+        Complete a paid order whose reservation expired before finalize().
+
+        Stock is reserved again and the order finalized; if the stock is
+        gone, the payment is refunded instead. Returns True when the order
+        went through and False when it was refunded.
+        """
+        try:
+            CheckoutService.rereserve(order, cart_items)
+            CheckoutService.finalize(order, cart_items, payment_result, card_data)
+            return True
+        except (InsufficientStockError, ReservationExpiredError):
+            CheckoutService.refund(order, payment_result)
+            return False
+
+    @staticmethod
+    def refund(order, payment_result):
+        """
+        Refund a captured payment for an order that cannot be fulfilled.
+
+        The transaction id is saved and the order's stock released before
+        the gateway is called, so a failed refund (RefundFailedError) leaves
+        a PAID, unordered order that can be reconciled by hand.
+        """
+        transaction_id = payment_result['transaction_id']
+        with transaction.atomic():
+            CheckoutService._release(StockReservation.objects.filter(order=order))
+            Order.objects.filter(id=order.id).update(payment_status='PAID', transaction_id=transaction_id)
+        order.payment_status, order.transaction_id = 'PAID', transaction_id
+
+        try:
+            refund = FakePaymentGateway.refund_payment(order, transaction_id)
+        except Exception as e:
+            refund = {'success': False, 'error': str(e)}
+        if not refund['success']:
+            logger.error(f"Refund of {transaction_id} for order {order.order_number} failed: {refund.get('error')}")
+            raise RefundFailedError(
+                f"Your checkout session expired and we could not refund your payment automatically. "
+                f"Please contact us quoting order {order.order_number}."
+            )
+
+        Order.objects.filter(id=order.id).update(payment_status='REFUNDED')
+        order.payment_status = 'REFUNDED'
+
+    @staticmethod
+    def release(order, payment_status='FAILED'):
+        """Return an unpaid order's held stock and mark its payment status"""
+        with transaction.atomic():
+            CheckoutService._release(StockReservation.objects.filter(order=order))
+            Order.objects.filter(id=order.id).update(payment_status=payment_status)
+        order.payment_status = payment_status
+
+    @staticmethod
+    def release_expired(batch_size=500):
+        """
+        Release held reservations past their expiry, in batches.
+
+        Returns the number of reservations released.
+        """
+        released = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    StockReservation.objects.select_for_update(skip_locked=True)
+                    .filter(status='HELD', expires_at__lt=timezone.now())
+                    .values_list('id', flat=True)[:batch_size]
+                )
+                if not ids:
+                    return released
+                order_ids = set(
+                    StockReservation.objects.filter(id__in=ids).values_list('order_id', flat=True)
+                )
+                released += CheckoutService._release(StockReservation.objects.filter(id__in=ids))
+                Order.objects.filter(id__in=order_ids, payment_status='PENDING').update(payment_status='FAILED')
+
+    @staticmethod
+    def _release(reservations):
+        """Give held quantities back to stock with one UPDATE per product"""
+        ids = list(reservations.select_for_update().filter(status='HELD').values_list('id', flat=True))
+        held = StockReservation.objects.filter(id__in=ids)
+        totals = held.values('product_id').annotate(total=Sum('quantity')).order_by('product_id')
+        for row in totals:
+            Product.objects.filter(id=row['product_id']).update(stock=F('stock') + row['total'])
+        return held.update(status='RELEASED')
@@ -1,3 +1,145 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cart.holds import StockHolds
+from cart.models import Cart, CartHold, CartItem
+from products.models import Category, Product
+from .models import Order, OrderProduct, StockReservation
+from .services.checkout_service import (
+    CheckoutService, InsufficientStockError, RefundFailedError, ReservationExpiredError,
+)
+
+CARD_DATA = {'card_type': 'visa', 'card_number': '4111111111111111'}
+PAYMENT = {'success': True, 'transaction_id': 'TRANS_1'}
+GATEWAY = 'checkout.services.checkout_service.FakePaymentGateway'
+
+
+class TwoPhaseCheckoutTests(TransactionTestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Notebook', slug='notebook', price='5.00', image='photos/products/n.jpg',
+            stock=3, category=category,
+        )
+        self.cart = Cart.objects.create()
+
+    def _order(self):
+        return Order(
+            order_number=f'T{Order.objects.count()}', first_name='A', last_name='B', email='a@b.com',
+            phone='1234567890', address_line_1='1 St', city='Fullerton', state='CA', country='US',
+            zipcode='92831', order_total='10.00', tax='1.00',
+        )
+
+    def _cart_items(self, quantity):
+        CartItem.objects.update_or_create(cart=self.cart, product=self.product, defaults={'quantity': quantity})
+        return list(CartItem.objects.filter(cart=self.cart).select_related('product'))
+
+    def test_reserve_pay_finalize(self):
+        order = self._order()
+        cart_items = self._cart_items(2)
+        CheckoutService.reserve(order, cart_items)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 1)
+
+        def fake_gateway(order, card_data):
+            self.assertFalse(transaction.get_connection().in_atomic_block)
+            return {'success': True, 'transaction_id': 'TRANS_1'}
+
+        with mock.patch('checkout.services.checkout_service.FakePaymentGateway.process_payment', fake_gateway):
+            result = CheckoutService.pay(order, CARD_DATA)
+        CheckoutService.finalize(order, cart_items, result, CARD_DATA)
+
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, 'PAID')
+        self.assertEqual(OrderProduct.objects.get(order=order).quantity, 2)
+        self.assertEqual(StockReservation.objects.get(order=order).status, 'COMMITTED')
+
+    def test_insufficient_stock_rolls_back(self):
+        order = self._order()
+        with self.assertRaises(InsufficientStockError):
+            CheckoutService.reserve(order, self._cart_items(5))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_reservations_are_released(self):
+        order = self._order()
+        CheckoutService.reserve(order, self._cart_items(2))
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(CheckoutService.release_expired(), 1)
+        self.product.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(order.payment_status, 'FAILED')
+
+    def test_reserve_converts_cart_holds(self):
+        other_cart = Cart.objects.create()
+        StockHolds.hold(other_cart.id, self.product.id, 1)
+        StockHolds.hold(self.cart.id, self.product.id, 2)
+        cart_items = self._cart_items(2)
+
+        with CaptureQueriesContext(connection) as queries:
+            CheckoutService.reserve(self._order(), cart_items)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.held_stock), (1, 1))
+        self.assertEqual(list(CartHold.objects.values_list('cart_id', flat=True)), [other_cart.id])
+        # Stock is only ever written with conditional UPDATEs, never read
+        reads = [query for query in queries if query['sql'].startswith('SELECT') and 'products_product' in query['sql']]
+        self.assertEqual(reads, [])
+
+    def test_other_carts_holds_are_not_sold(self):
+        StockHolds.hold(Cart.objects.create().id, self.product.id, 2)
+        with self.assertRaises(InsufficientStockError):
+            CheckoutService.reserve(self._order(), self._cart_items(2))
+
+    def _expired_after_payment(self, quantity):
+        """An order reserved and paid for whose reservation the sweeper released before finalize()"""
+        order = self._order()
+        cart_items = self._cart_items(quantity)
+        CheckoutService.reserve(order, cart_items)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        CheckoutService.release_expired()
+        with self.assertRaises(ReservationExpiredError):
+            CheckoutService.finalize(order, cart_items, PAYMENT, CARD_DATA)
+        return order, cart_items
+
+    def test_expired_reservation_is_taken_again_after_payment(self):
+        order, cart_items = self._expired_after_payment(2)
+        with mock.patch(f'{GATEWAY}.refund_payment') as refund:
+            self.assertTrue(CheckoutService.recover(order, cart_items, PAYMENT, CARD_DATA))
+        refund.assert_not_called()
+
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((order.payment_status, order.is_ordered, order.transaction_id), ('PAID', True, 'TRANS_1'))
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(list(StockReservation.objects.values_list('status', flat=True)), ['COMMITTED'])
+
+    def test_payment_is_refunded_when_the_stock_is_gone(self):
+        order, cart_items = self._expired_after_payment(2)
+        Product.objects.filter(id=self.product.id).update(stock=1)  # Sold meanwhile
+        with mock.patch(f'{GATEWAY}.refund_payment', return_value={'success': True}) as refund:
+            self.assertFalse(CheckoutService.recover(order, cart_items, PAYMENT, CARD_DATA))
+        refund.assert_called_once_with(order, 'TRANS_1')
+
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((order.payment_status, order.is_ordered, order.transaction_id), ('REFUNDED', False, 'TRANS_1'))
+        self.assertEqual(self.product.stock, 1)
+        self.assertFalse(OrderProduct.objects.exists())
+
+    def test_failed_refund_leaves_a_paid_order_to_reconcile(self):
+        order, cart_items = self._expired_after_payment(2)
+        Product.objects.filter(id=self.product.id).update(stock=0)
+        with mock.patch(f'{GATEWAY}.refund_payment', return_value={'success': False, 'error': 'declined'}), \
+                self.assertLogs('checkout.services.checkout_service', 'ERROR'):
+            with self.assertRaises(RefundFailedError):
+                CheckoutService.recover(order, cart_items, PAYMENT, CARD_DATA)
+        order.refresh_from_db()
+        self.assertEqual((order.payment_status, order.transaction_id), ('PAID', 'TRANS_1'))
@@ -4,20 +4,18 @@ from django.contrib import messages
 from django.urls import reverse
 from decimal import Decimal
 from accounts.models.address import Address
-from products.models import Product
-from cart.models import Cart, CartItem
+from cart.models import CartItem
+from cart.lazy import mark_cart_changed
+from cart.views import get_cart
 from .models import Order, OrderProduct
-from .forms import OrderForm, GuestOrderForm, CreditCardForm, FakePaymentGateway
+from .forms import OrderForm, GuestOrderForm, CreditCardForm
+from .services.checkout_service import CheckoutService, ReservationExpiredError
 import datetime
 import uuid
 #10/23 added
 from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import csrf_protect
 from django.core.exceptions import PermissionDenied
-from django.db import transaction, DatabaseError
-from time import sleep
-from functools import wraps
-import random
 from django.http import JsonResponse
 from django.template.loader import render_to_string
 
@@ -72,93 +70,14 @@ def get_user_initial_data(user):
     
     return initial_data
 
-# Helper function to get or create cart based on user authentication status
-def get_or_create_cart(request):
-
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        cart_id = request.session.get('cart_id')
-        if cart_id:
-            try:
-                cart = Cart.objects.get(id=cart_id)
-            except Cart.DoesNotExist:
-                cart = Cart.objects.create()
-        else:
-            cart = Cart.objects.create()
-        request.session['cart_id'] = cart.id
-    return cart
-
-# 10/23
-# Decorator to retry a function on deadlock with exponential backoff
-def retry_on_deadlock(max_retries=3, initial_delay=0.1):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            retry_count = 0
-            delay = initial_delay
-            
-            while retry_count < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except DatabaseError as e:
-                    if 'Deadlock found' in str(e) and retry_count < max_retries - 1:
-                        retry_count += 1
-                        # Add random jitter to prevent multiple retries from deadlocking again
-                        sleep_time = delay + (random.random() * 0.1)
-                        sleep(sleep_time)
-                        delay *= 2  # Exponential backoff
-                        continue
-                    raise
-            return func(*args, **kwargs)
-        return wrapper
-    return decorator
-
-# Process order items with optimized locking
-def process_order_items(cart_items, order):
-    insufficient_stock_items = []
-    
-    # First, validate all stock levels
-    products_to_update = []
-    for cart_item in cart_items:
-        product = cart_item.product
-        if cart_item.quantity > product.stock:
-            insufficient_stock_items.append(product.name)
-        else:
-            products_to_update.append((product, cart_item.quantity))
-    
-    if insufficient_stock_items:
-        raise ValueError(f"Insufficient stock for: {', '.join(insufficient_stock_items)}")
-    
-    # Then create order items and update stock in a single transaction
-    order_products = []
-    for product, quantity in products_to_update:
-        order_products.append(
-            OrderProduct(
-                order=order,
-                product=product,
-                quantity=quantity,
-                product_price=product.price,
-                ordered=True
-            )
-        )
-        product.stock -= quantity
-        
-    # Bulk create order products
-    OrderProduct.objects.bulk_create(order_products)
-    
-    # Bulk update products
-    products = [p for p, _ in products_to_update]
-    Product.objects.bulk_update(products, ['stock'])
-
-@retry_on_deadlock()
-@transaction.atomic
 def checkout(request):
     try:
-        cart = get_or_create_cart(request)
-        cart_items = CartItem.objects.filter(cart=cart)
+        cart = get_cart(request)
+        # Share the instance so totals are aggregated once for view and context processor
+        request.cart = cart
+        cart_items = list(CartItem.objects.filter(cart_id=cart.id).select_related('product'))
         
-        if not cart_items.exists():
+        if not cart_items:
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({
                     'success': False,
@@ -182,82 +101,59 @@ def checkout(request):
             payment_form = CreditCardForm(request.POST)
             
             if order_form.is_valid() and payment_form.is_valid():
+                order = order_form.save(commit=False)
+                if request.user.is_authenticated:
+                    order.user = request.user
+                
+                order.order_total = cart.cart_total
+                order.tax = cart.tax
+                order.ip = request.META.get('REMOTE_ADDR')
+                order.order_number = str(uuid.uuid4())[:10].upper()
+                
                 try:
-                    with transaction.atomic():
-                        # Save order
-                        order = order_form.save(commit=False)
-                        if request.user.is_authenticated:
-                            order.user = request.user
-                        
-                        order.order_total = cart.cart_total
-                        order.tax = cart.tax
-                        order.ip = request.META.get('REMOTE_ADDR')
-                        order.order_number = str(uuid.uuid4())[:10].upper()
-                        
-                        # Process payment
-                        payment_gateway = FakePaymentGateway()
-                        payment_result = payment_gateway.process_payment(order, payment_form.cleaned_data)
-                        
-                        if not payment_result['success']:
-                            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                                return JsonResponse({
-                                    'success': False,
-                                    'error': "Payment processing failed"
-                                })
-                            raise ValueError("Payment processing failed")
-                            
-                        # If payment successful, proceed with order creation
-                        order.payment_status = 'PAID'
-                        order.transaction_id = payment_result['transaction_id']
-                        order.payment_method = f"{payment_form.cleaned_data['card_type'].upper()} **** **** **** {payment_form.cleaned_data['card_number'][-4:]}"
-                        order.last_four = payment_form.cleaned_data['card_number'][-4:]
-                        order.save()
-                        
-                        # Validate stock
-                        insufficient_stock_items = []
-                        for cart_item in cart_items:
-                            if cart_item.quantity > cart_item.product.stock:
-                                insufficient_stock_items.append(cart_item.product.name)
-                        
-                        if insufficient_stock_items:
-                            error_msg = f"Insufficient stock for: {', '.join(insufficient_stock_items)}"
-                            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                                return JsonResponse({
-                                    'success': False,
-                                    'error': error_msg
-                                })
-                            raise ValueError(error_msg)
-                        
-                        # Create order products and update stock
-                        for cart_item in cart_items:
-                            OrderProduct.objects.create(
-                                order=order,
-                                product=cart_item.product,
-                                quantity=cart_item.quantity,
-                                product_price=cart_item.product.price,
-                                ordered=True
+                    # Phase 1: hold stock in a short transaction
+                    CheckoutService.reserve(order, cart_items)
+                    
+                    # Phase 2: payment runs outside any transaction
+                    try:
+                        payment_result = CheckoutService.pay(order, payment_form.cleaned_data)
+                    except Exception:
+                        CheckoutService.release(order)
+                        raise
+                    
+                    if not payment_result['success']:
+                        CheckoutService.release(order)
+                        raise ValueError("Payment processing failed")
+                    
+                    # Phase 3: commit held stock and write order lines
+                    try:
+                        CheckoutService.finalize(order, cart_items, payment_result, payment_form.cleaned_data)
+                    except ReservationExpiredError:
+                        # Paid already: hold the stock again, or refund when it is gone
+                        if not CheckoutService.recover(order, cart_items, payment_result, payment_form.cleaned_data):
+                            raise ValueError(
+                                "Your checkout session expired and some items sold out in the meantime. "
+                                "Your payment has been refunded."
                             )
-                            
-                            cart_item.product.stock -= cart_item.quantity
-                            cart_item.product.save()
-                        
-                        # Clear cart
-                        cart_items.delete()
-                        
-                        # Store order number in session
-                        request.session['completed_order'] = order.order_number
-                        
-                        success_url = reverse('order_complete', kwargs={'order_number': order.order_number})
-                        
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            return JsonResponse({
-                                'success': True,
-                                'redirect_url': success_url
-                            })
-                            
-                        messages.success(request, 'Payment successful! Order placed successfully.')
-                        return redirect(success_url)
+                    
+                    # Clear cart
+                    CartItem.objects.filter(cart_id=cart.id).delete()
+                    mark_cart_changed(request, cart)
+                    
+                    # Store order number in session
+                    request.session['completed_order'] = order.order_number
+                    
+                    success_url = reverse('order_complete', kwargs={'order_number': order.order_number})
+                    
+                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                        return JsonResponse({
+                            'success': True,
+                            'redirect_url': success_url
+                        })
                         
+                    messages.success(request, 'Payment successful! Order placed successfully.')
+                    return redirect(success_url)
+                    
                 except (ValueError, Exception) as e:
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         return JsonResponse({
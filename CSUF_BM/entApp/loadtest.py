@@ -0,0 +1,188 @@
+"""
+Scripted user journeys against a running server, for load testing.
+
+The management command (manage.py load_test) picks real product URLs and
+synthetic accounts from the database, then starts worker processes that
+each play one user at a time with the standard library's HTTP client.
+This module stays free of Django imports so spawned workers start fast.
+
+Every request is recorded as (step, status, latency in ms, DB queries);
+the query count comes from the X-DB-Queries header that
+RequestMetricsMiddleware adds when QUERY_COUNT_HEADER is on.
+"""
+from datetime import datetime
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+import random
+import re
+import time
+import urllib.request
+
+JOURNEYS = ('browse', 'shopper', 'member')
+DEFAULT_MIX = {'browse': 6, 'shopper': 3, 'member': 1}
+PERCENTILES = (50, 90, 95, 99)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Redirects are recorded as their own step instead of being followed
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Session:
+    """One simulated browser: cookies, CSRF token and the samples it recorded"""
+
+    def __init__(self, base_url, samples, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.samples = samples
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+
+    def _csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def request(self, step, path, data=None):
+        """GET (or POST when data is given) path, record it and return (status, body)"""
+        headers = {'User-Agent': 'csuf-load-test'}
+        body = None
+        if data is not None:
+            data = {'csrfmiddlewaretoken': self._csrf_token(), **data}
+            body = urlencode(data).encode()
+            headers['Referer'] = self.base_url + path
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                status, content, response_headers = response.status, response.read(), response.headers
+        except HTTPError as e:
+            status, content, response_headers = e.code, e.read(), e.headers
+        except (URLError, OSError):
+            status, content, response_headers = 0, b'', {}
+        latency = (time.perf_counter() - started) * 1000
+        queries = response_headers.get('X-DB-Queries')
+        self.samples.append((step, status, latency, int(queries) if queries is not None else None))
+        return status, content
+
+
+def _browse(session, rng, plan):
+    paths = plan['paths']
+    session.request('store', paths['store'])
+    session.request('store_sorted', f"{paths['store']}?{urlencode({'sort_by': rng.choice(plan['sorts'])})}")
+    if plan['categories']:
+        session.request('store_category', rng.choice(plan['categories']))
+    if plan['departments']:
+        query = urlencode({'department': rng.choice(plan['departments']), 'essential_only': 'on'})
+        session.request('store_filtered', f"{paths['store']}?{query}")
+    for _ in range(2):
+        session.request('product_detail', rng.choice(plan['products'])['url'])
+
+
+def _shopper(session, rng, plan):
+    paths = plan['paths']
+    product = rng.choice(plan['products'])
+    session.request('product_detail', product['url'])
+    session.request('add_to_cart', product['add_url'], {'quantity': 1})
+    status, content = session.request('cart_detail', paths['cart'])
+    # The update form's action carries the cart item id
+    prefix, suffix = paths['update_cart'].split('{id}')
+    item = re.search(re.escape(prefix).encode() + rb'(\d+)' + re.escape(suffix).encode(), content)
+    if item:
+        session.request('update_cart', paths['update_cart'].format(id=int(item.group(1))), {'quantity': 2})
+    session.request('checkout', paths['checkout'])
+    session.request('checkout_submit', paths['checkout'], {
+        'first_name': 'Load', 'last_name': 'Test', 'phone': '+15555550100', 'email': 'load-test@example.edu',
+        'address_line_1': '800 N State College Blvd', 'address_line_2': '', 'country': 'US', 'state': 'CA',
+        'city': 'Fullerton', 'zipcode': '92831', 'use_shipping_address_for_billing': 'on',
+        'card_type': 'visa', 'card_number': '4111111111111111', 'expiry_month': '12',
+        'expiry_year': str(datetime.now().year + 1), 'cvv': '123',
+    })
+
+
+def _member(session, rng, plan):
+    if not plan['users']:
+        return _browse(session, rng, plan)
+    paths = plan['paths']
+    session.request('login_form', paths['login'])
+    session.request('login', paths['login'], {'email': rng.choice(plan['users']), 'password': plan['password']})
+    session.request('dashboard', paths['dashboard'])
+    session.request('store', paths['store'])
+    session.request('product_detail', rng.choice(plan['products'])['url'])
+
+
+STEPS = {'browse': _browse, 'shopper': _shopper, 'member': _member}
+
+
+def run_worker(worker, base_url, plan, mix, duration, journeys, seed):
+    """
+    Play journeys back to back, each as a fresh visitor, until duration
+    seconds pass or journeys have run. Returns (samples, journeys run).
+    Runs in a spawned process, so it only takes and returns plain data.
+    """
+    rng = random.Random(seed * 1000 + worker)
+    names, weights = zip(*mix.items())
+    samples = []
+    deadline = time.monotonic() + duration
+    played = 0
+    while time.monotonic() < deadline and (not journeys or played < journeys):
+        journey = rng.choices(names, weights=weights)[0]
+        STEPS[journey](Session(base_url, samples), rng, plan)
+        played += 1
+    return samples, played
+
+
+def _percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def _summary(samples, elapsed):
+    latencies = sorted(sample[2] for sample in samples)
+    queries = [sample[3] for sample in samples if sample[3] is not None]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+    errors = sum(1 for sample in samples if sample[1] == 0 or sample[1] >= 400)
+    return {
+        'requests': len(samples),
+        'requests_per_second': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'statuses': statuses,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            **{f'p{percent}': round(_percentile(latencies, percent), 2) for percent in PERCENTILES},
+            'max': round(latencies[-1], 2) if latencies else 0.0,
+        },
+        'db_queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+def summarize(samples, elapsed):
+    """Totals plus the same figures per step"""
+    by_step = {}
+    for sample in samples:
+        by_step.setdefault(sample[0], []).append(sample)
+    return {
+        'total': _summary(samples, elapsed),
+        'steps': {step: _summary(step_samples, elapsed) for step, step_samples in sorted(by_step.items())},
+    }
+
+def compare(current, baseline):
+    """Rows of (step, metric, baseline, current, change %) for the headline figures"""
+    rows = []
+    steps = [('total', current['results']['total'], baseline['results']['total'])]
+    steps += [
+        (step, figures, baseline['results']['steps'][step])
+        for step, figures in current['results']['steps'].items() if step in baseline['results']['steps']
+    ]
+    for step, now, before in steps:
+        for metric, read in (
+            ('requests_per_second', lambda figures: figures['requests_per_second']),
+            ('p95_ms', lambda figures: figures['latency_ms']['p95']),
+            ('error_rate', lambda figures: figures['error_rate']),
+            ('db_queries', lambda figures: figures['db_queries_per_request']),
+        ):
+            old, new = read(before), read(now)
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            rows.append((step, metric, old, new, change))
+    return rows
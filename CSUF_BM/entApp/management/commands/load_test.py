@@ -0,0 +1,129 @@
+from datetime import datetime
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from accounts.models import Faculty
+from entApp.loadtest import DEFAULT_MIX, JOURNEYS, compare, run_worker, summarize
+from products.forms import ProductSortForm
+from products.models import Category, Product
+import json
+import multiprocessing
+import subprocess
+import time
+
+
+class Command(BaseCommand):
+    help = 'Drive a running server with scripted store, cart, checkout and dashboard journeys and report throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server to test; it must already be running')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes, each playing one user at a time')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds each worker keeps starting journeys')
+        parser.add_argument('--journeys', type=int, default=0, help='Stop each worker after this many journeys (0 for no limit)')
+        parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                            help=f"Journey weights, e.g. browse=6,shopper=3,member=1 (journeys: {', '.join(JOURNEYS)})")
+        parser.add_argument('--seed', type=int, default=0, help='Seed for journey and product choices')
+        parser.add_argument('--products', type=int, default=500, help='Available products to sample URLs from')
+        parser.add_argument('--password', default='synthetic-password', help='Password of the synthetic accounts member journeys log in as')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Earlier JSON results to compare this run against')
+
+    def _mix(self, value):
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            if name.strip() not in JOURNEYS or not weight.strip().isdigit():
+                raise CommandError(f"Invalid journey weight '{part}'")
+            mix[name.strip()] = int(weight)
+        if not any(mix.values()):
+            raise CommandError('At least one journey needs a positive weight')
+        return {name: weight for name, weight in mix.items() if weight}
+
+    def _plan(self, options):
+        products = [
+            {'url': product.get_url(), 'add_url': reverse('add_to_cart', args=[product.id])}
+            for product in Product.objects.filter(is_available=True).select_related('category').order_by('?')[:options['products']]
+        ]
+        if not products:
+            raise CommandError('No available products to test against; try manage.py generate_synthetic_data')
+        categories = [
+            reverse('products_by_category', args=[slug])
+            for slug in Category.objects.values_list('slug', flat=True)
+        ]
+        return {
+            'paths': {
+                'store': reverse('store'),
+                'cart': reverse('cart_detail'),
+                'update_cart': reverse('update_cart', args=[0]).replace('/0/', '/{id}/'),
+                'checkout': reverse('checkout'),
+                'login': reverse('login'),
+                'dashboard': reverse('dashboard'),
+            },
+            'products': products,
+            'categories': categories,
+            'departments': sorted(set(Faculty.objects.values_list('department', flat=True))),
+            'sorts': [value for value, _ in ProductSortForm.SORT_CHOICES if value],
+            'users': list(get_user_model().objects.filter(
+                email__startswith='synthetic', email__endswith='@example.edu'
+            ).order_by('id').values_list('email', flat=True)[:1000]),
+            'password': options['password'],
+        }
+
+    def _commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        mix = self._mix(options['mix'])
+        plan = self._plan(options)
+        self.stdout.write(
+            f"Running {options['workers']} worker(s) against {options['base_url']} for up to {options['duration']}s "
+            f"({len(plan['products'])} products, {len(plan['users'])} accounts)"
+        )
+
+        # spawn, so workers do not inherit the parent's database connections
+        context = multiprocessing.get_context('spawn')
+        started = time.perf_counter()
+        with context.Pool(options['workers']) as pool:
+            results = pool.starmap(run_worker, [
+                (worker, options['base_url'], plan, mix, options['duration'], options['journeys'], options['seed'])
+                for worker in range(options['workers'])
+            ])
+        elapsed = time.perf_counter() - started
+
+        samples = [sample for worker_samples, _ in results for sample in worker_samples]
+        report = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': self._commit(),
+            'options': {
+                name: options[name] for name in ('base_url', 'workers', 'duration', 'journeys', 'seed', 'products')
+            } | {'mix': mix},
+            'elapsed_seconds': round(elapsed, 2),
+            'journeys': sum(played for _, played in results),
+            'results': summarize(samples, elapsed),
+        }
+
+        self.stdout.write(f"{'step':<18}{'requests':>10}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>9}{'queries':>9}")
+        for step, figures in [('total', report['results']['total']), *report['results']['steps'].items()]:
+            latency = figures['latency_ms']
+            queries = figures['db_queries_per_request']
+            self.stdout.write(
+                f"{step:<18}{figures['requests']:>10}{figures['requests_per_second']:>10}{latency['p50']:>10}"
+                f"{latency['p95']:>10}{latency['p99']:>10}{figures['error_rate']:>9.2%}{'-' if queries is None else queries:>9}"
+            )
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"\nCompared with {options['compare']} ({baseline.get('commit') or 'unknown commit'}):")
+            for step, metric, old, new, change in compare(report, baseline):
+                self.stdout.write(f"{step:<18}{metric:<22}{str(old):>10}{str(new):>10}{'' if change is None else f'{change:+.1f}%':>10}")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Ran {report['journeys']} journey(s), {len(samples)} request(s) in {elapsed:.1f}s"))
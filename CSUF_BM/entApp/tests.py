@@ -1,3 +1,24 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+from entApp.loadtest import compare, summarize
 
-# Create your tests here.
+
+class LoadTestReportTests(SimpleTestCase):
+    def test_summary_percentiles_errors_and_queries(self):
+        samples = [('store', 200, float(ms), 4) for ms in range(1, 101)] + [('checkout', 500, 50.0, None)]
+        results = summarize(samples, elapsed=10)
+        store = results['steps']['store']
+        self.assertEqual(store['requests'], 100)
+        self.assertEqual(store['latency_ms']['p50'], 51.0)
+        self.assertEqual(store['latency_ms']['p99'], 100.0)
+        self.assertEqual(store['db_queries_per_request'], 4)
+        self.assertIsNone(results['steps']['checkout']['db_queries_per_request'])
+        self.assertEqual(results['total']['error_rate'], round(1 / 101, 4))
+        self.assertEqual(results['total']['requests_per_second'], 10.1)
+
+    def test_compare_reports_change_against_baseline(self):
+        baseline = {'results': summarize([('store', 200, 100.0, 10)] * 10, elapsed=10)}
+        current = {'results': summarize([('store', 200, 50.0, 5)] * 20, elapsed=10)}
+        rows = {(step, metric): (old, new, change) for step, metric, old, new, change in compare(current, baseline)}
+        self.assertEqual(rows['store', 'requests_per_second'], (1.0, 2.0, 100.0))
+        self.assertEqual(rows['store', 'p95_ms'], (100.0, 50.0, -50.0))
+        self.assertEqual(rows['store', 'db_queries'], (10, 5, -50.0))
@@ -1,22 +1,32 @@
 from django.shortcuts import render, HttpResponse
 from products.models import Product, Category
-from django.db.models import Avg
+from products.utils.images import image_sources
+from products.utils.reference import get_categories
+from products.utils.snapshot import get_snapshot
 
 
 def home(request):
-    # Get featured/active products
-    products = Product.objects.filter(
-        is_available=True
-    ).annotate(
-        avg_rating=Avg('reviews__rating')
-    ).order_by('-created_date')
+    # Get featured/active products, newest first; from the mapped catalog
+    # snapshot when there is one (rows carry name, price, image and url)
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        products = snapshot.products('-created_date')
+    else:
+        products = Product.objects.filter(
+            is_available=True
+        ).select_related('category').order_by('-created_date')
     
     # Get categories
-    categories = Category.objects.all()
+    categories = get_categories()
     
+    # One manifest read per image group instead of one per <img>
+    product_images = [getattr(product.image, 'name', product.image) for product in products]
     context = {
         'products': products,
         'categories': categories,
+        'image_sources': image_sources(product_images, 'detail'),
+        'card_image_sources': image_sources(product_images[:6], 'card'),
+        'category_image_sources': image_sources([category.image.name for category in categories], 'detail'),
     }
     
     return render(request, 'home.html', context)
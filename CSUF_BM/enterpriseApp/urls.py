@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from entApp import views as entApp_views
+from products import views as products_views
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -27,6 +28,7 @@ urlpatterns = [
     path('checkout/', include("checkout.urls")),
     path('cart/', include("cart.urls")),
     path('store/', include("products.urls")),
+    path('metrics/', products_views.metrics, name='metrics'),
     
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
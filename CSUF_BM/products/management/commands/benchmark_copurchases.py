@@ -0,0 +1,57 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from itertools import accumulate
+from products.utils.copurchase import count_pairs, max_basket, min_orders, top_n, top_neighbours
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the co-purchase counting and top-N selection on synthetic baskets '
+        '(Zipf-distributed product popularity, nothing is written to the database)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--line-items', type=int, default=1_000_000)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--mean-basket', type=float, default=3.0)
+        parser.add_argument('--zipf', type=float, default=1.1, help='Popularity skew exponent')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        baskets = self._baskets(rng, options['line_items'], options['products'], options['mean_basket'], options['zipf'])
+        self.stdout.write(f'{len(baskets)} orders, {options["line_items"]} line items, {options["products"]} products')
+
+        start = time.perf_counter()
+        pairs = count_pairs(baskets, max_basket())
+        counted = time.perf_counter()
+
+        rows = defaultdict(dict)
+        for (a, b), orders in pairs.items():
+            rows[a][b] = orders
+            rows[b][a] = orders
+        n, threshold = top_n(), min_orders()
+        tops = {product_id: top_neighbours(row, n, threshold) for product_id, row in rows.items()}
+        ranked = time.perf_counter()
+
+        self._report('count pairs', counted - start, f'{len(pairs)} distinct pairs')
+        self._report('top-N', ranked - counted, f'{sum(1 for top in tops.values() if top)} products with neighbours')
+        self._report('total', ranked - start, f'{options["line_items"] / (ranked - start):,.0f} line items/s')
+
+    @staticmethod
+    def _baskets(rng, line_items, products, mean_basket, skew):
+        cum_weights = list(accumulate(1 / rank ** skew for rank in range(1, products + 1)))
+        ids = list(range(1, products + 1))
+        baskets = []
+        remaining = line_items
+        while remaining > 0:
+            # Geometric basket sizes: mostly small orders with a long tail
+            size = min(remaining, 1 + int(rng.expovariate(1 / max(mean_basket - 1, 0.01))))
+            baskets.append(rng.choices(ids, cum_weights=cum_weights, k=size))
+            remaining -= size
+        return baskets
+
+    def _report(self, label, seconds, detail):
+        self.stdout.write(self.style.SUCCESS(f'{label:<12} {seconds * 1000:10.1f}ms  {detail}'))
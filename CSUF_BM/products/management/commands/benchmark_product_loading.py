@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from products.models import Category, DigitalProduct, Product
+import random
+import statistics
+import time
+import uuid
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare query counts and latency of the try-digital-then-product lookups '
+        'with Product.objects.polymorphic() on a throwaway mixed catalog (rolled back afterwards)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--digital-ratio', type=float, default=0.3)
+        parser.add_argument('--lookups', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ids = self._build_catalog(options['products'], options['digital_ratio'])
+            sample = random.sample(ids, min(options['lookups'], len(ids)))
+            page_ids = ids[:options['page_size']]
+
+            self._report('lookup  fallback', sample, self._fallback_lookup)
+            self._report('lookup  polymorphic', sample, self._polymorphic_lookup)
+            self._report('listing per-row', [page_ids], self._per_row_listing)
+            self._report('listing polymorphic', [page_ids], self._polymorphic_listing)
+            transaction.set_rollback(True)
+
+    def _build_catalog(self, count, digital_ratio):
+        run_id = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'Benchmark {run_id}', slug=f'benchmark-{run_id}')
+        digital_count = int(count * digital_ratio)
+        Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark {run_id} physical {i}', slug=f'benchmark-{run_id}-p{i}',
+                price=10, image='photos/products/benchmark.jpg', stock=10, category=category,
+            )
+            for i in range(count - digital_count)
+        ], batch_size=500)
+        # Multi-table children cannot be bulk created
+        for i in range(digital_count):
+            DigitalProduct.objects.create(
+                name=f'Benchmark {run_id} digital {i}', slug=f'benchmark-{run_id}-d{i}',
+                price=10, image='photos/products/benchmark.jpg', stock=-1, category=category,
+                version=f'1.{i}', download_link='https://example.com/download', file_size='1 MB',
+            )
+        ids = list(Product.objects.filter(category=category).values_list('id', flat=True))
+        random.shuffle(ids)
+        return ids
+
+    @staticmethod
+    def _fallback_lookup(product_id):
+        try:
+            return DigitalProduct.objects.get(id=product_id)
+        except DigitalProduct.DoesNotExist:
+            return Product.objects.get(id=product_id)
+
+    @staticmethod
+    def _polymorphic_lookup(product_id):
+        return Product.objects.polymorphic().get(id=product_id)
+
+    @staticmethod
+    def _per_row_listing(product_ids):
+        products = []
+        for product in Product.objects.filter(id__in=product_ids):
+            try:
+                products.append(product.digitalproduct)
+            except DigitalProduct.DoesNotExist:
+                products.append(product)
+        return products
+
+    @staticmethod
+    def _polymorphic_listing(product_ids):
+        return list(Product.objects.polymorphic().filter(id__in=product_ids))
+
+    def _report(self, label, calls, load):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for arg in calls:
+                start = time.perf_counter()
+                load(arg)
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f'{label:<20} {len(queries) / len(calls):6.2f} queries/call  '
+            f'mean {statistics.fmean(timings):7.3f}ms  p50 {timings[len(timings) // 2]:7.3f}ms'
+        ))
@@ -0,0 +1,106 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from accounts.models import Faculty
+from products.models import Product, ProductRecommendation
+from products.utils.pagination import STORE_CARD_FIELDS, store_ordering
+from products.utils.store_filters import store_order_by, store_queryset
+import statistics
+import time
+
+NO_FILTERS = {'department': '', 'faculty_search': '', 'essential_only': False, 'recommended_only': False}
+
+
+class Command(BaseCommand):
+    help = (
+        'Time one store page for common filter and sort combinations, compiled summary-column '
+        'predicates against the old joins plus DISTINCT. Run it on a large catalog, e.g. one from '
+        'manage.py generate_synthetic_data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per scenario; the median is reported')
+        parser.add_argument('--page-size', type=int, default=24)
+        parser.add_argument('--explain', action='store_true', help='Print both query plans of every scenario')
+
+    def handle(self, *args, **options):
+        if not Product.objects.filter(is_available=True).exists():
+            raise CommandError('No available products; try manage.py generate_synthetic_data first')
+        department = Faculty.objects.values('department').annotate(
+            total=Count('recommended_products')
+        ).order_by('-total').values_list('department', flat=True).first() or 'Mathematics'
+        last_name = Faculty.objects.values_list('user__last_name', flat=True).first() or 'Smith'
+
+        scenarios = [
+            ('no filters', {}),
+            ('essential', {'essential_only': True}),
+            ('recommended', {'recommended_only': True}),
+            (f'department={department}', {'department': department}),
+            (f'faculty={last_name}', {'faculty_search': last_name}),
+            ('department+essential', {'department': department, 'essential_only': True}),
+        ]
+        self.stdout.write(
+            f"{Product.objects.count()} products, {ProductRecommendation.objects.count()} recommendations, "
+            f"{options['repeat']} runs per scenario"
+        )
+        self.stdout.write(f"{'scenario':<36}{'sort':<18}{'joins ms':>10}{'compiled ms':>13}{'speedup':>9}")
+        for label, overrides in scenarios:
+            filters = {**NO_FILTERS, **overrides}
+            for sort_by in ('', 'recommendations'):
+                legacy = self._legacy_page(filters, sort_by, options['page_size'])
+                compiled = self._compiled_page(filters, sort_by, options['page_size'])
+                if [row['id'] for row in legacy] != [row['id'] for row in compiled]:
+                    self.stdout.write(self.style.WARNING(f'{label}: pages differ (faculty names now match as "First Last")'))
+                legacy_ms = self._time(lambda: self._legacy_page(filters, sort_by, options['page_size']), options['repeat'])
+                compiled_ms = self._time(lambda: self._compiled_page(filters, sort_by, options['page_size']), options['repeat'])
+                self.stdout.write(
+                    f"{label:<36}{sort_by or 'newest':<18}{legacy_ms:>10.2f}{compiled_ms:>13.2f}"
+                    f"{legacy_ms / compiled_ms if compiled_ms else 0:>8.1f}x"
+                )
+                if options['explain']:
+                    self.stdout.write(self._legacy_query(filters, sort_by, options['page_size']).explain())
+                    self.stdout.write(self._compiled_query(filters, sort_by, options['page_size']).explain())
+
+    @staticmethod
+    def _time(run, repeat):
+        run()  # Warm the page cache of the database
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    @staticmethod
+    def _compiled_query(filters, sort_by, page_size):
+        queryset = store_queryset(filters).order_by(*store_order_by(filters, sort_by))
+        return queryset.values(*STORE_CARD_FIELDS)[:page_size + 1]
+
+    def _compiled_page(self, filters, sort_by, page_size):
+        return list(self._compiled_query(filters, sort_by, page_size))
+
+    @staticmethod
+    def _legacy_query(filters, sort_by, page_size):
+        """The store query as it was before the recommendation summary"""
+        queryset = Product.objects.filter(is_available=True)
+        if filters['essential_only']:
+            queryset = queryset.filter(recommendations__is_essential=True)
+        if filters['recommended_only']:
+            queryset = queryset.filter(recommendations__isnull=False)
+        if filters['department']:
+            queryset = queryset.filter(recommendations__faculty__department=filters['department'])
+        if filters['faculty_search']:
+            queryset = queryset.filter(
+                Q(recommendations__faculty__user__first_name__icontains=filters['faculty_search']) |
+                Q(recommendations__faculty__user__last_name__icontains=filters['faculty_search'])
+            )
+        counts = ProductRecommendation.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        queryset = queryset.annotate(legacy_count=Coalesce(
+            Subquery(counts.annotate(total=Count('id')).values('total'), output_field=IntegerField()), 0
+        ))
+        ordering = [field.replace('recommendation_count', 'legacy_count') for field in store_ordering(sort_by)]
+        fields = [field for field in STORE_CARD_FIELDS if field not in ('recommendation_count', 'recent_recommenders')]
+        return queryset.order_by(*ordering).values(*fields, 'legacy_count').distinct()[:page_size + 1]
+
+    def _legacy_page(self, filters, sort_by, page_size):
+        return list(self._legacy_query(filters, sort_by, page_size))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.utils.snapshot import build_snapshot, snapshot_path
+
+
+class Command(BaseCommand):
+    help = 'Write the memory-mapped catalog snapshot that store listings read'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Defaults to settings.CATALOG_SNAPSHOT_PATH')
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_path()
+        if not path:
+            raise CommandError('Set CATALOG_SNAPSHOT_PATH or pass --path')
+        count = build_snapshot(path)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} product(s) to {path}'))
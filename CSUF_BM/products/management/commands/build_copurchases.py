@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from products.utils.copurchase import build_copurchases
+
+
+class Command(BaseCommand):
+    help = 'Fold new paid orders into the frequently-bought-together tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Clear the co-purchase tables and rebuild from every order')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders per transaction')
+
+    def handle(self, *args, **options):
+        orders, pairs = build_copurchases(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {orders} order(s), {pairs} distinct product pair(s)'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product
+from products.utils.catalog_io import FORMATS, export_rows, guess_format, write_rows
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Stream the catalog to CSV or JSON lines in the format import_catalog reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help="File to write, or - for stdout")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension (csv otherwise)')
+        parser.add_argument('--category', help='Only export this category slug')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['output']
+        fmt = options['format'] or guess_format(path)
+        queryset = Product.objects.all()
+        if options['category']:
+            queryset = queryset.filter(category__slug=options['category'])
+        rows = export_rows(queryset, chunk_size=options['chunk_size'])
+
+        if path == '-':
+            written = write_rows(rows, self.stdout, fmt)
+        else:
+            try:
+                with open(path, 'w', newline='', encoding='utf-8') as stream:
+                    written = write_rows(rows, stream, fmt)
+            except OSError as e:
+                raise CommandError(f'Cannot write {path}: {e}')
+        self.stderr.write(self.style.SUCCESS(f'Exported {written} product(s)'))
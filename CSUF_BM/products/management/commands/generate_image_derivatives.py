@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from products.utils.images import backfill_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Render resized and WebP derivatives of every product and category image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render images whose content is unchanged')
+        parser.add_argument('--workers', type=int, default=None, help='Pool processes; 0 renders in this process')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        total, rendered = backfill_derivatives(
+            force=options['force'], workers=options['workers'], batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rendered derivatives for {rendered} of {total} image(s)'))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from products.utils.synthetic import generate
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-insert a deterministic synthetic data set (catalog, accounts, reviews, '
+        'recommendations, carts and order history) for benchmarking'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--digital-ratio', type=float, default=0.2)
+        parser.add_argument('--faculty', type=int, default=100)
+        parser.add_argument('--students', type=int, default=2000)
+        parser.add_argument('--recommendations', type=int, default=2000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--carts', type=int, default=1000)
+        parser.add_argument('--order-lines', type=int, default=100000)
+        parser.add_argument('--mean-basket', type=float, default=3.0, help='Average lines per order')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per transaction')
+        parser.add_argument(
+            '--no-rebuild', action='store_true',
+            help='Skip rebuilding rating counters, the search index, caches and the catalog snapshot',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = {}
+
+        def progress(label, count):
+            # A line roughly every 100k rows of each kind
+            if count // 100000 > written.get(label, 0) // 100000:
+                self.stdout.write(f'  {label}: {count}')
+            written[label] = count
+
+        generate(
+            categories=options['categories'], products=options['products'], digital_ratio=options['digital_ratio'],
+            faculty=options['faculty'], students=options['students'], recommendations=options['recommendations'],
+            reviews=options['reviews'], carts=options['carts'], order_lines=options['order_lines'],
+            mean_basket=options['mean_basket'], seed=options['seed'], chunk_size=options['chunk_size'],
+            rebuild=not options['no_rebuild'], progress=progress,
+        )
+        for label, count in written.items():
+            self.stdout.write(f'{label:<20} {count}')
+        self.stdout.write(self.style.SUCCESS(f'Generated in {time.perf_counter() - started:.1f}s'))
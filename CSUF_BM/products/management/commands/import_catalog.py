@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.utils.catalog_io import FORMATS, guess_format, import_catalog, read_rows
+import sys
+
+
+class Command(BaseCommand):
+    help = (
+        'Upsert categories, products and digital products on slug from a CSV or JSON lines file, '
+        'in batches, with one cache invalidation at the end'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, or - for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension (csv otherwise)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-errors', type=int, default=20, help='Rejected rows to list in the output')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
+        try:
+            stats, errors = import_catalog(read_rows(stream, fmt), batch_size=options['batch_size'])
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for number, message in errors[:options['max_errors']]:
+            self.stderr.write(self.style.WARNING(f'line {number}: {message}'))
+        if len(errors) > options['max_errors']:
+            self.stderr.write(self.style.WARNING(f'... and {len(errors) - options["max_errors"]} more'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported catalog: {stats['created']} created, {stats['updated']} updated, "
+            f"{stats['unchanged']} unchanged, {stats['categories']} new categories, {len(errors)} rejected"
+        ))
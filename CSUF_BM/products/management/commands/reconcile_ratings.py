@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products.utils.ratings import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product rating counters from ProductReview rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        corrected = reconcile_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Corrected rating counters on {corrected} product(s)'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products.utils.recommendations import refresh_recommendation_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the recommendation summary columns on products from ProductRecommendation rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        corrected = refresh_recommendation_summaries(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Corrected recommendation summaries on {corrected} product(s)'))
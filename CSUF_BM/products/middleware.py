@@ -1,59 +1,119 @@
 # middleware.py
 import time
-from django.core.cache import cache
-from django.conf import settings
 import logging
+from django.conf import settings
+from .utils import db_routing
+from .utils.cache import coalesce_invalidations
+from .utils.metrics import QueryCounter, registry
+from .utils.queries import QueryRecorder, inspection_enabled, query_budgets
 logger = logging.getLogger(__name__)
 
 
-class EnhancedCacheMonitoringMiddleware:
+class InvalidationCoalescingMiddleware:
+    """
+    Apply the product cache invalidations committed during a request once,
+    when the response is ready. Bulk admin edits (list_editable, actions)
+    then bump each tag a single time instead of once per row. Bursts
+    spread over many requests are debounced across processes when
+    CACHE_INVALIDATION_WINDOW is set (see debounce_tags).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with coalesce_invalidations():
+            return self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record per-route request counts, latency histograms and database
+    query totals in the in-process metrics registry. Each request only
+    updates local counters; the registry flushes to the cache in batches.
+    With QUERY_COUNT_HEADER on, responses also carry X-DB-Queries for
+    load tests to read. In inspection mode (QUERY_INSPECTION, DEBUG by
+    default) every statement is recorded with its call site, responses
+    carry X-DB-Queries and X-DB-Time, and repeated statements or views
+    over their QUERY_BUDGETS entry are logged as warnings.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.inspect = inspection_enabled()
+        self.query_header = self.inspect or getattr(settings, 'QUERY_COUNT_HEADER', False)
+
+    def __call__(self, request):
+        start_time = time.perf_counter()
+        with (QueryRecorder() if self.inspect else QueryCounter()).active() as queries:
+            response = self.get_response(request)
+        duration = time.perf_counter() - start_time
+
+        recording_start = time.perf_counter()
+        match = getattr(request, 'resolver_match', None)
+        labels = {
+            'route': match.route if match else 'unmatched',
+            'method': request.method,
+        }
+        registry.observe('http_request_duration_seconds', duration, labels)
+        registry.inc('http_requests_total', {**labels, 'status': f'{response.status_code // 100}xx'})
+        if hasattr(response, '_cache_hit'):
+            registry.inc('http_response_cache_hits_total', labels)
+        registry.inc('db_queries_total', labels, queries.count)
+        if self.query_header:
+            response['X-DB-Queries'] = str(queries.count)
+        if self.inspect:
+            response['X-DB-Time'] = f'{queries.total_ms:.1f}ms'
+            self._warn(request, match, queries)
+        # Keep the middleware's own cost visible against METRICS_OVERHEAD_BUDGET_US
+        registry.observe('metrics_record_overhead_seconds', time.perf_counter() - recording_start)
+        registry.maybe_flush()
+
+        return response
+
+    def _warn(self, request, match, recorder):
+        view = match.url_name if match else None
+        budget = query_budgets().get(view)
+        if budget is not None and recorder.count > budget:
+            logger.warning(f"{view} ran {recorder.count} queries, over its budget of {budget}:\n{recorder.report()}")
+        elif recorder.repeated():
+            logger.warning(f"Possible N+1 on {request.path}:\n{recorder.report()}")
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Send the reads of read-only views to a replica; see utils/db_routing.py.
+    A view whose replica read fails is run again against the primary, and
+    that replica is skipped for a while.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
-        self.stats_timeout = 86400  # 24 hours
 
     def __call__(self, request):
-        start_time = time.time()
-        response = self.get_response(request)
-        duration = time.time() - start_time
-        
-        if not settings.DEBUG:
-            self.update_cache_stats(request.path, duration, hasattr(response, '_cache_hit'))
-        
+        with db_routing.routing() as state:
+            response = self.get_response(request)
+        if state.wrote:
+            db_routing.pin(response)
         return response
-    
-    def update_cache_stats(self, path, duration, is_hit):
-        """Update cache statistics with pipeline"""
-        cache_key = f"cache_stats:{path}"
-        
-        pipeline = cache.client.pipeline(transaction=True)
-        try:
-            # Get current stats
-            stats = cache.get(cache_key, {
-                'hits': 0,
-                'misses': 0,
-                'avg_time': 0,
-                'min_time': duration,
-                'max_time': duration,
-                'total_requests': 0
-            })
-            
-            # Update stats
-            stats['total_requests'] += 1
-            if is_hit:
-                stats['hits'] += 1
-            else:
-                stats['misses'] += 1
-            
-            stats['avg_time'] = (
-                (stats['avg_time'] * (stats['total_requests'] - 1) + duration) / 
-                stats['total_requests']
-            )
-            stats['min_time'] = min(stats['min_time'], duration)
-            stats['max_time'] = max(stats['max_time'], duration)
-            
-            # Store updated stats
-            pipeline.set(cache_key, stats, self.stats_timeout)
-            pipeline.execute()
-            
-        except Exception as e:
-            logger.error(f"Error updating cache stats: {e}")
\ No newline at end of file
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method not in ('GET', 'HEAD') or request.resolver_match.url_name not in db_routing.read_views()
+                or not db_routing.replica_aliases() or db_routing.is_pinned(request)
+                or db_routing.replica_reads_held()):
+            return None
+        alias = db_routing.choose_replica()
+        if alias is not None:
+            db_routing.current_state().alias = alias
+            registry.inc('db_replica_reads_total', {'alias': alias})
+        return None
+
+    def process_exception(self, request, exception):
+        if not db_routing.failed_on_replica(exception):
+            return None
+        state = db_routing.current_state()
+        db_routing.health.mark_failed(state.alias, 'error', str(exception))
+        state.alias = None
+        match = request.resolver_match
+        return match.func(request, *match.args, **match.kwargs)
+
+
+# Old name kept for settings that still list it
+EnhancedCacheMonitoringMiddleware = RequestMetricsMiddleware
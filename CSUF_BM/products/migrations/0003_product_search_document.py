@@ -0,0 +1,54 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE products_productsearchdocument '
+        'ADD FULLTEXT INDEX products_search_title_ft (title), '
+        'ADD FULLTEXT INDEX products_search_document_ft (document)'
+    )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE products_productsearchdocument '
+        'DROP INDEX products_search_title_ft, '
+        'DROP INDEX products_search_document_ft'
+    )
+
+
+def backfill_search_documents(apps, schema_editor):
+    from products.utils.search import rebuild_index
+    rebuild_index(
+        product_model=apps.get_model('products', 'Product'),
+        document_model=apps.get_model('products', 'ProductSearchDocument'),
+        publish=False
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_rating_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('title', models.TextField(blank=True)),
+                ('document', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
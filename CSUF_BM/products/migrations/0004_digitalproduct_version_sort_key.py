@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:42
+
+from django.db import migrations, models
+
+
+def backfill_version_sort_keys(apps, schema_editor):
+    from products.models import version_sort_key
+    DigitalProduct = apps.get_model('products', 'DigitalProduct')
+    batch = []
+    for product in DigitalProduct.objects.only('pk', 'version').iterator(chunk_size=500):
+        product.version_sort_key = version_sort_key(product.version)
+        batch.append(product)
+        if len(batch) >= 500:
+            DigitalProduct.objects.bulk_update(batch, ['version_sort_key'])
+            batch = []
+    DigitalProduct.objects.bulk_update(batch, ['version_sort_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digitalproduct',
+            name='version_sort_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_version_sort_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_digitalproduct_version_sort_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDerivatives',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original', models.CharField(max_length=255, unique=True)),
+                ('source_hash', models.CharField(max_length=16)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('variants', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'image derivatives',
+            },
+        ),
+    ]
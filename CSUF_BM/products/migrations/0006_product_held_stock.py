@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='held_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
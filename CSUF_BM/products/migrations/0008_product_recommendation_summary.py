@@ -0,0 +1,52 @@
+# Generated by Django 5.1.1 on 2026-10-18 02:29
+
+from django.db import migrations, models
+
+
+def backfill_recommendation_summaries(apps, schema_editor):
+    from products.utils.recommendations import refresh_recommendation_summaries
+    refresh_recommendation_summaries(
+        product_model=apps.get_model('products', 'Product'),
+        recommendation_model=apps.get_model('products', 'ProductRecommendation'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_account_profile_picture_and_more'),
+        ('products', '0007_copurchase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='has_essential_recommendation',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='recent_recommenders',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='recommendation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='recommendation_departments',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='recommender_names',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['recommendation_count', 'id'], name='product_recommended_idx'),
+        ),
+        migrations.RunPython(backfill_recommendation_summaries, migrations.RunPython.noop),
+    ]
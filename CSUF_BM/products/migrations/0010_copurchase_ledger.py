@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+def reset_copurchases(apps, schema_editor):
+    # Counts folded in before the ledger existed cannot be told apart from
+    # new ones, so the next build_copurchases run starts from scratch
+    for name in ('CoPurchaseCount', 'FrequentlyBoughtTogether', 'CoPurchaseRun'):
+        apps.get_model('products', name).objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchaseOrder',
+            fields=[
+                ('order_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('product_ids', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='copurchaserun',
+            name='removed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(reset_copurchases, migrations.RunPython.noop),
+    ]
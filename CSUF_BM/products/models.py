@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.query import ModelIterable
 from django.urls import reverse
 from django.utils.text import slugify
 from django.core.cache import cache
@@ -7,6 +8,37 @@ from django.dispatch import receiver
 
 # Create your models here.
 
+RATING_HISTOGRAM_FIELDS = tuple(f'rating_{stars}_count' for stars in range(1, 6))
+RATING_COUNTER_FIELDS = ('average_rating', 'rating_sum', 'rating_count') + RATING_HISTOGRAM_FIELDS
+# Fields no cached listing shows; saves touching only these skip invalidation
+STOCK_FIELDS = frozenset({'stock'})
+# Summary of a product's ProductRecommendation rows (see utils/recommendations.py)
+RECOMMENDATION_SUMMARY_FIELDS = (
+    'recommendation_count', 'has_essential_recommendation', 'recommendation_departments',
+    'recommender_names', 'recent_recommenders',
+)
+# Fields maintained outside save() (atomic F() updates, summaries); save() never writes them back
+COUNTER_FIELDS = RATING_COUNTER_FIELDS + RECOMMENDATION_SUMMARY_FIELDS + ('held_stock',)
+# Bookkeeping fields ignored when deciding what a save changed
+UNTRACKED_FIELDS = frozenset({'modified_date'})
+VERSION_PART_WIDTH = 8
+
+
+def version_sort_key(version):
+    """
+    Fixed-width string that sorts like the version's numeric parts:
+    "1.10" -> "00000001.00000010", so "1.9" < "1.10" and "1.2" < "1.2.0".
+    Versions with non-numeric parts sort first, as "0".
+    """
+    try:
+        parts = [int(part) for part in (version or '').strip().split('.')]
+    except ValueError:
+        parts = [0]
+    if any(part < 0 for part in parts):
+        parts = [0]
+    width = VERSION_PART_WIDTH
+    return '.'.join(str(min(part, 10 ** width - 1)).zfill(width) for part in parts)[:255]
+
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
     slug = models.SlugField(max_length=100, unique=True)
@@ -30,6 +62,56 @@ class Category(models.Model):
         super(Category, self).save(*args, **kwargs)
 
 
+def subclass_accessors(model):
+    """Reverse accessors of the multi-table subclasses of model, e.g. ('digitalproduct',)"""
+    return tuple(
+        relation.get_accessor_name()
+        for relation in model._meta.related_objects
+        if relation.one_to_one and relation.parent_link and issubclass(relation.related_model, model)
+    )
+
+
+class PolymorphicModelIterable(ModelIterable):
+    """Yields the subclass instance joined in by ProductQuerySet.polymorphic() when there is one"""
+
+    def __iter__(self):
+        queryset = self.queryset
+        accessors = subclass_accessors(queryset.model)
+        annotations = list(queryset.query.annotation_select)
+        for obj in super().__iter__():
+            yield downcast(obj, accessors, annotations)
+
+
+def downcast(obj, accessors, annotations=()):
+    for accessor in accessors:
+        child = obj._state.fields_cache.get(accessor)
+        if child is None:
+            continue
+        # Keep what the parent row already loaded: related objects and annotations
+        for name, value in obj._state.fields_cache.items():
+            if name not in accessors:
+                child._state.fields_cache.setdefault(name, value)
+        for name in annotations:
+            setattr(child, name, getattr(obj, name))
+        return child
+    return obj
+
+
+class ProductQuerySet(models.QuerySet):
+    def polymorphic(self):
+        """
+        Return every row as its most specific model (DigitalProduct rows as
+        DigitalProduct) from this single query: subclass tables are LEFT
+        JOINed in instead of fetched with one query per row.
+        """
+        accessors = subclass_accessors(self.model)
+        if not accessors:
+            return self._chain()
+        clone = self.select_related(*accessors)
+        clone._iterable_class = PolymorphicModelIterable
+        return clone
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=200, unique=True)
@@ -37,6 +119,8 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='photos/products')
     stock = models.IntegerField()
+    # Units held by carts (cart.CartHold); available to sell is stock - held_stock
+    held_stock = models.PositiveIntegerField(default=0, editable=False)
     is_available = models.BooleanField(default=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     created_date = models.DateTimeField(auto_now_add=True)
@@ -45,13 +129,43 @@ class Product(models.Model):
     brand = models.CharField(max_length=100, blank=True)
     discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    # Review counters maintained incrementally by ProductReview
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
     featured = models.BooleanField(default=False)
+    # Recommendation summary rewritten by products.signals, so store listings
+    # filter and sort on the product row without joining recommendations
+    recommendation_count = models.PositiveIntegerField(default=0, editable=False)
+    has_essential_recommendation = models.BooleanField(default=False, editable=False)
+    # Departments as '|Biology|Math|', so one matches as a delimited substring
+    recommendation_departments = models.TextField(blank=True, default='', editable=False)
+    # 'First Last|First Last' of every recommender, for the faculty name search
+    recommender_names = models.TextField(blank=True, default='', editable=False)
+    # The newest recommenders as store cards show them
+    recent_recommenders = models.JSONField(default=list, blank=True, editable=False)
 
     PRODUCT_TYPES = (
         ('physical', 'Physical Product'),
         ('digital', 'Digital Product'),
     )
     product_type = models.CharField(max_length=20, choices=PRODUCT_TYPES, default='physical')
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset orders of the store sorts (name uses its unique index),
+            # so an unfiltered page reads one index range without sorting
+            models.Index(fields=['created_date', 'id'], name='product_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            # Also where every faculty filter starts (utils/store_filters.py)
+            models.Index(fields=['recommendation_count', 'id'], name='product_recommended_idx'),
+        ]
     
     @property
     def is_digital(self):
@@ -63,17 +177,131 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance._tracked_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        refreshed = self._tracked_values()
+        if fields is not None:
+            refreshed = {
+                attname: value for attname, value in refreshed.items()
+                if attname in fields or attname.removesuffix('_id') in fields
+            }
+        self._loaded_values = {**getattr(self, '_loaded_values', {}), **refreshed}
+
+    def _tracked_values(self):
+        return {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and field.name not in UNTRACKED_FIELDS
+        }
+
+    def get_changed_fields(self):
+        """
+        Names of the fields that differ from what was loaded from the database,
+        or None when that is unknown (new or unloaded instances)
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded is None:
+            return None
+        return {
+            field.name for field in self._meta.concrete_fields
+            if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]
+        }
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
         if self.product_type == 'digital':
             self.stock = -1  # Indicates unlimited stock
+        # Read by the post_save receiver to decide how much cache to invalidate
+        changed = self.get_changed_fields()
+        if kwargs.get('update_fields') is not None:
+            requested = set(kwargs['update_fields'])
+            changed = requested if changed is None else changed & requested
+        self._changed_fields = changed
+        if not self._state.adding and 'update_fields' not in kwargs and not kwargs.get('force_insert'):
+            # Never write back stale counters; ProductReview and cart holds own them
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COUNTER_FIELDS
+            ]
         super().save(*args, **kwargs)
+        self._loaded_values = self._tracked_values()
+
+    @property
+    def available_stock(self):
+        """Units not held by carts; negative stock means unlimited"""
+        if self.stock < 0:
+            return self.stock
+        return max(0, self.stock - self.held_stock)
+
+    @staticmethod
+    def available_stock_expression():
+        # Branches instead of GREATEST(): stock - held_stock must never go below
+        # zero on MySQL, where held_stock is unsigned
+        return models.Case(
+            models.When(stock__lt=0, then=models.F('stock')),
+            models.When(stock__lte=models.F('held_stock'), then=models.Value(0)),
+            default=models.F('stock') - models.F('held_stock'),
+            output_field=models.IntegerField()
+        )
 
     @property
     def discounted_price(self):
         return self.price * (1 - self.discount / 100)
 
+    @property
+    def rating_histogram(self):
+        """Review counts keyed by star rating, highest first"""
+        return {stars: getattr(self, f'rating_{stars}_count') for stars in range(5, 0, -1)}
+
+    @classmethod
+    def apply_rating_change(cls, product_id, added=None, removed=None):
+        """
+        Adjust a product's review counters with atomic F() updates.
+
+        added/removed are the star ratings entering and leaving the
+        product's reviews (both are given when a review is edited).
+        Uses queryset updates so no post_save cache flush is triggered.
+        """
+        if added == removed:
+            return
+        changes = {}
+        count_delta = sum_delta = 0
+        for rating, sign in ((added, 1), (removed, -1)):
+            if rating is None:
+                continue
+            count_delta += sign
+            sum_delta += sign * rating
+            field = f'rating_{rating}_count'
+            if field in RATING_HISTOGRAM_FIELDS:
+                changes[field] = models.F(field) + sign
+
+        with transaction.atomic():
+            cls.objects.filter(id=product_id).update(
+                rating_sum=models.F('rating_sum') + sum_delta,
+                rating_count=models.F('rating_count') + count_delta,
+                **changes
+            )
+            # Separate statement: MySQL evaluates SET clauses left to right
+            cls.objects.filter(id=product_id).update(average_rating=cls.average_rating_expression())
+
+    @staticmethod
+    def average_rating_expression():
+        return models.Case(
+            models.When(rating_count=0, then=models.Value(0)),
+            default=models.ExpressionWrapper(
+                models.F('rating_sum') * models.Value(1.0) / models.F('rating_count'),
+                output_field=models.DecimalField(max_digits=3, decimal_places=2)
+            ),
+            output_field=models.DecimalField(max_digits=3, decimal_places=2)
+        )
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='photos/products')
@@ -82,6 +310,25 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"{self.product.name} - Image {self.id}"
 
+class ImageDerivatives(models.Model):
+    """
+    Manifest of the resized copies of one uploaded image, written by
+    products.utils.images. variants maps a size name to its width, height
+    and the storage paths of the fallback ('src') and WebP files.
+    """
+    original = models.CharField(max_length=255, unique=True)
+    source_hash = models.CharField(max_length=16)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    variants = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'image derivatives'
+
+    def __str__(self):
+        return f"Derivatives of {self.original}"
+
 class ProductReview(models.Model):
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
     user = models.ForeignKey('accounts.Account', on_delete=models.CASCADE)
@@ -92,11 +339,21 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.rating} stars"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so an edit can adjust the counters
+        instance._stored_rating = instance.__dict__.get('rating')
+        return instance
+
     def save(self, *args, **kwargs):
+        self.rating = int(self.rating)
+        previous = getattr(self, '_stored_rating', None)
         super(ProductReview, self).save(*args, **kwargs)
-        # Update average rating
-        self.product.average_rating = self.product.reviews.aggregate(models.Avg('rating'))['rating__avg']
-        self.product.save()
+        # Update rating counters incrementally
+        if previous != self.rating:
+            Product.apply_rating_change(self.product_id, added=self.rating, removed=previous)
+        self._stored_rating = self.rating
 
 class DigitalProduct(Product):
     version = models.CharField(max_length=50)
@@ -104,9 +361,15 @@ class DigitalProduct(Product):
     file_size = models.CharField(max_length=50, help_text="e.g., '15 MB'")
     system_requirements = models.TextField(blank=True)
     release_notes = models.TextField(blank=True)
+    # Derived from version so the admin listing can sort versions in the database
+    version_sort_key = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
     
     def save(self, *args, **kwargs):
         self.stock = -1  # Indicates unlimited stock for digital products
+        self.version_sort_key = version_sort_key(self.version)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'version' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'version_sort_key'}
         super().save(*args, **kwargs)
     
     @property
@@ -130,3 +393,77 @@ class ProductRecommendation(models.Model):
         return f"{self.product.name} recommended by {self.faculty.user.get_full_name()}"
     
 
+
+class ProductSearchDocument(models.Model):
+    """
+    Normalized search text for one product, kept current by products.signals.
+    On MySQL both columns carry FULLTEXT indexes (see migration 0003).
+    """
+    product = models.OneToOneField(Product, related_name='search_document', on_delete=models.CASCADE, primary_key=True)
+    # Tokens of name and brand, weighted higher when ranking
+    title = models.TextField(blank=True)
+    # Tokens of name, brand, category name and description
+    document = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for product {self.product_id}"
+
+
+class CoPurchaseCount(models.Model):
+    """
+    Number of paid orders that contained both products. Each pair is
+    stored in both directions so a product's row set is one index range.
+    Maintained by products.utils.copurchase.
+    """
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    other = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['product', 'other']
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.orders} orders"
+
+
+class FrequentlyBoughtTogether(models.Model):
+    """
+    Top co-purchased products for one product, as [[product_id, orders], ...]
+    in descending order, so pages read a product's neighbours with one
+    primary key lookup.
+    """
+    product = models.OneToOneField(Product, related_name='bought_together', on_delete=models.CASCADE, primary_key=True)
+    neighbours = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'frequently bought together'
+
+    def __str__(self):
+        return f"Bought with product {self.product_id}"
+
+
+class CoPurchaseOrder(models.Model):
+    """
+    A paid order folded into CoPurchaseCount, with the basket that was
+    counted. Orders missing here are still to be counted, whenever they
+    were paid; rows whose order is no longer paid are taken back out.
+    """
+    order_id = models.PositiveIntegerField(primary_key=True)
+    product_ids = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"Co-purchases of order {self.order_id}"
+
+
+class CoPurchaseRun(models.Model):
+    """One batch of the co-purchase job, kept as a log"""
+    last_order_id = models.PositiveIntegerField()
+    orders = models.PositiveIntegerField(default=0)
+    removed = models.PositiveIntegerField(default=0)
+    pairs = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Co-purchase run up to order {self.last_order_id}"
@@ -1,40 +1,148 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache, caches
-from .models import Product, ProductRecommendation
-from .utils.cache import CacheKeyBuilder
+from accounts.models import Account, Faculty
+from .models import STOCK_FIELDS, Category, DigitalProduct, Product, ProductImage, ProductRecommendation, ProductReview
+from .utils.cache import CacheTags, CacheKeyBuilder, queue_invalidation, record_invalidation_stat
+from .utils.images import schedule_derivatives
+from .utils.recommendations import recommended_by, refresh_recommendation_summaries
+from .utils.search import SEARCH_FIELDS, index_products, remove_products
+from .utils.snapshot import schedule_rebuild as schedule_snapshot_rebuild
 
-def bulk_cache_delete(keys):
-    """Delete multiple cache keys efficiently"""
-    pipeline = cache.client.pipeline(transaction=True)
-    for key in keys:
-        pipeline.delete(key)
-    pipeline.execute()
+def _invalidate_on_commit(keys, tags, bump_global=False):
+    """Run invalidation after the surrounding transaction commits"""
+    queue_invalidation(keys, tags, bump_global)
 
 @receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=DigitalProduct)
 def invalidate_product_cache(sender, instance, **kwargs):
+    changed = getattr(instance, '_changed_fields', None)
+    if kwargs.get('signal') is post_save and changed is not None and changed <= STOCK_FIELDS:
+        # Stock is not part of any cached listing, and product pages read it live
+        transaction.on_commit(lambda: record_invalidation_stat('stock_only'))
+        return
+
     keys_to_delete = [
         CacheKeyBuilder.product_key(instance.id),
-        CacheKeyBuilder.store_page_key(instance.category.slug),
-        CacheKeyBuilder.store_page_key(),
+        CacheKeyBuilder.product_recommendations_key(instance.id),
+        CacheKeyBuilder.department_recommendations_key(instance.category.name),
+    ]
+    tags = [
+        CacheTags.CATALOG,
+        CacheTags.product(instance.id),
+        CacheTags.category(instance.category.slug),
     ]
-    
-    # Invalidate related recommendations
-    if hasattr(instance, 'recommendations'):
-        keys_to_delete.extend([
-            CacheKeyBuilder.product_recommendations_key(instance.id),
-            CacheKeyBuilder.department_recommendations_key(instance.category.name)
-        ])
-    
-    bulk_cache_delete(keys_to_delete)
-    cache.incr('global_version')
+
+    _invalidate_on_commit(keys_to_delete, tags, bump_global=True)
+
+@receiver([post_save, post_delete], sender=ProductRecommendation)
+def update_recommendation_summary(sender, instance, **kwargs):
+    # Same transaction as the change, so listings never see a stale summary
+    refresh_recommendation_summaries([instance.product_id])
 
 @receiver([post_save, post_delete], sender=ProductRecommendation)
 def invalidate_recommendation_cache(sender, instance, **kwargs):
+    faculty = instance.faculty
+    product = instance.product
     keys_to_delete = [
         CacheKeyBuilder.product_recommendations_key(instance.product_id),
-        CacheKeyBuilder.faculty_recommendations_key(instance.faculty_id),
-        CacheKeyBuilder.department_recommendations_key(instance.faculty.department),
-        CacheKeyBuilder.store_page_key()
+        CacheKeyBuilder.faculty_recommendations_key(faculty.user_id),
+        CacheKeyBuilder.department_recommendations_key(faculty.department),
     ]
-    bulk_cache_delete(keys_to_delete)
\ No newline at end of file
+    tags = [
+        CacheTags.CATALOG,
+        CacheTags.product(instance.product_id),
+        CacheTags.category(product.category.slug),
+        CacheTags.department(faculty.department),
+        CacheTags.faculty(faculty.user_id),
+    ]
+    _invalidate_on_commit(keys_to_delete, tags)
+
+@receiver(post_delete, sender=ProductReview)
+def remove_review_rating(sender, instance, **kwargs):
+    removed = getattr(instance, '_stored_rating', instance.rating)
+    Product.apply_rating_change(instance.product_id, removed=int(removed))
+
+@receiver([post_save, post_delete], sender=ProductReview)
+def invalidate_review_cache(sender, instance, **kwargs):
+    # Store and category cards show the average rating too
+    tags = [CacheTags.CATALOG, CacheTags.product(instance.product_id)]
+    slug = Product.objects.filter(id=instance.product_id).values_list('category__slug', flat=True).first()
+    if slug is not None:
+        tags.append(CacheTags.category(slug))
+    _invalidate_on_commit([CacheKeyBuilder.product_key(instance.product_id)], tags)
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=DigitalProduct)
+def update_search_document(sender, instance, created, **kwargs):
+    changed = getattr(instance, '_changed_fields', None)
+    if not created and changed is not None and not changed & SEARCH_FIELDS:
+        return
+    product_id = instance.id
+    transaction.on_commit(lambda: index_products([product_id]))
+
+@receiver(post_delete, sender=Product)
+def remove_search_document(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: remove_products([product_id]))
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if created:
+        return
+    # Category names are part of every product document in the category
+    transaction.on_commit(lambda: index_products(
+        Product.objects.filter(category_id=instance.id).values_list('id', flat=True)
+    ))
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    # Category lists and store pages (card urls carry the category slug)
+    _invalidate_on_commit([], [CacheTags.CATEGORY, CacheTags.CATALOG, CacheTags.category(instance.slug)])
+
+def _refresh_recommender_summaries(faculty_user_id):
+    # Store cards show recommender names and departments from the product summary
+    if refresh_recommendation_summaries(recommended_by(faculty_user_id)):
+        _invalidate_on_commit([], [CacheTags.CATALOG])
+
+@receiver([post_save, post_delete], sender=Faculty)
+def invalidate_faculty_cache(sender, instance, **kwargs):
+    if kwargs.get('signal') is post_save:
+        _refresh_recommender_summaries(instance.user_id)
+    _invalidate_on_commit([], [CacheTags.FACULTY])
+
+@receiver(post_save, sender=Account)
+def invalidate_faculty_names(sender, instance, update_fields=None, **kwargs):
+    # The faculty directory shows account names; logins only touch last_login
+    if instance.is_faculty and set(update_fields or ()) != {'last_login'}:
+        _refresh_recommender_summaries(instance.id)
+        _invalidate_on_commit([], [CacheTags.FACULTY])
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=DigitalProduct)
+def generate_product_image_derivatives(sender, instance, created, **kwargs):
+    changed = getattr(instance, '_changed_fields', None)
+    if not created and changed is not None and 'image' not in changed:
+        return
+    name = instance.image.name
+    transaction.on_commit(lambda: schedule_derivatives([name]))
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+def generate_image_derivatives(sender, instance, **kwargs):
+    # Unchanged images are skipped by their content hash
+    name = instance.image.name
+    transaction.on_commit(lambda: schedule_derivatives([name]))
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=DigitalProduct)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ProductRecommendation)
+@receiver([post_save, post_delete], sender=ProductReview)
+def rebuild_catalog_snapshot(sender, instance, **kwargs):
+    changed = getattr(instance, '_changed_fields', None)
+    if kwargs.get('signal') is post_save and changed is not None and changed <= STOCK_FIELDS:
+        # The snapshot holds no stock
+        return
+    # Rebuilds requested while one runs, in any process, fold into a single follow-up
+    transaction.on_commit(schedule_snapshot_rebuild)
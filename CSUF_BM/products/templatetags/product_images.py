@@ -0,0 +1,23 @@
+from django import template
+from ..utils.images import image_sources
+
+register = template.Library()
+
+
+@register.inclusion_tag('store/partials/picture.html')
+def responsive_image(image, size='card', alt='', css_class='', style='', lazy=True, sources=None):
+    """
+    <picture> with WebP and resized srcsets for an image field or name.
+    Pass sources from image_sources() when rendering many images so the
+    manifest is read once per page instead of once per image.
+    """
+    name = getattr(image, 'name', image)
+    if sources is None:
+        sources = image_sources([name], size)
+    return {
+        'image': sources.get(name),
+        'alt': alt,
+        'css_class': css_class,
+        'style': style,
+        'lazy': lazy,
+    }
@@ -1,3 +1,1337 @@
-from django.test import TestCase
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+import itertools
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import Account, Faculty
+from .models import (
+    Category, CoPurchaseCount, CoPurchaseRun, DigitalProduct, FrequentlyBoughtTogether, ImageDerivatives, Product,
+    ProductRecommendation, ProductReview, ProductSearchDocument, version_sort_key,
+)
+from .utils.catalog_io import export_rows, import_catalog, read_rows, write_rows
+from .utils.copurchase import bought_together, bought_together_for_cart, build_copurchases, count_pairs, top_neighbours
+from .utils.images import generate_derivatives, image_sources
+from .utils.metrics import MetricsRegistry, registry
+from .utils.queries import QueryBudgetMixin, QueryRecorder, normalize_sql
+from .utils.pagination import STORE_CARD_FIELDS, STORE_SORT_ORDERINGS, fetch_snapshot_page, fetch_store_page
+from .utils.ratings import reconcile_ratings
+from .utils.recommendations import refresh_recommendation_summaries
+from .utils.reference import get_categories, reference_cache
+from .utils.search import InvertedIndex, parse_query, rebuild_index, search_documents, search_product_ids
+from .utils.snapshot import REBUILD_LOCK_KEY, REBUILD_PENDING_KEY, build_snapshot, get_snapshot, rebuild_snapshot
+from .utils.store_filters import store_order_by, store_queryset
+from .utils.synthetic import generate
+from .utils.tiered_cache import LocalLRUCache, TieredCache
+from .utils import db_routing
+from .views import categories_processor
+from .utils.cache import (
+    CacheKeyBuilder, CacheTags, StampedePolicy, close_invalidation_windows, coalesce_invalidations,
+    get_invalidation_stats, get_or_set_cache, get_or_set_tagged, get_stampede_stats, invalidate_tags,
+    make_tagged_key,
+)
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CacheTagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_store_page_key_is_stable(self):
+        params = {'sort_by': 'price', 'department': 'Math', 'essential_only': False}
+        reordered = dict(reversed(list(params.items())))
+        self.assertEqual(
+            CacheKeyBuilder.store_page_key('books', params),
+            CacheKeyBuilder.store_page_key('books', reordered),
+        )
+        # Known digest guards against a per-process salt sneaking back in
+        self.assertEqual(CacheKeyBuilder.stable_hash({'a': 1}), 'bb6cb5c68df46529')
+
+    def test_invalidate_tag_orphans_registered_entries(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        tags = [CacheTags.category('books'), CacheTags.CATALOG]
+        self.assertEqual(get_or_set_tagged('listing', compute, tags), 1)
+        self.assertEqual(get_or_set_tagged('listing', compute, tags), 1)
+
+        invalidate_tags(CacheTags.category('books'))
+        self.assertEqual(get_or_set_tagged('listing', compute, tags), 2)
+
+    def test_unrelated_tag_leaves_entry_alone(self):
+        key = make_tagged_key('listing', [CacheTags.category('books')])
+        invalidate_tags(CacheTags.category('games'), CacheTags.faculty(7))
+        self.assertEqual(key, make_tagged_key('listing', [CacheTags.category('books')]))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FieldAwareInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Notebook', slug='notebook', price='5.00', image='photos/products/n.jpg',
+            stock=3, category=self.category,
+        )
+        self.catalog_key = make_tagged_key('listing', [CacheTags.CATALOG])
+
+    def test_stock_only_save_skips_invalidation(self):
+        product = Product.objects.get(id=self.product.id)
+        product.stock = 7
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        self.assertEqual(make_tagged_key('listing', [CacheTags.CATALOG]), self.catalog_key)
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['UPDATE'])
+        self.assertEqual(get_invalidation_stats()['stock_only'], 1)
+
+    def test_price_change_invalidates_catalog(self):
+        product = Product.objects.get(id=self.product.id)
+        product.price = Decimal('6.00')
+        product.stock = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertNotEqual(make_tagged_key('listing', [CacheTags.CATALOG]), self.catalog_key)
+
+    def test_digital_product_edits_invalidate_catalog(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            digital = DigitalProduct.objects.create(
+                name='Stats Toolkit', slug='stats', price='10.00', image='photos/products/s.jpg',
+                stock=-1, category=self.category, version='1.0', download_link='https://example.com/s',
+                file_size='1MB', system_requirements='Any',
+            )
+        catalog_key = make_tagged_key('listing', [CacheTags.CATALOG])
+        product_key = make_tagged_key('detail', [CacheTags.product(digital.id)])
+
+        digital = DigitalProduct.objects.get(id=digital.id)
+        digital.price = Decimal('12.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            digital.save()
+        self.assertNotEqual(make_tagged_key('listing', [CacheTags.CATALOG]), catalog_key)
+        self.assertNotEqual(make_tagged_key('detail', [CacheTags.product(digital.id)]), product_key)
+
+        catalog_key = make_tagged_key('listing', [CacheTags.CATALOG])
+        with self.captureOnCommitCallbacks(execute=True):
+            digital.delete()
+        self.assertNotEqual(make_tagged_key('listing', [CacheTags.CATALOG]), catalog_key)
+
+    def test_burst_is_coalesced(self):
+        with coalesce_invalidations():
+            for price in ('6.00', '7.00', '8.00'):
+                self.product.price = Decimal(price)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.product.save()
+            # Nothing is applied until the batch closes
+            self.assertEqual(make_tagged_key('listing', [CacheTags.CATALOG]), self.catalog_key)
+
+        self.assertEqual(cache.get(CacheKeyBuilder.tag_version_key(CacheTags.CATALOG)), 2)
+        stats = get_invalidation_stats()
+        self.assertEqual((stats['requested'], stats['applied'], stats['avoided']), (3, 1, 2))
+
+
+    @override_settings(CACHE_INVALIDATION_WINDOW=60)
+    def test_bursts_across_requests_are_debounced(self):
+        version_key = CacheKeyBuilder.tag_version_key(CacheTags.CATALOG)
+        with mock.patch('products.utils.cache.threading.Timer') as timer:
+            for price in ('6.00', '7.00', '8.00'):
+                self.product.price = Decimal(price)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.product.save()
+                # The first edit applies at once; the rest wait for the window
+                self.assertEqual(cache.get(version_key), 2)
+
+        self.assertEqual(timer.call_count, 1)
+        window, close, (opened,) = timer.call_args.args
+        self.assertEqual((window, close), (60, close_invalidation_windows))
+        close_invalidation_windows(opened)
+        self.assertEqual(cache.get(version_key), 3)
+        # Catalog, product and category tags each skipped the third bump
+        self.assertEqual(get_invalidation_stats()['debounced'], 3)
+
+        # A closed window lets the next edit through at once
+        self.product.price = Decimal('9.00')
+        with mock.patch('products.utils.cache.threading.Timer'), self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(cache.get(version_key), 4)
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class StampedeProtectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_single_flight_on_miss(self):
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_set_cache('hot', slow)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(get_stampede_stats()['lock_waits'], 4)
+
+    def test_none_results_are_cached_for_waiters(self):
+        calls = []
+
+        def slow_none():
+            calls.append(1)
+            time.sleep(0.2)
+            return None
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_set_cache('empty', slow_none)))
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((len(calls), results), (1, [None] * 3))
+        self.assertIsNone(get_or_set_cache('empty', slow_none))
+        self.assertEqual(len(calls), 1)
+
+    def test_waiters_stop_when_the_lock_is_released(self):
+        lock_key = CacheKeyBuilder.cache_lock_key('hot')
+        cache.add(lock_key, 'other-worker')
+        threading.Timer(0.1, cache.delete, [lock_key]).start()
+
+        started = time.monotonic()
+        self.assertEqual(get_or_set_cache('hot', lambda: 'mine', wait_timeout=5), 'mine')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_xfetch_refreshes_early_only_near_expiry(self):
+        policy = StampedePolicy(beta=1.0)
+        self.assertFalse(policy.should_refresh({'expires_at': time.time() + 3600, 'delta': 0.01}))
+        self.assertTrue(policy.should_refresh({'expires_at': time.time() - 1, 'delta': 0.01}))
+        # A value that takes as long to compute as it has left nearly always refreshes
+        with mock.patch('products.utils.cache.random.random', return_value=0.5):
+            self.assertTrue(policy.should_refresh({'expires_at': time.time() + 1, 'delta': 5}))
+        self.assertFalse(StampedePolicy(beta=0).should_refresh({'expires_at': time.time() + 1, 'delta': 5}))
+
+    def test_stale_value_served_while_another_worker_refreshes(self):
+        get_or_set_cache('listing', lambda: 'old', timeout=60, stale_ttl=600)
+        meta_key = CacheKeyBuilder.cache_meta_key('listing')
+        cache.set(meta_key, {'expires_at': time.time() - 1, 'delta': 0.1})
+        cache.add(CacheKeyBuilder.cache_lock_key('listing'), 'other-worker')
+
+        self.assertEqual(get_or_set_cache('listing', lambda: 'new', timeout=60, stale_ttl=600), 'old')
+        self.assertEqual(get_stampede_stats()['stale_served'], 1)
+
+        cache.delete(CacheKeyBuilder.cache_lock_key('listing'))
+        self.assertEqual(get_or_set_cache('listing', lambda: 'new', timeout=60, stale_ttl=600), 'new')
+
+    @override_settings(CACHE_STAMPEDE_POLICIES={'store_page': {'beta': 0}})
+    def test_policy_by_key_prefix(self):
+        self.assertEqual(StampedePolicy.for_key('store_page_books').beta, 0)
+        self.assertEqual(StampedePolicy.for_key('store_page_books', beta=2).beta, 2)
+        self.assertEqual(StampedePolicy.for_key('all_categories').beta, 1.0)
+
+    def test_plain_cache_set_values_are_hits(self):
+        cache.set('all_categories', ['Books'])
+        self.assertEqual(get_or_set_cache('all_categories', lambda: ['fresh']), ['Books'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, REFERENCE_CACHE_CHECK_INTERVAL=0)
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reference_cache.clear()
+        Category.objects.create(name='Books', slug='books')
+
+    def test_tiers_and_counters(self):
+        worker = TieredCache('test')
+        other = TieredCache('test')
+        self.assertEqual(worker.get_or_set('k', lambda: 'v', ['t']), 'v')
+        self.assertEqual(worker.get_or_set('k', lambda: 'x', ['t']), 'v')
+        self.assertEqual(other.get_or_set('k', lambda: 'x', ['t']), 'v')
+        self.assertEqual(worker.stats, {'l1_hits': 1, 'l1_misses': 1, 'l2_hits': 0, 'l2_misses': 1})
+        self.assertEqual(other.stats, {'l1_hits': 0, 'l1_misses': 1, 'l2_hits': 1, 'l2_misses': 0})
+
+    def test_tag_bump_reaches_every_process(self):
+        worker = TieredCache('test')
+        worker.get_or_set('k', lambda: 'old', ['t'])
+        invalidate_tags('t')
+        self.assertEqual(worker.get_or_set('k', lambda: 'new', ['t']), 'new')
+
+        # Within the check interval the remembered versions are trusted
+        relaxed = TieredCache('test', check_interval=60)
+        relaxed.get_or_set('k', lambda: 'new', ['t'])
+        invalidate_tags('t')
+        self.assertEqual(relaxed.get_or_set('k', lambda: 'newer', ['t']), 'new')
+
+    def test_local_tier_is_bounded(self):
+        local = LocalLRUCache(maxsize=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual(len(local), 2)
+        with mock.patch('products.utils.tiered_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(local.get('a'))
+
+    def test_categories_follow_saves_without_queries_when_warm(self):
+        self.assertEqual([c.name for c in get_categories()], ['Books'])
+        with self.assertNumQueries(0):
+            categories_processor(None)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Art', slug='art')
+        self.assertEqual([c.name for c in get_categories()], ['Art', 'Books'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_workers_flush_into_shared_totals(self):
+        labels = {'route': 'store/', 'method': 'GET'}
+        workers = [MetricsRegistry(), MetricsRegistry()]
+        for worker, seconds in zip(workers, (0.003, 0.3)):
+            worker.observe('http_request_duration_seconds', seconds, labels)
+            worker.inc('http_requests_total', labels)
+            worker.flush()
+
+        text = workers[0].render_text()
+        self.assertIn('http_requests_total{method="GET",route="store/"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{le="0.005",method="GET",route="store/"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="store/"} 2', text)
+        self.assertNotIn('_quantile', text)
+
+    def test_recording_stays_within_overhead_budget(self):
+        worker = MetricsRegistry(flush_interval=3600)
+        labels = {'route': 'store/', 'method': 'GET'}
+        rounds = 2000
+        started = time.perf_counter()
+        for _ in range(rounds):
+            worker.observe('http_request_duration_seconds', 0.02, labels)
+            worker.inc('http_requests_total', {**labels, 'status': '2xx'})
+            worker.maybe_flush()
+        per_request_us = (time.perf_counter() - started) / rounds * 1_000_000
+        self.assertLess(per_request_us, 50)
+
+    def test_endpoint_is_opt_in(self):
+        registry.inc('http_requests_total', {'route': 'metrics/', 'method': 'GET', 'status': '2xx'})
+        # Not even local requests, which is what proxied ones look like
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.9']):
+            response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.9')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'http_requests_total{method="GET",route="metrics/",status="2xx"}', response.content)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+        with self.settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer guess').status_code, 404)
+
+    def test_query_count_header_is_opt_in(self):
+        Category.objects.create(name='Books', slug='books')
+        self.assertNotIn('X-DB-Queries', self.client.get(reverse('store')))
+        # The middleware reads the setting when the handler is built
+        with override_settings(QUERY_COUNT_HEADER=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = Client().get(reverse('store'))
+        self.assertEqual(int(response['X-DB-Queries']), len(queries))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class QueryInspectionTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Pen', slug='pen', price='2.00', image='photos/products/p.jpg', stock=5, category=self.books,
+        )
+
+    def test_shapes_collapse_literals_and_in_lists(self):
+        self.assertEqual(
+            normalize_sql('SELECT "a"."id" FROM "a" WHERE "a"."id" IN (%s, %s, %s) AND "a"."name" = \'x\' LIMIT 21'),
+            'SELECT "a"."id" FROM "a" WHERE "a"."id" IN (...) AND "a"."name" = ? LIMIT ?',
+        )
+
+    def test_lazy_relation_reads_are_grouped_by_call_site(self):
+        from cart.models import Cart, CartItem
+
+        cart = Cart.objects.create()
+        for i in range(3):
+            product = Product.objects.create(
+                name=f'Ink {i}', slug=f'ink-{i}', price='1.00', image='photos/products/i.jpg', stock=5, category=self.books,
+            )
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+        recorder = QueryRecorder()
+        with recorder.active():
+            sum(item.subtotal for item in CartItem.objects.filter(cart=cart))
+        (shape, count, _, sites), = recorder.repeated()
+        self.assertEqual(count, 3)
+        self.assertIn('FROM "products_product"', shape)
+        (site,) = sites
+        self.assertTrue(site.startswith('cart/models.py:') and site.endswith(' in subtotal'), site)
+
+    def test_product_detail_reviews_stay_within_budget(self):
+        for i in range(4):
+            user = Account.objects.create_user(
+                username=f'r{i}', email=f'r{i}@example.edu', password='pw', first_name='R', last_name=str(i),
+            )
+            ProductReview.objects.create(product=self.product, user=user, rating=4, review='Fine')
+        response = self.assertQueryBudget('product_detail', args=['books', 'pen'], max_repeats=2)
+        self.assertContains(response, 'Fine', count=4)
+        self.assertQueryBudget('store', max_repeats=2)
+
+    def test_category_page_and_dashboard_stay_within_budget(self):
+        from checkout.models import Order, OrderProduct
+
+        for i in range(3):
+            Product.objects.create(
+                name=f'Ink {i}', slug=f'ink-{i}', price='1.00', image='photos/products/i.jpg', stock=5, category=self.books,
+            )
+        response = self.assertQueryBudget('products_by_category', args=['books'], max_repeats=2)
+        self.assertContains(response, 'Ink 2')
+
+        user = Account.objects.create_user(
+            username='buyer', email='buyer@example.edu', password='pw', first_name='B', last_name='Uyer',
+        )
+        for number in ('D1', 'D2'):
+            order = Order.objects.create(
+                user=user, order_number=number, first_name='B', last_name='Uyer', email='buyer@example.edu',
+                phone='1234567890', address_line_1='1 St', city='Fullerton', state='CA', country='US',
+                zipcode='92831', order_total='10.00', tax='1.00', is_ordered=True, payment_status='PAID',
+            )
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=product, quantity=1, product_price='1.00', ordered=True)
+                for product in Product.objects.all()
+            ])
+        self.client.force_login(user)
+        response = self.assertQueryBudget('dashboard', max_repeats=2)
+        self.assertContains(response, 'D2')
+
+    @override_settings(QUERY_INSPECTION=True, QUERY_BUDGETS={'store': 1})
+    def test_inspection_mode_reports_time_and_budget_overruns(self):
+        with self.assertLogs('products.middleware', 'WARNING') as logs:
+            response = Client().get(reverse('store'))
+        self.assertGreater(int(response['X-DB-Queries']), 1)
+        self.assertTrue(response['X-DB-Time'].endswith('ms'))
+        self.assertIn('store ran', logs.output[0])
+        self.assertIn('products/utils/pagination.py', logs.output[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class RecommendationSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        books = Category.objects.create(name='Books', slug='books')
+        self.pen, self.ink, self.paper = (
+            Product.objects.create(
+                name=name, slug=name.lower(), price='2.00', image='photos/products/s.jpg', stock=5, category=books,
+            )
+            for name in ('Pen', 'Ink', 'Paper')
+        )
+        self.ada = self._faculty('ada', 'Ada', 'Lovelace', 'Math')
+        self.alan = self._faculty('alan', 'Alan', 'Turing', 'Computer Science')
+
+    def _faculty(self, username, first_name, last_name, department):
+        user = Account.objects.create_user(
+            username=username, email=f'{username}@example.edu', password='pw',
+            first_name=first_name, last_name=last_name, is_faculty=True,
+        )
+        return Faculty.objects.create(user=user, faculty_id=username, department=department, position='Professor')
+
+    def _recommend(self, product, faculty, essential=False):
+        return ProductRecommendation.objects.create(
+            product=product, faculty=faculty, recommendation_text='Useful', is_essential=essential,
+        )
+
+    def test_signals_keep_the_summary_current(self):
+        self._recommend(self.pen, self.ada)
+        latest = self._recommend(self.pen, self.alan, essential=True)
+        pen = Product.objects.get(id=self.pen.id)
+        self.assertEqual(pen.recommendation_count, 2)
+        self.assertTrue(pen.has_essential_recommendation)
+        self.assertEqual(pen.recommendation_departments, '|Computer Science|Math|')
+        self.assertEqual(pen.recent_recommenders[0], {
+            'name': 'Alan Turing', 'department': 'Computer Science', 'is_essential': True,
+        })
+
+        latest.delete()
+        self.ada.department = 'Physics'
+        self.ada.save()
+        self.ada.user.last_name = 'King'
+        self.ada.user.save()
+        pen = Product.objects.get(id=self.pen.id)
+        self.assertEqual(pen.recommendation_count, 1)
+        self.assertFalse(pen.has_essential_recommendation)
+        self.assertEqual(pen.recommendation_departments, '|Physics|')
+        self.assertEqual(pen.recommender_names, 'Ada King')
+
+        Product.objects.filter(id=self.pen.id).update(recommendation_count=9)
+        self.assertEqual(refresh_recommendation_summaries(), 1)
+        self.assertEqual(Product.objects.get(id=self.pen.id).recommendation_count, 1)
+
+    def test_store_filters_and_sorts_without_joining_recommendations(self):
+        self._recommend(self.pen, self.ada, essential=True)
+        self._recommend(self.ink, self.alan)
+        self._recommend(self.ink, self.ada)
+
+        def names(query):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('store'), query)
+            self.assertFalse([q['sql'] for q in queries if 'productrecommendation' in q['sql']])
+            return [card['name'] for card in response.context['products']]
+
+        self.assertEqual(names({'department': 'Math'}), ['Ink', 'Pen'])
+        self.assertEqual(names({'department': 'Computer Science'}), ['Ink'])
+        self.assertEqual(names({'faculty_search': 'turing'}), ['Ink'])
+        self.assertEqual(names({'essential_only': 'on'}), ['Pen'])
+        self.assertEqual(names({'recommended_only': 'on', 'sort_by': 'recommendations'}), ['Ink', 'Pen'])
+        self.assertEqual(names({'sort_by': 'recommendations'}), ['Ink', 'Pen', 'Paper'])
+
+
+class StoreFilterCompilerTests(TestCase):
+    FILTER_VALUES = {'department': 'Math', 'faculty_search': 'ada', 'essential_only': True, 'recommended_only': True}
+
+    def _queries(self):
+        """(filters, sort_by, page query) for every filter combination and sort"""
+        for enabled in itertools.product((False, True), repeat=len(self.FILTER_VALUES)):
+            filters = {
+                name: value if on else type(value)()
+                for (name, value), on in zip(self.FILTER_VALUES.items(), enabled)
+            }
+            for sort_by in STORE_SORT_ORDERINGS:
+                queryset = store_queryset(filters).order_by(*store_order_by(filters, sort_by))
+                yield filters, sort_by, queryset.values(*STORE_CARD_FIELDS)[:25]
+
+    def test_filters_never_join_or_deduplicate(self):
+        for filters, sort_by, queryset in self._queries():
+            sql = str(queryset.query)
+            self.assertNotIn('DISTINCT', sql, (filters, sort_by))
+            self.assertNotIn('productrecommendation', sql, (filters, sort_by))
+            self.assertNotIn('accounts_', sql, (filters, sort_by))
+
+    def test_filtered_pages_sort_on_unindexed_expressions(self):
+        for filters, sort_by, queryset in self._queries():
+            first_key = str(queryset.query).split(' ORDER BY ')[1].split(',')[0]
+            hidden = any(filters.values()) and sort_by != 'recommendations'
+            self.assertEqual('COALESCE(' in first_key, hidden, (filters, sort_by, first_key))
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads SQLite EXPLAIN QUERY PLAN output')
+    def test_plan_shape_is_fixed(self):
+        for filters, sort_by, queryset in self._queries():
+            plan = queryset.explain()
+            products = [line for line in plan.splitlines() if 'products_product' in line]
+            self.assertEqual(len(products), 1, plan)
+            if any(filters.values()):
+                # Start from the recommended products, then sort the matches
+                self.assertIn('SEARCH products_product USING INDEX product_recommended_idx', products[0], plan)
+            else:
+                # Walk the sort's own index; no sort step
+                self.assertIn('SCAN products_product USING INDEX', products[0], plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+    @skipUnless(connection.vendor == 'mysql', 'reads MySQL EXPLAIN output')
+    def test_mysql_plan_starts_from_recommended_products(self):
+        for filters, sort_by, queryset in self._queries():
+            if any(filters.values()):
+                self.assertIn('product_recommended_idx', queryset.explain(), (filters, sort_by))
+
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        db_routing.health.reset()
+
+    def test_reads_follow_the_routing_block_until_a_write(self):
+        router = db_routing.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with db_routing.routing('replica') as state:
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_read(Session), 'default')
+            self.assertEqual(router.db_for_write(Product), 'default')
+            self.assertTrue(state.wrote)
+            self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertIsNone(db_routing.current_state())
+
+    @override_settings(DATABASE_REPLICAS=['replica'], REPLICA_CHECK_INTERVAL=0, REPLICA_MAX_LAG_SECONDS=2)
+    def test_lagging_or_failing_replicas_are_skipped(self):
+        with mock.patch.object(db_routing, 'replica_lag', return_value=0.5):
+            self.assertEqual(db_routing.choose_replica(), 'replica')
+        with mock.patch.object(db_routing, 'replica_lag', return_value=30.0), self.assertLogs(db_routing.logger):
+            self.assertIsNone(db_routing.choose_replica())
+        with mock.patch.object(db_routing, 'replica_lag', return_value=0.5) as lag:
+            # Still within REPLICA_RETRY_SECONDS
+            self.assertIsNone(db_routing.choose_replica())
+            lag.assert_not_called()
+
+        db_routing.health.reset()
+        with mock.patch.object(db_routing, 'replica_lag', side_effect=OperationalError('gone away')), \
+                self.assertLogs(db_routing.logger) as logs:
+            self.assertIsNone(db_routing.choose_replica())
+        self.assertIn('unavailable: gone away', logs.output[0])
+
+    def test_replica_lag_on_sqlite_only_checks_the_connection(self):
+        self.assertIsNone(db_routing.replica_lag('default'))
+
+
+REPLICA_MIDDLEWARE = ['products.middleware.ReplicaRoutingMiddleware', *settings.MIDDLEWARE]
+# The test runner sets up every alias a test class names, skipped or not
+HAS_REPLICA = 'replica' in settings.DATABASES
+
+
+@skipUnless(HAS_REPLICA, "needs a second database aliased 'replica'")
+@override_settings(
+    CACHES=LOCMEM_CACHE, MIDDLEWARE=REPLICA_MIDDLEWARE, DATABASE_REPLICAS=['replica'],
+    DATABASE_ROUTERS=['products.utils.db_routing.ReplicaRouter'],
+)
+class ReplicaRoutingTests(TestCase):
+    """Two SQLite databases, each holding a product the other lacks"""
+    databases = {'default', 'replica'} if HAS_REPLICA else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        db_routing.health.reset()
+        for alias, name in (('default', 'Primary Pen'), ('replica', 'Replica Pen')):
+            books = Category.objects.using(alias).create(id=1, name='Books', slug='books')
+            Product.objects.using(alias).create(
+                id=1, name=name, slug='pen', price='2.00', image='photos/products/s.jpg', stock=5, category=books,
+            )
+        self.client = Client()
+
+    def _store(self):
+        cache.clear()
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('store'))
+        names = [card['name'] for card in response.context['products']]
+        return names, len(replica_queries)
+
+    def test_read_only_views_read_from_the_replica(self):
+        names, replica_queries = self._store()
+        self.assertEqual(names, ['Replica Pen'])
+        self.assertGreater(replica_queries, 0)
+
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.client.get(reverse('cart_detail'))
+        self.assertEqual(len(queries), 0)
+
+    def test_writers_read_the_primary_for_a_while(self):
+        response = self.client.post(reverse('add_to_cart', args=[1]))
+        self.assertIn(db_routing.STICKY_COOKIE, response.cookies)
+        self.assertEqual(self._store(), (['Primary Pen'], 0))
+
+        self.client.cookies[db_routing.STICKY_COOKIE] = str(time.time() - 1)
+        self.assertEqual(self._store()[0], ['Replica Pen'])
+
+    def test_invalidations_hold_replica_reads_until_they_catch_up(self):
+        with override_settings(REPLICA_MAX_LAG_SECONDS=60):
+            with self.captureOnCommitCallbacks(execute=True):
+                Category.objects.get(id=1).save()
+            # The invalidation already outdated every cached page
+            response = self.client.get(reverse('store'))
+            self.assertEqual([card['name'] for card in response.context['products']], ['Primary Pen'])
+
+    def test_falls_back_to_the_primary_when_the_replica_lags_or_fails(self):
+        with mock.patch.object(db_routing, 'replica_lag', return_value=120.0), self.assertLogs(db_routing.logger):
+            self.assertEqual(self._store(), (['Primary Pen'], 0))
+
+        from checkout.models import Order
+
+        db_routing.health.reset()
+        Order.objects.create(
+            order_number='R1', first_name='A', last_name='B', email='a@b.com', phone='1234567890',
+            address_line_1='1 St', city='Fullerton', state='CA', country='US', zipcode='92831',
+            order_total='10.00', tax='1.00',
+        )
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('DROP TABLE checkout_order')
+        with self.assertLogs(db_routing.logger):
+            response = self.client.get(reverse('order_status', args=['R1']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['order'].order_number, 'R1')
+        self.assertEqual(self._store(), (['Primary Pen'], 0))
+
+        # Views that turn errors into redirects still hand replica failures back
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('DROP TABLE products_product')
+        db_routing.health.reset()
+        with self.assertLogs(db_routing.logger):
+            self.assertEqual(self._store()[0], ['Primary Pen'])
+        self.assertFalse(db_routing.health.is_usable('replica'))
+
+        db_routing.health.reset()
+        with self.assertLogs(db_routing.logger):
+            response = self.client.get(reverse('product_detail', args=['books', 'pen']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['single_product'].name, 'Primary Pen')
+        self.assertFalse(db_routing.health.is_usable('replica'))
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Books', slug='books')
+        # Repeated prices exercise the id tie-breaker
+        for i in range(7):
+            Product.objects.create(
+                name=f'Book {i}', slug=f'book-{i}', price=f'{i % 3}.00', image='photos/products/b.jpg',
+                stock=5, category=category,
+            )
+
+    def _walk(self, sort_by):
+        ids, cursor = [], None
+        while True:
+            page = fetch_store_page(Product.objects.all(), sort_by, cursor, page_size=3)
+            self.assertLessEqual(len(page['products']), 3)
+            ids += [product['id'] for product in page['products']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_every_sort_exactly_once(self):
+        for sort_by, ordering in STORE_SORT_ORDERINGS.items():
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(self._walk(sort_by), expected, sort_by)
+
+    def test_page_is_plain_cacheable_data(self):
+        # Page (recommenders come from the product row), image manifest
+        with self.assertNumQueries(2):
+            page = fetch_store_page(Product.objects.all(), 'price', None, page_size=3)
+        card = page['products'][0]
+        self.assertEqual(card['url'], Product.objects.get(id=card['id']).get_url())
+        self.assertEqual(card['recommendation_count'], 0)
+
+    def test_cursor_from_another_sort_restarts(self):
+        cursor = fetch_store_page(Product.objects.all(), 'price', None, page_size=3)['next_cursor']
+        page = fetch_store_page(Product.objects.all(), 'name', cursor, page_size=3)
+        self.assertEqual(page['products'][0]['name'], 'Book 0')
+
+
+@override_settings(CACHES=LOCMEM_CACHE, PRODUCT_SEARCH_BACKEND='inverted')
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Calculators', slug='calculators')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.graphing = Product.objects.create(
+                name='Graphing Calculator', slug='graphing', price='99.00', image='photos/products/g.jpg',
+                stock=5, category=self.category, brand='Texas Instruments',
+            )
+            self.notebook = Product.objects.create(
+                name='Spiral Notebook', slug='notebook', price='3.00', image='photos/products/n.jpg',
+                stock=5, category=self.category, description='Graph paper for calculus',
+            )
+
+    def test_prefix_wildcard_and_ranking(self):
+        # Title hits outrank description hits
+        self.assertEqual(search_product_ids('graph'), [self.graphing.id, self.notebook.id])
+        self.assertEqual(search_product_ids('calc*lator'), [self.graphing.id])
+        self.assertEqual(search_product_ids('*book'), [self.notebook.id])
+        self.assertEqual(search_product_ids('texas graph'), [self.graphing.id])
+        self.assertEqual(search_product_ids('   '), [])
+
+    def test_document_queryset_matches_the_index(self):
+        for query in ('graph', 'calc*lator', '*book', 'texas graph', 'nothing', '   '):
+            matched = search_documents(query).values_list('product_id', flat=True)
+            self.assertEqual(sorted(matched), sorted(search_product_ids(query)), query)
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notebook.name = 'Composition Book'
+            self.notebook.save()
+        self.assertEqual(search_product_ids('composition'), [self.notebook.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.graphing.delete()
+        self.assertEqual(search_product_ids('texas'), [])
+        self.assertEqual(rebuild_index(), 1)
+
+    def test_stock_change_does_not_reindex(self):
+        with mock.patch('products.signals.index_products') as index_products:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.notebook.stock = 1
+                self.notebook.save()
+        index_products.assert_not_called()
+
+    def test_digital_products_are_indexed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            digital = DigitalProduct.objects.create(
+                name='Stats Toolkit', slug='stats', price='10.00', image='photos/products/s.jpg',
+                stock=0, category=self.category, version='1.0', download_link='https://example.com/s',
+                file_size='1MB', system_requirements='Any',
+            )
+        self.assertTrue(ProductSearchDocument.objects.filter(product_id=digital.id).exists())
+        self.assertEqual(search_product_ids('toolkit'), [digital.id])
+
+    def test_storefront_search_page(self):
+        response = self.client.get(reverse('product_search'), {'q': 'calc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([card['id'] for card in response.context['products']], [self.graphing.id, self.notebook.id])
+
+    def test_inverted_index_intersects_terms(self):
+        index = InvertedIndex()
+        index.add(1, 'red pen', 'red pen office')
+        index.add(2, 'blue pen', 'blue pen')
+        self.assertEqual(index.search(parse_query('pen red')), {1: 8})
+        index.remove(1)
+        self.assertEqual(index.search(parse_query('red')), {})
+
+
+class RatingCounterTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            name='Notebook', slug='notebook', price='4.50', image='photos/products/n.jpg',
+            stock=10, category=category,
+        )
+        self.users = [
+            Account.objects.create_user(
+                username=f'user{i}', email=f'user{i}@csu.fullerton.edu', password='pw',
+                first_name='Test', last_name=f'User{i}',
+            )
+            for i in range(3)
+        ]
+
+    def _review(self, user, rating):
+        return ProductReview.objects.create(product=self.product, user=user, rating=rating, review='ok')
+
+    def test_counters_follow_create_edit_delete(self):
+        first = self._review(self.users[0], 5)
+        self._review(self.users[1], 2)
+
+        edited = ProductReview.objects.get(id=first.id)
+        edited.rating = '4'
+        edited.save()
+        self._review(self.users[2], 4).delete()
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count), (6, 2))
+        self.assertEqual(self.product.average_rating, Decimal('3.00'))
+        self.assertEqual(self.product.rating_histogram, {5: 0, 4: 1, 3: 0, 2: 1, 1: 0})
+
+    def test_product_save_keeps_counters(self):
+        stale = Product.objects.get(id=self.product.id)
+        self._review(self.users[0], 5)
+        stale.stock = 3
+        stale.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.stock, 3)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_reviews_invalidate_store_cards(self):
+        cache.clear()
+        category_key = make_tagged_key('listing', [CacheTags.category('books')])
+        with self.captureOnCommitCallbacks(execute=True):
+            review = self._review(self.users[0], 5)
+        self.assertNotEqual(make_tagged_key('listing', [CacheTags.category('books')]), category_key)
+
+        catalog_key = make_tagged_key('listing', [CacheTags.CATALOG])
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertNotEqual(make_tagged_key('listing', [CacheTags.CATALOG]), catalog_key)
+
+    def test_reconcile_repairs_drift(self):
+        self._review(self.users[0], 3)
+        Product.objects.filter(id=self.product.id).update(rating_count=9, rating_sum=1)
+
+        self.assertEqual(reconcile_ratings(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count), (3, 1))
+        self.assertEqual(reconcile_ratings(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, MANAGE_ITEMS_PAGE_SIZE=2)
+class AdminListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Software', slug='software')
+        for name, stock in (('Pencil', 0), ('Eraser', 7)):
+            Product.objects.create(
+                name=name, slug=name.lower(), price='1.00', image='photos/products/p.jpg',
+                stock=stock, category=category,
+            )
+        for name, version in (('Editor', '1.10'), ('Compiler', '1.9'), ('Linter', 'beta')):
+            DigitalProduct.objects.create(
+                name=name, slug=name.lower(), price='9.00', image='photos/products/d.jpg', stock=0,
+                category=category, version=version, download_link='https://example.com/d',
+                file_size='1 MB',
+            )
+        user = Account.objects.create_user(
+            username='admin', email='admin@csu.fullerton.edu', password='pw',
+            first_name='Ada', last_name='Admin',
+        )
+        self.client.force_login(user)
+
+    def test_version_sort_key_orders_numerically(self):
+        self.assertLess(version_sort_key('1.9'), version_sort_key('1.10'))
+        self.assertLess(version_sort_key('1.2'), version_sort_key('1.2.0'))
+        self.assertEqual(version_sort_key('beta'), version_sort_key('0'))
+        self.assertEqual(
+            DigitalProduct.objects.get(name='Editor').version_sort_key, version_sort_key('1.10')
+        )
+
+    def test_listing_pages_and_counts_in_the_database(self):
+        seen = []
+        for page in (1, 2, 3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('manage_items'), {'sort': 'stock', 'page': page})
+            product_queries = [q for q in queries if 'FROM "products_product"' in q['sql']]
+            self.assertEqual(len(product_queries), 2)  # statistics and the page
+            seen += [product.name for product in response.context['products']]
+        self.assertEqual(seen, ['Pencil', 'Eraser', 'Linter', 'Compiler', 'Editor'])
+        self.assertEqual(
+            [response.context[name] for name in ('total_products', 'digital_products', 'physical_products', 'out_of_stock')],
+            [5, 3, 2, 1]
+        )
+
+    def test_search_filters_with_a_subquery(self):
+        rebuild_index()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('manage_items'), {'search': 'e'})
+        self.assertEqual([product.name for product in response.context['products']], ['Editor', 'Eraser'])
+        self.assertEqual(response.context['total_products'], 2)
+        product_queries = [q['sql'] for q in queries if 'FROM "products_product"' in q['sql']]
+        self.assertEqual(len(product_queries), 2)
+        for sql in product_queries:
+            self.assertIn('products_productsearchdocument', sql)
+
+        response = self.client.get(reverse('manage_items'), {'search': '***'})
+        self.assertEqual(list(response.context['products']), [])
+        self.assertEqual(response.context['total_products'], 0)
+
+    def test_sorted_fetch_returns_one_page(self):
+        response = self.client.get(reverse('fetch_sorted_data'), {'sort': 'name', 'dir': 'desc'})
+        data = response.json()
+        self.assertIn('Pencil', data['products_html'])
+        self.assertIn('Linter', data['products_html'])
+        self.assertNotIn('Editor', data['products_html'])
+        self.assertIn('deleteProductModal', data['modals_html'])
+        self.assertIn('page=2', data['pagination_html'])
+
+
+class PolymorphicProductTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Software', slug='software')
+        self.physical = Product.objects.create(
+            name='Mouse', slug='mouse', price='5.00', image='photos/products/m.jpg',
+            stock=3, category=self.category,
+        )
+        self.digital = DigitalProduct.objects.create(
+            name='IDE', slug='ide', price='9.00', image='photos/products/i.jpg', stock=0,
+            category=self.category, version='2.1', download_link='https://example.com/ide',
+            file_size='1 MB',
+        )
+
+    def test_get_returns_subclass_in_one_query(self):
+        with self.assertNumQueries(1):
+            product = Product.objects.polymorphic().select_related('category').get(id=self.digital.id)
+            self.assertIsInstance(product, DigitalProduct)
+            self.assertEqual((product.version, product.category.slug), ('2.1', 'software'))
+        self.assertIs(type(Product.objects.polymorphic().get(id=self.physical.id)), Product)
+
+    def test_listing_mixes_types_and_keeps_annotations(self):
+        with self.assertNumQueries(1):
+            products = list(
+                Product.objects.polymorphic().annotate(review_total=Count('reviews')).order_by('name')
+            )
+        self.assertEqual([type(product) for product in products], [DigitalProduct, Product])
+        self.assertEqual([product.review_total for product in products], [0, 0])
+
+    def test_product_detail_shows_digital_product(self):
+        response = self.client.get(reverse('product_detail', args=['software', 'ide']))
+        self.assertIsInstance(response.context['single_product'], DigitalProduct)
+        # Wrong category: the view redirects to the store with a message
+        self.assertRedirects(
+            self.client.get(reverse('product_detail', args=['other', 'ide'])),
+            reverse('store'), fetch_redirect_response=False
+        )
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT, IMAGE_DERIVATIVES_ASYNC=False, IMAGE_DERIVATIVE_WORKERS=0,
+    IMAGE_DERIVATIVE_SIZES={'thumbnail': 160, 'card': 480, 'detail': 1200},
+)
+class ImageDerivativeTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Art', slug='art')
+
+    def _upload(self, name, size=(800, 400), mode='RGB', color='red'):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new(mode, size, color).save(buffer, 'PNG' if mode == 'RGBA' else 'JPEG')
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def test_saving_a_product_renders_sizes_without_upscaling(self):
+        name = self._upload('photos/products/poster.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                name='Poster', slug='poster', price='3.00', image=name, stock=1, category=self.category,
+            )
+        manifest = ImageDerivatives.objects.get(original=name)
+        self.assertEqual((manifest.width, manifest.height), (800, 400))
+        widths = {size: variant['width'] for size, variant in manifest.variants.items()}
+        self.assertEqual(widths, {'thumbnail': 160, 'card': 480, 'detail': 800})
+        for variant in manifest.variants.values():
+            self.assertTrue(variant['src'].endswith('.jpg'))
+            self.assertTrue(default_storage.exists(variant['webp']))
+
+    def test_transparent_images_keep_png_and_unchanged_images_are_skipped(self):
+        name = self._upload('photos/products/logo.png', mode='RGBA', color=(0, 0, 0, 0))
+        self.assertEqual(generate_derivatives([name]), 1)
+        self.assertEqual(generate_derivatives([name]), 0)
+        self.assertEqual(generate_derivatives([name], force=True), 1)
+        variants = ImageDerivatives.objects.get(original=name).variants
+        self.assertTrue(variants['card']['src'].endswith('.png'))
+
+    def test_sources_come_from_the_manifest(self):
+        name = self._upload('photos/products/mug.jpg')
+        Product.objects.create(name='Mug', slug='mug', price='8.00', image=name, stock=2, category=self.category)
+        out = StringIO()
+        call_command('generate_image_derivatives', '--workers', '0', stdout=out)
+        self.assertIn('for 1 of 1 image(s)', out.getvalue())
+        with self.assertNumQueries(1):
+            sources = image_sources([name, 'photos/products/missing.jpg'], 'card')
+        self.assertIn('480w', sources[name]['srcset'])
+        self.assertIn('.webp 160w', sources[name]['webp_srcset'])
+        self.assertEqual(
+            sources['photos/products/missing.jpg'], {'src': default_storage.url('photos/products/missing.jpg')}
+        )
+
+    def test_unreadable_images_are_logged_not_raised(self):
+        with self.assertLogs('products.utils.images', 'WARNING'):
+            self.assertEqual(generate_derivatives(['photos/products/absent.jpg']), 0)
+
+
+CATALOG_CSV = """type,category,category_name,name,slug,price,image,stock,version,download_link,file_size
+physical,supplies,Supplies,Notebook,notebook,4.50,photos/products/notebook.jpg,30,,,
+digital,software,Software,Editor,editor,19.00,photos/products/editor.jpg,,1.10,https://example.com/e,2 MB
+physical,supplies,,Pen,,1.25,photos/products/pen.jpg,abc,,,
+"""
+
+
+@override_settings(CACHES=LOCMEM_CACHE, IMAGE_DERIVATIVES_ASYNC=False)
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _import(self, text, fmt='csv', batch_size=500):
+        with self.captureOnCommitCallbacks(execute=True):
+            return import_catalog(read_rows(StringIO(text), fmt), batch_size=batch_size)
+
+    def test_import_creates_rows_and_reports_bad_ones(self):
+        with mock.patch('products.utils.catalog_io.queue_invalidation') as invalidate:
+            stats, errors = self._import(CATALOG_CSV)
+        self.assertEqual((stats['created'], stats['categories']), (2, 2))
+        self.assertEqual([number for number, _ in errors], [4])
+        editor = Product.objects.polymorphic().get(slug='editor')
+        self.assertIsInstance(editor, DigitalProduct)
+        self.assertEqual((editor.stock, editor.version_sort_key), (-1, version_sort_key('1.10')))
+        self.assertEqual(Category.objects.get(slug='supplies').name, 'Supplies')
+        self.assertEqual(search_product_ids('editor'), [editor.id])
+        invalidate.assert_called_once()
+
+    def test_reimport_upserts_on_slug_in_batches(self):
+        self._import(CATALOG_CSV)
+        changed = CATALOG_CSV.replace('4.50', '5.00').replace('1.10,', '2.0,')
+        with CaptureQueriesContext(connection) as queries:
+            stats, _ = self._import(changed, batch_size=1)
+        self.assertEqual((stats['created'], stats['updated'], stats['unchanged']), (0, 2, 0))
+        self.assertEqual(Product.objects.get(slug='notebook').price, Decimal('5.00'))
+        self.assertEqual(DigitalProduct.objects.get(slug='editor').version_sort_key, version_sort_key('2.0'))
+        self.assertFalse(any('INSERT INTO "products_product"' in query['sql'] for query in queries))
+
+    def test_export_round_trips_in_both_formats(self):
+        self._import(CATALOG_CSV)
+        for fmt in ('csv', 'jsonl'):
+            out = StringIO()
+            self.assertEqual(write_rows(export_rows(chunk_size=1), out, fmt), 2)
+            stats, errors = self._import(out.getvalue(), fmt)
+            self.assertEqual((stats['unchanged'], errors), (2, []), fmt)
+
+    def test_type_changes_are_rejected(self):
+        self._import(CATALOG_CSV)
+        stats, errors = self._import('{"type": "physical", "category": "software", "slug": "editor"}\n', 'jsonl')
+        self.assertEqual(stats['updated'], 0)
+        self.assertIn('digital product', errors[0][1])
+
+
+SNAPSHOT_DIR = tempfile.mkdtemp()
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHE, CATALOG_SNAPSHOT_PATH=f'{SNAPSHOT_DIR}/catalog.snap',
+    CATALOG_SNAPSHOT_ASYNC=False, CATALOG_SNAPSHOT_CHECK_INTERVAL=0,
+)
+class CatalogSnapshotTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.pens = Category.objects.create(name='Pens', slug='pens')
+        for i in range(7):
+            Product.objects.create(
+                name=f'Item {i}', slug=f'item-{i}', price=f'{i % 3}.50', image='photos/products/b.jpg',
+                stock=5, category=self.books if i % 2 else self.pens,
+            )
+        Product.objects.create(
+            name='Hidden', slug='hidden', price='1.00', image='photos/products/b.jpg', stock=5,
+            category=self.books, is_available=False,
+        )
+        build_snapshot()
+
+    def _walk(self, fetch, sort_by, **kwargs):
+        ids, cursor = [], None
+        while True:
+            page = fetch(sort_by=sort_by, cursor=cursor, page_size=3, **kwargs)
+            ids += [product['id'] for product in page['products']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_pages_match_the_database(self):
+        snapshot = get_snapshot()
+        self.assertEqual(len(snapshot), 7)
+        for sort_by in STORE_SORT_ORDERINGS:
+            expected = self._walk(
+                lambda **kwargs: fetch_store_page(Product.objects.filter(is_available=True), **kwargs), sort_by
+            )
+            self.assertEqual(self._walk(lambda **kwargs: fetch_snapshot_page(snapshot, **kwargs), sort_by), expected)
+        in_books = self._walk(
+            lambda **kwargs: fetch_snapshot_page(snapshot, **kwargs), 'price', category_id=self.books.id
+        )
+        self.assertEqual(in_books, list(
+            Product.objects.filter(category=self.books, is_available=True).order_by('price', 'id').values_list('id', flat=True)
+        ))
+
+    def test_listing_reads_no_product_rows(self):
+        snapshot = get_snapshot()
+        with CaptureQueriesContext(connection) as queries:
+            page = fetch_snapshot_page(snapshot, 'name', page_size=3)
+        self.assertEqual(page['products'][0]['url'], reverse('product_detail', args=['pens', 'item-0']))
+        self.assertFalse(any('FROM "products_product"' in query['sql'] for query in queries))
+
+    def test_slug_lookup(self):
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot.find('books', 'item-1'), Product.objects.get(slug='item-1').id)
+        self.assertIsNone(snapshot.find('pens', 'item-1'))
+        self.assertIsNone(snapshot.find('books', 'hidden'))
+        self.assertIsNone(snapshot.find('books', 'zzz'))
+
+    def test_stock_only_saves_keep_the_snapshot(self):
+        before = get_snapshot().generation
+        product = Product.objects.get(slug='item-1')
+        product.stock = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(get_snapshot().generation, before)
+
+    def test_one_process_rebuilds_at_a_time(self):
+        before = get_snapshot().generation
+        cache.add(REBUILD_LOCK_KEY, True)
+        self.assertEqual(rebuild_snapshot(), 0)
+        # Left pending for the process holding the lock
+        self.assertTrue(cache.get(REBUILD_PENDING_KEY))
+        self.assertEqual(get_snapshot().generation, before)
+
+        cache.delete(REBUILD_LOCK_KEY)
+        self.assertEqual(rebuild_snapshot(), 1)
+        self.assertIsNone(cache.get(REBUILD_PENDING_KEY))
+
+    @override_settings(CATALOG_SNAPSHOT_ASYNC=True)
+    def test_imports_write_the_snapshot_before_returning(self):
+        with mock.patch('products.utils.snapshot.threading.Thread') as thread, \
+                self.captureOnCommitCallbacks(execute=True):
+            import_catalog(read_rows(StringIO(CATALOG_CSV), 'csv'))
+        thread.assert_not_called()
+        self.assertIsNotNone(get_snapshot().find('supplies', 'notebook'))
+
+    def test_saves_swap_in_a_new_snapshot(self):
+        before = get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(slug='item-3').get().delete()
+        after = get_snapshot()
+        self.assertNotEqual(after.generation, before.generation)
+        self.assertIsNone(after.find('books', 'item-3'))
+        # The old mapping stays readable for requests still holding it
+        self.assertIsNotNone(before.find('books', 'item-3'))
+        response = self.client.get(reverse('store'))
+        self.assertEqual(len(response.context['products']), 6)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, CO_PURCHASE_MIN_ORDERS=1, CO_PURCHASE_TOP_N=2)
+class CoPurchaseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.products = {
+            name: Product.objects.create(
+                name=name, slug=name.lower(), price='2.00', image='photos/products/c.jpg', stock=5, category=self.books,
+            )
+            for name in ('Pen', 'Ink', 'Paper', 'Ruler')
+        }
+
+    def _order(self, *names, paid=True):
+        from checkout.models import Order, OrderProduct
+
+        order = Order.objects.create(
+            order_number=f'C{Order.objects.count()}', first_name='A', last_name='B', email='a@b.com',
+            phone='1234567890', address_line_1='1 St', city='Fullerton', state='CA', country='US',
+            zipcode='92831', order_total='10.00', tax='1.00', is_ordered=paid,
+            payment_status='PAID' if paid else 'PENDING',
+        )
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=order, product=self.products[name], quantity=1, product_price='2.00', ordered=paid)
+            for name in names
+        ])
+        return order
+
+    def _neighbours(self, name):
+        return [
+            (Product.objects.get(id=other_id).name, orders)
+            for other_id, orders in FrequentlyBoughtTogether.objects.get(product=self.products[name]).neighbours
+        ]
+
+    def test_count_pairs(self):
+        counts = count_pairs([[3, 1, 2], [2, 1, 1], [4], list(range(10))], limit=5)
+        self.assertEqual(counts, {(1, 2): 2, (1, 3): 1, (2, 3): 1})
+        self.assertEqual(top_neighbours({5: 3, 7: 3, 9: 1, 2: 4}, 3, 2), [[2, 4], [5, 3], [7, 3]])
+
+    def test_incremental_build(self):
+        self._order('Pen', 'Ink')
+        self._order('Pen', 'Ink', 'Paper')
+        self._order('Pen', 'Ruler', paid=False)
+        self.assertEqual(build_copurchases(batch_size=2), (2, 3))
+        self.assertEqual(self._neighbours('Pen'), [('Ink', 2), ('Paper', 1)])
+        self.assertEqual(CoPurchaseCount.objects.count(), 6)
+
+        self._order('Pen', 'Paper')
+        self._order('Pen', 'Paper')
+        self.assertEqual(build_copurchases(), (2, 1))
+        self.assertEqual(self._neighbours('Pen'), [('Paper', 3), ('Ink', 2)])
+        self.assertEqual(self._neighbours('Paper'), [('Pen', 3), ('Ink', 1)])
+        # Nothing new: every paid order is in the ledger
+        self.assertEqual(build_copurchases(), (0, 0))
+        self.assertEqual(build_copurchases(full=True), (4, 3))
+        self.assertEqual(self._neighbours('Pen'), [('Paper', 3), ('Ink', 2)])
+
+    def test_late_payments_count_and_refunds_are_taken_out(self):
+        from checkout.models import Order
+
+        late = self._order('Pen', 'Ink', paid=False)
+        self._order('Pen', 'Paper')
+        self.assertEqual(build_copurchases(), (1, 1))
+
+        Order.objects.filter(id=late.id).update(is_ordered=True, payment_status='PAID')
+        self.assertEqual(build_copurchases(), (1, 1))
+        self.assertEqual(self._neighbours('Pen'), [('Ink', 1), ('Paper', 1)])
+
+        Order.objects.filter(id=late.id).update(payment_status='REFUNDED')
+        self.assertEqual(build_copurchases(), (1, 1))
+        self.assertEqual(self._neighbours('Pen'), [('Paper', 1)])
+        self.assertFalse(CoPurchaseCount.objects.filter(product=self.products['Ink']).exists())
+        self.assertFalse(FrequentlyBoughtTogether.objects.filter(product=self.products['Ink']).exists())
+        self.assertEqual(list(CoPurchaseRun.objects.values_list('removed', flat=True)), [0, 0, 1])
+
+    def test_pages_read_neighbours(self):
+        self._order('Pen', 'Ink', 'Paper')
+        self._order('Pen', 'Ink')
+        self._order('Ruler', 'Paper')
+        build_copurchases()
+        pen = self.products['Pen']
+        with self.assertNumQueries(2):
+            self.assertEqual([product.name for product in bought_together(pen.id)], ['Ink', 'Paper'])
+
+        Product.objects.filter(name='Ink').update(is_available=False)
+        self.assertEqual([product.name for product in bought_together_for_cart([pen.id, self.products['Ruler'].id])], ['Paper'])
+        response = self.client.get(pen.get_url())
+        self.assertEqual([product.name for product in response.context['bought_together']], ['Paper'])
+        self.assertContains(response, 'Frequently Bought Together')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SyntheticDataTests(TestCase):
+    SMALL = dict(
+        categories=3, products=40, faculty=3, students=10, recommendations=15, reviews=60, carts=5,
+        order_lines=200, chunk_size=25,
+    )
+
+    def test_generates_consistent_data(self):
+        from checkout.models import Order, OrderProduct
+
+        generate(**self.SMALL)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Account.objects.filter(is_faculty=True, faculty__isnull=False).count(), 3)
+        self.assertEqual(Account.objects.filter(is_student=True, student__isnull=False).count(), 10)
+        self.assertEqual(OrderProduct.objects.count(), 200)
+        self.assertEqual(ProductSearchDocument.objects.count(), 40)
+        # Written counters match the reviews, and digital rows load as DigitalProduct
+        self.assertEqual(reconcile_ratings(), 0)
+        self.assertTrue(all(
+            isinstance(product, DigitalProduct) == (product.product_type == 'digital')
+            for product in Product.objects.polymorphic()
+        ))
+        order = Order.objects.order_by('id').first()
+        self.assertEqual(order.order_total, order.get_items_total())
+
+        # Zero counts reuse what exists: more history for the same catalog
+        generate(**{**self.SMALL, 'categories': 0, 'products': 0, 'faculty': 0, 'students': 0, 'order_lines': 50})
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(OrderProduct.objects.count(), 250)
+        self.assertEqual(reconcile_ratings(), 0)
+
+    def test_same_seed_same_rows(self):
+        def snapshot():
+            return list(Product.objects.order_by('id').values_list('name', 'price', 'stock', 'rating_count'))
+
+        generate(**self.SMALL, seed=7)
+        first = snapshot()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        Account.objects.all().delete()
+        generate(**self.SMALL, seed=7)
+        # Ids continue from the table maximum, so compare everything but the id suffix
+        strip = lambda rows: [(name.rsplit(' ', 1)[0], *rest) for name, *rest in rows]
+        self.assertEqual(strip(snapshot()), strip(first))
@@ -14,6 +14,7 @@ urlpatterns = [
     
     # Store front URLs
     path('', views.store, name='store'),
+    path('search/', views.search, name='product_search'),
     path('<slug:category_slug>/', views.store, name='products_by_category'),
     path('<slug:category_slug>/<slug:product_slug>/', views.product_detail, name='product_detail'),
     
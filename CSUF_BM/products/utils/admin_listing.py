@@ -0,0 +1,68 @@
+from django.core.paginator import Paginator
+from django.db.models import BooleanField, Count, ExpressionWrapper, F, Q
+from django.db.models.functions import Lower
+
+IS_DIGITAL = Q(digitalproduct__isnull=False)
+IS_PHYSICAL = Q(digitalproduct__isnull=True)
+
+# Sort expressions per manage_items column; id breaks ties so pages never overlap
+ADMIN_SORT_KEYS = {
+    'name': (Lower('name'),),
+    'type': (F('digital_type'),),
+    'category': (Lower('category__name'),),
+    'price': (F('price'),),
+    # Physical products by stock, then digital products by version
+    'stock': (F('digital_type'), F('stock'), F('version_sort_key')),
+}
+
+
+def admin_product_queryset():
+    """
+    Physical and digital products in one query over the product table.
+    digital_type tells them apart; version columns are NULL for physical rows.
+    """
+    from ..models import Product
+    return Product.objects.select_related('category').annotate(
+        digital_type=ExpressionWrapper(IS_DIGITAL, output_field=BooleanField()),
+        version=F('digitalproduct__version'),
+        version_sort_key=F('digitalproduct__version_sort_key'),
+    )
+
+def admin_product_ordering(sort_by, sort_dir='asc'):
+    descending = sort_dir == 'desc'
+    keys = ADMIN_SORT_KEYS.get(sort_by, ADMIN_SORT_KEYS['name']) + (F('id'),)
+    return [key.desc() if descending else key.asc() for key in keys]
+
+def _matching(search):
+    return Q(id__in=search.values('product_id'))
+
+def product_statistics(search=None):
+    """
+    Dashboard counters from a single aggregate query. total_products counts
+    the matches of search (a search_documents() queryset) when given; the
+    rest ignore the search.
+    """
+    from ..models import Product
+    if search is None:
+        total = Count('id')
+    elif not search.query.is_empty():
+        total = Count('id', filter=_matching(search))
+    else:
+        total = None
+    stats = Product.objects.aggregate(
+        **({'total_products': total} if total is not None else {}),
+        digital_products=Count('id', filter=IS_DIGITAL),
+        physical_products=Count('id', filter=IS_PHYSICAL),
+        out_of_stock=Count('id', filter=IS_PHYSICAL & Q(stock=0)),
+    )
+    stats.setdefault('total_products', 0)
+    return stats
+
+def admin_product_page(sort_by, sort_dir, page_number, total, page_size=50, search=None):
+    """One page of the listing; total comes from product_statistics, so no extra COUNT runs"""
+    queryset = admin_product_queryset()
+    if search is not None:
+        queryset = queryset.filter(_matching(search))
+    paginator = Paginator(queryset.order_by(*admin_product_ordering(sort_by, sort_dir)), page_size)
+    paginator.count = total
+    return paginator.get_page(page_number)
@@ -1,49 +1,204 @@
 from django.conf import settings
 from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from contextlib import contextmanager
 from functools import wraps
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
 
 class CacheKeyBuilder:
     """Centralized cache key management"""
-    
+
     @staticmethod
     def _sanitize_key(key):
         """Convert characters that might cause issues with memcached"""
         return key.replace(' ', '_').replace(':', '_').replace('/', '_')
-    
+
+    @staticmethod
+    def stable_hash(params):
+        """
+        Hash a dict of parameters the same way in every process.
+
+        The builtin hash() is salted per interpreter (PYTHONHASHSEED), so keys
+        built from it differ between gunicorn workers. Parameters are dumped to
+        canonical JSON (sorted keys) and digested instead.
+        """
+        canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.md5(canonical.encode('utf-8')).hexdigest()[:16]
+
     @staticmethod
     def product_key(product_id):
         return f"product_{product_id}"
-    
+
     @staticmethod
     def product_recommendations_key(product_id):
         return f"recommendations_product_{product_id}"
-    
+
     @staticmethod
     def department_recommendations_key(department):
         department = CacheKeyBuilder._sanitize_key(department)
         return f"recommendations_department_{department}"
-    
+
     @staticmethod
     def faculty_recommendations_key(faculty_id):
         return f"recommendations_faculty_{faculty_id}"
-    
+
     @staticmethod
     def store_page_key(category_slug=None, params=None):
         base = "store_page"
         if category_slug:
             base += f"_{category_slug}"
         if params:
-            param_hash = hash(frozenset(params.items()))
-            base += f"_{param_hash}"
+            base += f"_{CacheKeyBuilder.stable_hash(params)}"
         return base
 
-def get_or_set_cache(key, func, timeout=3600):
-    """Get from cache or compute and cache value"""
-    result = cache.get(key)
-    if result is None:
-        result = func()
-        cache.set(key, result, timeout=timeout)
-    return result
+    @staticmethod
+    def tag_version_key(tag):
+        return f"tagver:{CacheKeyBuilder._sanitize_key(tag)}"
+
+    @staticmethod
+    def invalidation_window_key(tag):
+        return f"invalidation_window:{CacheKeyBuilder._sanitize_key(tag)}"
+
+    @staticmethod
+    def invalidation_pending_key(tag):
+        return f"invalidation_pending:{CacheKeyBuilder._sanitize_key(tag)}"
+
+    @staticmethod
+    def invalidation_stat_key(name):
+        return f"invalidation_stats:{name}"
+
+    @staticmethod
+    def cache_meta_key(key):
+        return f"{key}:meta"
+
+    @staticmethod
+    def cache_lock_key(key):
+        return f"lock:{key}"
+
+    @staticmethod
+    def stampede_stat_key(name):
+        return f"stampede_stats:{name}"
+
+
+class CacheTags:
+    """
+    Tag names used to group cache entries for invalidation.
+
+    Every tag owns a version counter in the cache. A tagged entry is stored
+    under a key that embeds the current versions of all its tags, so bumping
+    one counter orphans every entry registered under that tag in O(1) -
+    the orphans simply age out through their timeout. This works the same on
+    django-redis and locmem since it only needs get_many/add/incr.
+    """
+    CATALOG = 'catalog'
+    CATEGORY = 'category'
+    PRODUCT = 'product'
+    DEPARTMENT = 'department'
+    FACULTY = 'faculty'
+
+    @staticmethod
+    def category(slug):
+        return f"{CacheTags.CATEGORY}:{slug}"
+
+    @staticmethod
+    def product(product_id):
+        return f"{CacheTags.PRODUCT}:{product_id}"
+
+    @staticmethod
+    def department(department):
+        return f"{CacheTags.DEPARTMENT}:{department}"
+
+    @staticmethod
+    def faculty(faculty_id):
+        return f"{CacheTags.FACULTY}:{faculty_id}"
+
+
+def get_tag_versions(tags):
+    """Fetch the current version of each tag in a single cache round trip"""
+    version_keys = {CacheKeyBuilder.tag_version_key(tag): tag for tag in tags}
+    found = cache.get_many(list(version_keys))
+    return {tag: found.get(key, 1) for key, tag in version_keys.items()}
+
+def make_tagged_key(key, tags):
+    """Build the concrete cache key for an entry registered under tags"""
+    if not tags:
+        return key
+    versions = get_tag_versions(sorted(set(tags)))
+    return f"{key}:t{CacheKeyBuilder.stable_hash(versions)}"
+
+def get_or_set_tagged(key, func, tags, timeout=3600, **policy):
+    """Get from cache or compute and cache value registered under tags"""
+    return get_or_set_cache(make_tagged_key(key, tags), func, timeout=timeout, **policy)
+
+def bump_version(version_key):
+    """Atomically increment a version counter, creating it if missing"""
+    # add() is a no-op when the counter already exists; incr() is atomic on redis
+    cache.add(version_key, 1, timeout=None)
+    try:
+        return cache.incr(version_key)
+    except ValueError:
+        # Counter was evicted between add() and incr()
+        cache.set(version_key, 2, timeout=None)
+        return 2
+
+def invalidate_tags(*tags):
+    """Invalidate every cache entry registered under any of the given tags"""
+    for tag in set(tags):
+        bump_version(CacheKeyBuilder.tag_version_key(tag))
+
+def get_or_set_cache(key, func, timeout=3600, **policy):
+    """
+    Get from cache or compute and cache value, with stampede protection.
+
+    Only one worker recomputes a missing or refreshing key (a cache.add
+    lock); the others wait for its result or keep serving the old value.
+    Keys may be refreshed a little before they expire, with a probability
+    that grows as expiry nears and with how long the value took to compute
+    (XFetch). Keyword arguments override the StampedePolicy for this call.
+    """
+    policy = StampedePolicy.for_key(key, **policy)
+    meta_key = CacheKeyBuilder.cache_meta_key(key)
+    found = cache.get_many([key, meta_key])
+    value = found.get(key)
+    meta = found.get(meta_key)
+
+    if value is not None:
+        # No meta means the value was written with a plain cache.set()
+        if meta is None or not policy.should_refresh(meta):
+            return _unwrap(value)
+        expired = meta['expires_at'] <= time.time()
+        token = _acquire_lock(key, policy)
+        if token is None:
+            if expired:
+                record_stampede_stat('stale_served')
+            return _unwrap(value)
+        record_stampede_stat('stale_refreshes' if expired else 'early_refreshes')
+        if policy.background:
+            _recompute_in_background(key, func, timeout, policy, token)
+            return _unwrap(value)
+        return _recompute(key, func, timeout, policy, token)
+
+    record_stampede_stat('misses')
+    token = _acquire_lock(key, policy)
+    if token is not None:
+        return _recompute(key, func, timeout, policy, token)
+
+    record_stampede_stat('lock_waits')
+    found, value = _wait_for_value(key, policy.wait_timeout)
+    if found:
+        return value
+    # The lock holder is slow, died or stored nothing; compute rather than fail the request
+    record_stampede_stat('lock_timeouts')
+    return _recompute(key, func, timeout, policy, None)
 
 def make_versioned_key(key, key_prefix, version):
     """Create a versioned cache key"""
@@ -59,27 +214,286 @@ def cache_with_version(timeout=None):
             key = func.__name__ + ':' + ':'.join(str(arg) for arg in args)
             version = cache.get('global_version', 1)
             result = cache.get(key, version=version)
-            
+
             if result is None:
                 result = func(*args, **kwargs)
                 cache.set(key, result, timeout=timeout, version=version)
-            
+
             return result
         return wrapper
     return decorator
 
 def bulk_cache_delete(keys):
-    """Delete multiple cache keys efficiently"""
-    pipeline = cache.client.pipeline(transaction=True)
-    for key in keys:
-        pipeline.delete(key)
-    pipeline.execute()
-    
-    
-def get_or_set_cache(key, func, timeout=3600):
-    """Get from cache or compute and cache value"""
-    result = cache.get(key)
-    if result is None:
-        result = func()
-        cache.set(key, result, timeout=timeout)
-    return result
\ No newline at end of file
+    """Delete multiple cache keys in one round trip on any backend"""
+    cache.delete_many(list(keys))
+
+
+# Field-aware invalidation
+
+INVALIDATION_STATS = ('requested', 'applied', 'coalesced', 'stock_only', 'debounced')
+
+_coalescing = threading.local()
+
+
+class InvalidationBatch:
+    """Collects invalidations so each key and tag is only hit once"""
+
+    def __init__(self):
+        self.keys = set()
+        self.tags = set()
+        self.bump_global = False
+        self.requested = 0
+
+    def add(self, keys=(), tags=(), bump_global=False):
+        self.requested += 1
+        self.keys.update(keys)
+        self.tags.update(tags)
+        self.bump_global = self.bump_global or bump_global
+
+    def flush(self):
+        if not self.requested:
+            return
+        if self.keys:
+            bulk_cache_delete(self.keys)
+        invalidate_tags(*debounce_tags(self.tags))
+        if self.bump_global:
+            bump_version('global_version')
+        # Keep the pages rebuilt next from reading replicas that lack the change
+        from .db_routing import hold_replica_reads
+        hold_replica_reads()
+        record_invalidation_stat('requested', self.requested)
+        record_invalidation_stat('applied')
+        record_invalidation_stat('coalesced', self.requested - 1)
+
+
+@contextmanager
+def coalesce_invalidations():
+    """
+    Merge every invalidation committed inside the block into one flush.
+    Nested blocks join the outermost batch.
+    """
+    if getattr(_coalescing, 'batch', None) is not None:
+        yield _coalescing.batch
+        return
+    batch = _coalescing.batch = InvalidationBatch()
+    try:
+        yield batch
+    finally:
+        _coalescing.batch = None
+        batch.flush()
+
+def invalidation_window():
+    return getattr(settings, 'CACHE_INVALIDATION_WINDOW', 0)
+
+def debounce_tags(tags):
+    """
+    Return the tags to bump now, debouncing bumps across requests and
+    processes over CACHE_INVALIDATION_WINDOW seconds (0, the default,
+    bumps every tag every time).
+
+    The first bump of a tag opens a window and goes through at once.
+    Bumps inside the window only mark the tag pending, and the process
+    that opened it bumps pending tags once more when it closes, so a
+    burst of edits spread over many requests costs each tag two bumps.
+    A pending mark is cleared with delete(), which tells only one
+    process it removed the key, so exactly one of them bumps for it.
+    """
+    window = invalidation_window()
+    if not window:
+        return set(tags)
+
+    bump_now, pending = set(), []
+    for tag in set(tags):
+        if cache.add(CacheKeyBuilder.invalidation_window_key(tag), True, timeout=window * 2):
+            bump_now.add(tag)
+        elif cache.add(CacheKeyBuilder.invalidation_pending_key(tag), True, timeout=None):
+            pending.append(tag)
+        else:
+            record_invalidation_stat('debounced')
+
+    if bump_now:
+        timer = threading.Timer(window, close_invalidation_windows, [bump_now])
+        timer.daemon = True
+        timer.start()
+    if pending:
+        # A window that closed since the add above will not see the mark
+        open_windows = cache.get_many([CacheKeyBuilder.invalidation_window_key(tag) for tag in pending])
+        bump_now.update(
+            tag for tag in pending
+            if CacheKeyBuilder.invalidation_window_key(tag) not in open_windows
+            and cache.delete(CacheKeyBuilder.invalidation_pending_key(tag))
+        )
+    return bump_now
+
+def close_invalidation_windows(tags):
+    """Close the windows debounce_tags opened for tags and bump those marked pending"""
+    cache.delete_many([CacheKeyBuilder.invalidation_window_key(tag) for tag in tags])
+    pending = [tag for tag in tags if cache.delete(CacheKeyBuilder.invalidation_pending_key(tag))]
+    if pending:
+        invalidate_tags(*pending)
+        from .db_routing import hold_replica_reads
+        hold_replica_reads()
+
+def queue_invalidation(keys=(), tags=(), bump_global=False):
+    """Invalidate after the current transaction commits, coalescing if batching"""
+    keys, tags = list(keys), list(tags)
+
+    def enqueue():
+        batch = getattr(_coalescing, 'batch', None)
+        if batch is not None:
+            batch.add(keys, tags, bump_global)
+            return
+        single = InvalidationBatch()
+        single.add(keys, tags, bump_global)
+        single.flush()
+
+    transaction.on_commit(enqueue)
+
+def record_invalidation_stat(name, amount=1):
+    if amount <= 0:
+        return
+    _incr_counter(CacheKeyBuilder.invalidation_stat_key(name), amount)
+
+def get_invalidation_stats():
+    """Counters for requested/applied invalidations and those avoided"""
+    keys = {CacheKeyBuilder.invalidation_stat_key(name): name for name in INVALIDATION_STATS}
+    found = cache.get_many(list(keys))
+    stats = {name: found.get(key, 0) for key, name in keys.items()}
+    stats['avoided'] = stats['coalesced'] + stats['stock_only'] + stats['debounced']
+    return stats
+
+
+# Stampede protection
+
+# Stored for a None result, so it is a hit instead of a miss every time
+NONE_MARKER = 'stampede:none'
+# Returned by a get_or_set_cache func whose result must not be cached
+UNCACHEABLE = object()
+
+STAMPEDE_STATS = (
+    'misses', 'recomputes', 'early_refreshes', 'stale_refreshes',
+    'stale_served', 'lock_waits', 'lock_timeouts',
+)
+
+
+class StampedePolicy:
+    """
+    How get_or_set_cache protects one key.
+
+    beta: XFetch aggressiveness; 0 disables early refresh, higher refreshes sooner
+    stale_ttl: seconds an expired value is kept and served while one worker
+        recomputes it (stale-while-revalidate); 0 disables
+    background: with stale_ttl, the recomputing worker also serves the stale
+        value and refreshes in a thread instead of making its request wait
+    lock_timeout: seconds before an abandoned recompute lock frees itself
+    wait_timeout: seconds other workers wait for a missing key before
+        computing it themselves
+
+    Defaults can be set per key prefix with the CACHE_STAMPEDE_POLICIES
+    setting, e.g. {'all_categories': {'stale_ttl': 600}}.
+    """
+    DEFAULTS = {'beta': 1.0, 'stale_ttl': 0, 'background': False, 'lock_timeout': 30, 'wait_timeout': 2.0}
+
+    def __init__(self, **options):
+        unknown = set(options) - set(self.DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown stampede policy options: {', '.join(sorted(unknown))}")
+        for name, default in self.DEFAULTS.items():
+            setattr(self, name, options.get(name, default))
+
+    @classmethod
+    def for_key(cls, key, **overrides):
+        policies = getattr(settings, 'CACHE_STAMPEDE_POLICIES', {})
+        prefixes = [prefix for prefix in policies if key.startswith(prefix)]
+        options = dict(policies[max(prefixes, key=len)]) if prefixes else {}
+        options.update(overrides)
+        return cls(**options)
+
+    def should_refresh(self, meta):
+        if meta['expires_at'] is None:
+            return False
+        remaining = meta['expires_at'] - time.time()
+        if remaining <= 0:
+            return True
+        if self.beta <= 0:
+            return False
+        # XFetch: refresh when delta * beta * -ln(U) reaches past expiry
+        return -meta['delta'] * self.beta * math.log(1.0 - random.random()) >= remaining
+
+
+def _acquire_lock(key, policy):
+    token = uuid.uuid4().hex
+    if cache.add(CacheKeyBuilder.cache_lock_key(key), token, timeout=policy.lock_timeout):
+        return token
+    return None
+
+def _release_lock(key, token):
+    lock_key = CacheKeyBuilder.cache_lock_key(key)
+    # Only drop our own lock; it may have expired and been taken by another worker
+    if token is not None and cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+def _unwrap(value):
+    return None if value == NONE_MARKER else value
+
+def _wait_for_value(key, wait_timeout, interval=0.05):
+    """
+    Poll for the lock holder's result: (True, value) once it is stored,
+    (False, None) when the lock goes away without one or time runs out
+    """
+    lock_key = CacheKeyBuilder.cache_lock_key(key)
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        found = cache.get_many([key, lock_key])
+        if key in found:
+            return True, _unwrap(found[key])
+        if lock_key not in found:
+            return False, None
+    return False, None
+
+def _recompute(key, func, timeout, policy, token):
+    try:
+        started = time.monotonic()
+        value = func()
+        delta = time.monotonic() - started
+        if value is UNCACHEABLE:
+            value = None
+        else:
+            expires_at = None if timeout is None else time.time() + timeout
+            stored_for = None if timeout is None else timeout + policy.stale_ttl
+            cache.set_many({
+                key: NONE_MARKER if value is None else value,
+                CacheKeyBuilder.cache_meta_key(key): {'expires_at': expires_at, 'delta': delta},
+            }, timeout=stored_for)
+        record_stampede_stat('recomputes')
+        return value
+    finally:
+        _release_lock(key, token)
+
+def _recompute_in_background(key, func, timeout, policy, token):
+    def run():
+        try:
+            _recompute(key, func, timeout, policy, token)
+        except Exception as e:
+            logger.error(f"Background refresh of cache key {key} failed: {e}")
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=run, name=f'cache-refresh-{key}', daemon=True).start()
+
+def _incr_counter(key, amount):
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, timeout=None)
+
+def record_stampede_stat(name, amount=1):
+    _incr_counter(CacheKeyBuilder.stampede_stat_key(name), amount)
+
+def get_stampede_stats():
+    """Counters for the non-hit paths of get_or_set_cache"""
+    keys = {CacheKeyBuilder.stampede_stat_key(name): name for name in STAMPEDE_STATS}
+    found = cache.get_many(list(keys))
+    return {name: found.get(key, 0) for key, name in keys.items()}
@@ -0,0 +1,355 @@
+"""
+Streaming catalog import and export (CSV or JSON lines).
+
+Imports upsert products on slug in batches with bulk_create/bulk_update.
+Neither sends model signals, so nothing is invalidated or reindexed per
+row: each batch commits on its own and then refreshes its search
+documents and image derivatives, and the store
+caches are invalidated once when the whole load is done.
+"""
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+from django.db.models import BooleanField, ExpressionWrapper, F
+from django.utils import timezone
+from django.utils.text import slugify
+from .admin_listing import IS_DIGITAL
+from .cache import CacheKeyBuilder, CacheTags, queue_invalidation
+from .images import generate_derivatives
+from .search import index_products
+from .snapshot import rebuild_snapshot
+import csv
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+PRODUCT_COLUMNS = (
+    'name', 'slug', 'description', 'price', 'image', 'stock', 'is_available', 'brand', 'discount', 'featured',
+)
+DIGITAL_COLUMNS = ('version', 'download_link', 'file_size', 'system_requirements', 'release_notes')
+COLUMNS = ('type', 'category', 'category_name') + PRODUCT_COLUMNS + DIGITAL_COLUMNS
+# Columns without a usable default, needed when a row creates a product
+REQUIRED_FOR_NEW = {
+    'physical': ('name', 'price', 'image', 'stock'),
+    'digital': ('name', 'price', 'image', 'version', 'download_link', 'file_size'),
+}
+
+
+def guess_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def read_rows(stream, fmt='csv'):
+    """
+    (line number, row dict) for each record of a text stream. Empty CSV
+    cells count as missing columns; malformed JSON lines yield the error
+    in place of the row.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {
+                column: value for column, value in row.items() if column is not None and value != ''
+            }
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f'invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            row = ValueError('each line must be a JSON object')
+        yield number, row
+
+
+def _clean(model, values):
+    """Column values converted by the model fields, keyed by attname"""
+    cleaned = {}
+    for column, value in values.items():
+        field = model._meta.get_field(column)
+        if value is None and not field.null:
+            value = '' if field.empty_strings_allowed else None
+        if value is None:
+            raise ValueError(f'{column} is required')
+        cleaned[field.attname] = field.to_python(value)
+    return cleaned
+
+def parse_row(row):
+    """Validate one import row into the values written to each table"""
+    from ..models import DigitalProduct, Product
+
+    if isinstance(row, Exception):
+        raise row
+    unknown = set(row) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"unknown column(s): {', '.join(sorted(unknown))}")
+    kind = row.get('type') or ('digital' if any(column in row for column in DIGITAL_COLUMNS) else 'physical')
+    if kind not in ('physical', 'digital'):
+        raise ValueError(f'unknown type {kind!r}')
+    if not row.get('category'):
+        raise ValueError('category is required')
+
+    values = {column: row[column] for column in PRODUCT_COLUMNS if column in row}
+    if not values.get('slug'):
+        if not values.get('name'):
+            raise ValueError('name or slug is required')
+        values['slug'] = slugify(values['name'])
+    digital = {column: row[column] for column in DIGITAL_COLUMNS if column in row}
+    if kind == 'physical' and digital:
+        raise ValueError('digital columns on a physical product')
+    values['product_type'] = kind
+    if kind == 'digital':
+        values['stock'] = -1  # Unlimited, as DigitalProduct.save() sets it
+    return {
+        'kind': kind,
+        'category': row['category'],
+        'category_name': row.get('category_name'),
+        'product': _clean(Product, values),
+        'digital': _clean(DigitalProduct, digital),
+    }
+
+
+def _error_message(error):
+    if isinstance(error, ValidationError):
+        return '; '.join(error.messages)
+    return str(error)
+
+def _category_ids(rows):
+    """Category id per slug, creating the categories the batch introduces"""
+    from ..models import Category
+    names = {}
+    for row in rows:
+        if row['category_name'] or row['category'] not in names:
+            names[row['category']] = row['category_name']
+    ids = dict(Category.objects.filter(slug__in=names).values_list('slug', 'id'))
+    missing = [slug for slug in names if slug not in ids]
+    if missing:
+        Category.objects.bulk_create([
+            Category(slug=slug, name=names[slug] or slug.replace('-', ' ').title()) for slug in missing
+        ])
+        ids.update(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+    return ids, len(missing)
+
+def _apply(product, values):
+    """Set values on a loaded product; returns the names of the fields that changed"""
+    names = {field.attname: field.name for field in product._meta.concrete_fields}
+    changed = set()
+    for attname, value in values.items():
+        if getattr(product, attname) != value:
+            setattr(product, attname, value)
+            changed.add(names[attname])
+    return changed
+
+def _insert_digital_rows(parents, rows_by_slug):
+    """
+    Add the digital_product rows of freshly inserted parents. bulk_create
+    refuses multi-table children, so this issues the same child-table
+    insert a raw save would, but for the whole batch at once.
+    """
+    from ..models import DigitalProduct, version_sort_key
+    children = []
+    for slug, product_id in parents.items():
+        child = DigitalProduct(product_ptr_id=product_id, **rows_by_slug[slug]['digital'])
+        child.version_sort_key = version_sort_key(child.version)
+        children.append(child)
+    if children:
+        DigitalProduct._base_manager._insert(children, fields=DigitalProduct._meta.local_concrete_fields)
+
+def _import_batch(batch, stats, errors, touched_categories):
+    from ..models import DigitalProduct, Product, version_sort_key
+
+    rows = {}
+    for number, raw in batch:
+        try:
+            row = parse_row(raw)
+        except (ValueError, ValidationError) as e:
+            errors.append((number, _error_message(e)))
+            continue
+        row['line'] = number
+        rows[row['product']['slug']] = row  # A later row for the same slug wins
+    if not rows:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        category_ids, created_categories = _category_ids(rows.values())
+        existing = {product.slug: product for product in Product.objects.polymorphic().filter(slug__in=rows)}
+
+        new_products, updated, updated_digital = [], [], []
+        parent_fields, digital_fields, images = set(), set(), set()
+        unchanged = 0
+        for slug, row in list(rows.items()):
+            values = {**row['product'], 'category_id': category_ids[row['category']]}
+            product = existing.get(slug)
+            if product is None:
+                missing = [
+                    column for column in REQUIRED_FOR_NEW[row['kind']]
+                    if column not in row['product'] and column not in row['digital']
+                ]
+                if missing:
+                    errors.append((row['line'], f"new product {slug} needs {', '.join(missing)}"))
+                    del rows[slug]
+                    continue
+                new_products.append(Product(**values))
+                images.add(values.get('image'))
+                continue
+            if product.is_digital != (row['kind'] == 'digital'):
+                errors.append((row['line'], f'{slug} is a {"digital" if product.is_digital else "physical"} product'))
+                del rows[slug]
+                continue
+            previous_category = product.category_id
+            changed = _apply(product, values)
+            if 'category' in changed:
+                touched_categories.add(previous_category)
+            if row['digital']:
+                digital_changed = _apply(product, row['digital'])
+                if 'version' in digital_changed:
+                    product.version_sort_key = version_sort_key(product.version)
+                    digital_changed.add('version_sort_key')
+                if digital_changed:
+                    updated_digital.append(product)
+                    digital_fields |= digital_changed
+            if 'image' in changed:
+                images.add(product.image.name)
+            if changed:
+                product.modified_date = now
+                parent_fields |= changed | {'modified_date'}
+                updated.append(product)
+            elif product not in updated_digital:
+                unchanged += 1
+
+        if new_products:
+            Product.objects.bulk_create(new_products)
+            # MySQL does not return ids from bulk inserts, so read them back by slug
+            new_ids = dict(Product.objects.filter(
+                slug__in=[product.slug for product in new_products]
+            ).values_list('slug', 'id'))
+            _insert_digital_rows(
+                {slug: product_id for slug, product_id in new_ids.items() if rows[slug]['kind'] == 'digital'},
+                rows,
+            )
+        else:
+            new_ids = {}
+        if updated:
+            Product.objects.bulk_update(updated, sorted(parent_fields))
+        if updated_digital:
+            DigitalProduct.objects.bulk_update(updated_digital, sorted(digital_fields))
+
+        touched = set(new_ids.values()) | {product.id for product in updated + updated_digital}
+        transaction.on_commit(lambda: _after_batch(touched, images))
+
+    stats['categories'] += created_categories
+    stats['unchanged'] += unchanged
+    stats['created'] += len(new_ids)
+    stats['updated'] += len({product.id for product in updated + updated_digital})
+    touched_categories.update(category_ids[row['category']] for row in rows.values())
+
+def _after_batch(product_ids, images):
+    """
+    What the per-row post_save receivers would have done, once per batch.
+    Inline rather than on the receivers' threads, which the command would
+    not wait for.
+    """
+    if not product_ids:
+        return
+    index_products(product_ids)
+    try:
+        generate_derivatives(images)
+    except Exception as e:
+        # The batch is committed; manage.py generate_image_derivatives can catch up
+        logger.error(f"Image derivative generation failed for an import batch: {e}")
+
+def _invalidate_catalog(category_ids):
+    """The coalesced equivalent of every product and category receiver the load skipped"""
+    from ..models import Category
+    categories = Category.objects.filter(id__in=category_ids).values_list('slug', 'name')
+    queue_invalidation(
+        [CacheKeyBuilder.department_recommendations_key(name) for _, name in categories],
+        [CacheTags.CATALOG, CacheTags.CATEGORY] + [CacheTags.category(slug) for slug, _ in categories],
+        bump_global=True,
+    )
+    rebuild_snapshot()
+
+def import_catalog(rows, batch_size=500):
+    """
+    Upsert (line number, row) pairs from read_rows in batches. Returns
+    (stats, errors), errors being (line number, message) for every row
+    that was skipped. A batch the database rejects is rolled back and
+    reported as a whole; earlier batches stay committed.
+    """
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'categories': 0}
+    errors = []
+    touched_categories = set()
+
+    def flush(batch):
+        try:
+            _import_batch(batch, stats, errors, touched_categories)
+        except DatabaseError as e:
+            logger.warning(f"Catalog import batch at line {batch[0][0]} rolled back: {e}")
+            errors.extend((number, f'batch rolled back: {e}') for number, _ in batch)
+
+    try:
+        batch = []
+        for record in rows:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        if touched_categories:
+            _invalidate_catalog(touched_categories)
+    return stats, errors
+
+
+def export_rows(queryset=None, chunk_size=1000):
+    """
+    The catalog as import rows, read in keyset-paginated chunks so memory
+    stays flat on backends that buffer whole result sets (MySQL).
+    """
+    from ..models import Product
+    queryset = (Product.objects.all() if queryset is None else queryset).annotate(
+        is_digital=ExpressionWrapper(IS_DIGITAL, output_field=BooleanField()),
+        category_slug=F('category__slug'),
+        category_label=F('category__name'),
+        **{column: F(f'digitalproduct__{column}') for column in DIGITAL_COLUMNS},
+    ).values('id', 'is_digital', 'category_slug', 'category_label', *PRODUCT_COLUMNS, *DIGITAL_COLUMNS)
+
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+        for values in chunk:
+            row = {
+                'type': 'digital' if values['is_digital'] else 'physical',
+                'category': values['category_slug'],
+                'category_name': values['category_label'],
+            }
+            for column in PRODUCT_COLUMNS:
+                row[column] = values[column]
+            if values['is_digital']:
+                for column in DIGITAL_COLUMNS:
+                    row[column] = values[column]
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['id']
+
+def write_rows(rows, stream, fmt='csv'):
+    """Write export_rows to a text stream; returns the number written"""
+    written = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+        return written
+    for row in rows:
+        stream.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+        written += 1
+    return written
@@ -0,0 +1,217 @@
+"""
+"Frequently bought together" from order history.
+
+An offline job (manage.py build_copurchases) folds paid orders into
+CoPurchaseCount, the sparse item-item matrix of how many orders contained
+both products, and rewrites the top-N neighbours of every product it
+touched into FrequentlyBoughtTogether. Pages only read that table: one
+primary key lookup per product. CoPurchaseOrder records which orders
+were counted, so orders paid late are still picked up and refunded ones
+are subtracted again.
+"""
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from itertools import combinations
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def top_n():
+    return getattr(settings, 'CO_PURCHASE_TOP_N', 10)
+
+def min_orders():
+    # A pair seen in a single order is usually noise
+    return getattr(settings, 'CO_PURCHASE_MIN_ORDERS', 2)
+
+def max_basket():
+    # Pairs grow quadratically with basket size, and bulk orders say little about affinity
+    return getattr(settings, 'CO_PURCHASE_MAX_BASKET', 50)
+
+
+def count_pairs(baskets, limit=None):
+    """
+    Counter of {(a, b): orders} with a < b over iterables of product ids.
+    Counter.update() counts each basket's pairs in C, so this is the hot
+    loop for both the job and the benchmark.
+    """
+    limit = max_basket() if limit is None else limit
+    counts = Counter()
+    for basket in baskets:
+        items = sorted(set(basket))
+        if 1 < len(items) <= limit:
+            counts.update(combinations(items, 2))
+    return counts
+
+def top_neighbours(row, n, threshold):
+    """[[other_id, orders], ...] for one product's {other_id: orders}, best first"""
+    best = heapq.nlargest(
+        n, ((orders, -other) for other, orders in row.items() if orders >= threshold)
+    )
+    return [[-negated, orders] for orders, negated in best]
+
+
+def _baskets(order_ids):
+    from checkout.models import OrderProduct
+
+    baskets = {order_id: [] for order_id in order_ids}
+    for order_id, product_id in OrderProduct.objects.filter(order_id__in=order_ids).values_list('order_id', 'product_id'):
+        baskets[order_id].append(product_id)
+    return baskets
+
+def _apply(pair_counts, chunk_size=500):
+    """
+    Add pair counts (negative to subtract) to CoPurchaseCount in both
+    directions and rewrite the neighbour lists of every product involved.
+    Each chunk of products costs one read: its rows are merged in memory,
+    then bulk written. Pairs that drop to zero are deleted.
+    """
+    from ..models import CoPurchaseCount, FrequentlyBoughtTogether
+
+    deltas = defaultdict(dict)
+    for (a, b), orders in pair_counts.items():
+        deltas[a][b] = orders
+        deltas[b][a] = orders
+
+    n, threshold = top_n(), min_orders()
+    product_ids = sorted(deltas)
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        rows = defaultdict(dict)
+        existing = {}
+        for row_id, product_id, other_id, orders in CoPurchaseCount.objects.filter(
+            product_id__in=chunk
+        ).values_list('id', 'product_id', 'other_id', 'orders'):
+            rows[product_id][other_id] = orders
+            existing[product_id, other_id] = row_id
+
+        to_create, to_update, to_delete = [], [], []
+        for product_id in chunk:
+            row = rows[product_id]
+            for other_id, orders in deltas[product_id].items():
+                row[other_id] = row.get(other_id, 0) + orders
+                row_id = existing.get((product_id, other_id))
+                if row[other_id] <= 0:
+                    del row[other_id]
+                    if row_id is not None:
+                        to_delete.append(row_id)
+                    continue
+                pair = CoPurchaseCount(id=row_id, product_id=product_id, other_id=other_id, orders=row[other_id])
+                (to_create if row_id is None else to_update).append(pair)
+        CoPurchaseCount.objects.bulk_create(to_create, batch_size=1000)
+        CoPurchaseCount.objects.bulk_update(to_update, ['orders'], batch_size=1000)
+        if to_delete:
+            CoPurchaseCount.objects.filter(id__in=to_delete).delete()
+
+        tops = {product_id: top_neighbours(rows[product_id], n, threshold) for product_id in chunk}
+        stored = set(FrequentlyBoughtTogether.objects.filter(product_id__in=chunk).values_list('product_id', flat=True))
+        now = timezone.now()
+        FrequentlyBoughtTogether.objects.bulk_create([
+            FrequentlyBoughtTogether(product_id=product_id, neighbours=top, updated_at=now)
+            for product_id, top in tops.items() if top and product_id not in stored
+        ])
+        FrequentlyBoughtTogether.objects.bulk_update([
+            FrequentlyBoughtTogether(product_id=product_id, neighbours=top, updated_at=now)
+            for product_id, top in tops.items() if top and product_id in stored
+        ], ['neighbours', 'updated_at'])
+        emptied = [product_id for product_id, top in tops.items() if not top and product_id in stored]
+        if emptied:
+            FrequentlyBoughtTogether.objects.filter(product_id__in=emptied).delete()
+
+def build_copurchases(full=False, batch_size=1000):
+    """
+    Fold paid orders not yet in CoPurchaseOrder into the matrix and take
+    out the counted orders that are no longer paid (refunded, reverted or
+    deleted), batch_size orders per transaction. Pending orders are left
+    for a later run, so an order counts once it is paid however long that
+    takes. full clears everything and rebuilds from every paid order.
+
+    Returns (orders, pairs) processed.
+    """
+    from checkout.models import Order
+    from ..models import CoPurchaseCount, CoPurchaseOrder, CoPurchaseRun, FrequentlyBoughtTogether
+
+    if full:
+        with transaction.atomic():
+            CoPurchaseCount.objects.all().delete()
+            FrequentlyBoughtTogether.objects.all().delete()
+            CoPurchaseOrder.objects.all().delete()
+            CoPurchaseRun.objects.all().delete()
+
+    paid = Order.objects.filter(is_ordered=True, payment_status='PAID')
+    total_orders = total_removed = total_pairs = 0
+
+    unpaid = CoPurchaseOrder.objects.exclude(order_id__in=paid.values('id')).order_by('order_id')
+    while True:
+        counted = list(unpaid.values_list('order_id', 'product_ids')[:batch_size])
+        if not counted:
+            break
+        # Stored baskets were already cut to the size limit when counted
+        pair_counts = count_pairs((products for _, products in counted), limit=float('inf'))
+        with transaction.atomic():
+            _apply({pair: -orders for pair, orders in pair_counts.items()})
+            CoPurchaseOrder.objects.filter(order_id__in=[order_id for order_id, _ in counted]).delete()
+            CoPurchaseRun.objects.create(last_order_id=counted[-1][0], removed=len(counted), pairs=len(pair_counts))
+        total_removed += len(counted)
+        total_pairs += len(pair_counts)
+
+    new = paid.exclude(id__in=CoPurchaseOrder.objects.values('order_id')).order_by('id')
+    limit = max_basket()
+    while True:
+        order_ids = list(new.values_list('id', flat=True)[:batch_size])
+        if not order_ids:
+            break
+        baskets = {order_id: sorted(set(basket)) for order_id, basket in _baskets(order_ids).items()}
+        pair_counts = count_pairs(baskets.values(), limit)
+        with transaction.atomic():
+            _apply(pair_counts)
+            CoPurchaseOrder.objects.bulk_create([
+                CoPurchaseOrder(order_id=order_id, product_ids=basket if 1 < len(basket) <= limit else [])
+                for order_id, basket in baskets.items()
+            ])
+            CoPurchaseRun.objects.create(last_order_id=order_ids[-1], orders=len(order_ids), pairs=len(pair_counts))
+        total_orders += len(order_ids)
+        total_pairs += len(pair_counts)
+
+    logger.info(
+        f"Co-purchases updated from {total_orders} new and {total_removed} no longer paid orders "
+        f"({total_pairs} distinct pairs)"
+    )
+    return total_orders + total_removed, total_pairs
+
+
+def _available(product_ids, limit):
+    from ..models import Product
+
+    if not product_ids:
+        return []
+    products = Product.objects.filter(id__in=product_ids, is_available=True).select_related('category').in_bulk()
+    return [products[product_id] for product_id in product_ids if product_id in products][:limit]
+
+def bought_together(product_id, limit=4):
+    """Available products most often bought with one product (two queries)"""
+    from ..models import FrequentlyBoughtTogether
+
+    neighbours = FrequentlyBoughtTogether.objects.filter(product_id=product_id).values_list('neighbours', flat=True).first()
+    return _available([other_id for other_id, _ in neighbours or ()], limit)
+
+def bought_together_for_cart(product_ids, limit=4):
+    """
+    Available products most often bought with anything in the cart,
+    ranked by their summed co-purchase counts (two queries)
+    """
+    from ..models import FrequentlyBoughtTogether
+
+    in_cart = set(product_ids)
+    if not in_cart:
+        return []
+    scores = Counter()
+    for neighbours in FrequentlyBoughtTogether.objects.filter(product_id__in=in_cart).values_list('neighbours', flat=True):
+        for other_id, orders in neighbours:
+            if other_id not in in_cart:
+                scores[other_id] += orders
+    ranked = sorted(scores, key=lambda other_id: (-scores[other_id], other_id))
+    return _available(ranked, limit)
@@ -0,0 +1,222 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+Enabled by listing replica aliases and installing the router and middleware:
+
+    DATABASES = {'default': {...}, 'replica': {...}}
+    DATABASE_REPLICAS = ['replica']
+    DATABASE_ROUTERS = ['products.utils.db_routing.ReplicaRouter']
+    MIDDLEWARE = [
+        'django.middleware.security.SecurityMiddleware',
+        'products.middleware.ReplicaRoutingMiddleware',  # outside sessions, to see their writes
+        ...
+    ]
+
+Only GET and HEAD requests to the URL names in REPLICA_READ_VIEWS read from
+a replica. Every write, every read that follows a write in the same
+request, and every read of REPLICA_PRIMARY_APPS (sessions by default)
+goes to the primary. A response to a request that wrote pins that browser
+to the primary for REPLICA_STICKY_SECONDS through a cookie, so users see
+their own changes; catalog cache invalidations likewise pin everyone for
+REPLICA_MAX_LAG_SECONDS, so a page cached right after one is not rebuilt
+from a replica that has not caught up yet.
+
+Replicas are health-checked at most every REPLICA_CHECK_INTERVAL seconds
+per process. One that cannot be reached, or on MySQL and PostgreSQL lags
+more than REPLICA_MAX_LAG_SECONDS, is skipped for REPLICA_RETRY_SECONDS;
+with none left, reads go to the primary. Locally, two SQLite files (a
+copy of the primary's as the replica) stand in for a replicated pair.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.connection import ConnectionDoesNotExist
+from .metrics import registry
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'db_primary_until'
+FENCE_KEY = 'db_routing:primary_until'
+DEFAULT_READ_VIEWS = (
+    'store', 'products_by_category', 'product_detail', 'home', 'get_recommendations', 'order_status',
+)
+
+
+def replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+def read_views():
+    return set(getattr(settings, 'REPLICA_READ_VIEWS', DEFAULT_READ_VIEWS))
+
+def primary_apps():
+    return set(getattr(settings, 'REPLICA_PRIMARY_APPS', {'sessions'}))
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+def max_lag_seconds():
+    return getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 2)
+
+
+@dataclass
+class RoutingState:
+    """Where the current request reads from, and whether it has written"""
+    alias: str = None
+    wrote: bool = False
+
+
+_state = ContextVar('replica_routing', default=None)
+
+
+@contextmanager
+def routing(alias=None):
+    """Route the block's reads to alias (None for the primary); yields its RoutingState"""
+    state = RoutingState(alias)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+def current_state():
+    """The RoutingState of the enclosing routing() block, or None outside one"""
+    return _state.get()
+
+def failed_on_replica(exception):
+    """
+    Whether exception is a database error raised while reads went to a
+    replica. Views that turn errors into responses must re-raise these, so
+    ReplicaRoutingMiddleware can run them again on the primary.
+    """
+    state = _state.get()
+    return isinstance(exception, DatabaseError) and state is not None and state.alias is not None
+
+
+class ReplicaRouter:
+    """Reads go where the current routing() block says; writes always go to the primary"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.alias is None or model._meta.app_label in primary_apps():
+            # Explicit, so relations of rows read from a replica are not read there too
+            return DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # Read your own write for the rest of the request
+            state.wrote = True
+            state.alias = None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaHealth:
+    """Per-process record of which replicas are usable"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = {}
+        self._skipped_until = {}
+
+    def reset(self):
+        with self._lock:
+            self._checked_at.clear()
+            self._skipped_until.clear()
+
+    def mark_failed(self, alias, reason, detail=''):
+        """Skip alias for REPLICA_RETRY_SECONDS; reason is 'unavailable', 'lagging' or 'error'"""
+        retry = getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        with self._lock:
+            self._skipped_until[alias] = time.monotonic() + retry
+        registry.inc('db_replica_fallbacks_total', {'alias': alias, 'reason': reason})
+        logger.warning(f"Skipping replica {alias} for {retry}s, {reason}: {detail}")
+
+    def is_usable(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            if self._skipped_until.get(alias, 0) > now:
+                return False
+            due = now - self._checked_at.get(alias, float('-inf')) >= getattr(settings, 'REPLICA_CHECK_INTERVAL', 5)
+            if due:
+                self._checked_at[alias] = now
+        if not due:
+            return True
+        try:
+            lag = replica_lag(alias)
+        except (ConnectionDoesNotExist, DatabaseError) as e:
+            self.mark_failed(alias, 'unavailable', str(e))
+            return False
+        if lag is not None and lag > max_lag_seconds():
+            self.mark_failed(alias, 'lagging', f'{lag:.1f}s behind')
+            return False
+        return True
+
+
+health = ReplicaHealth()
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind the primary: float('inf') when
+    replication is stopped, None when the backend cannot tell (SQLite).
+    Connecting is part of the check, so an unreachable replica raises.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+            except DatabaseError:
+                cursor.execute('SHOW SLAVE STATUS')  # MySQL before 8.0.22
+            row = cursor.fetchone()
+            if row is None:
+                return None  # Not a replica, e.g. the primary listed as one
+            status = dict(zip((column[0] for column in cursor.description), row))
+            lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+            return float('inf') if lag is None else float(lag)
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT CASE WHEN pg_is_in_recovery() THEN '
+                'COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+            )
+            lag = cursor.fetchone()[0]
+            return None if lag is None else float(lag)
+        cursor.execute('SELECT 1')
+        return None
+
+def choose_replica():
+    """A usable replica alias at random, or None when reads must go to the primary"""
+    usable = [alias for alias in replica_aliases() if health.is_usable(alias)]
+    return random.choice(usable) if usable else None
+
+
+def is_pinned(request):
+    """Whether the request's browser wrote within the last REPLICA_STICKY_SECONDS"""
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def pin(response):
+    seconds = sticky_seconds()
+    response.set_cookie(STICKY_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds, httponly=True, samesite='Lax')
+
+def hold_replica_reads():
+    """Send everyone's reads to the primary until replicas have caught up with a write"""
+    if replica_aliases():
+        cache.set(FENCE_KEY, True, max_lag_seconds())
+
+def replica_reads_held():
+    return bool(cache.get(FENCE_KEY))
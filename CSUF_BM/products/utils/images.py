@@ -0,0 +1,254 @@
+"""
+Resized and WebP copies of uploaded product and category images.
+
+Pillow work runs in a process pool on raw bytes; this process reads the
+originals, writes the derivatives through default_storage and records
+them in ImageDerivatives, the manifest that templates read srcset URLs
+from (never the filesystem).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Target widths in pixels; images are never upscaled
+DEFAULT_SIZES = {'thumbnail': 160, 'card': 480, 'detail': 1200}
+# <img sizes> hints for each slot the templates render
+SIZE_HINTS = {
+    'thumbnail': '160px',
+    'card': '(min-width: 992px) 25vw, (min-width: 576px) 50vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+}
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def derivative_sizes():
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+def render_derivatives(data, sizes, quality=82):
+    """
+    Encode every size of one image. Runs in pool workers, so it only
+    takes and returns plain bytes and dicts.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    width, height = image.size
+    variants = {}
+    for name, target in sizes.items():
+        variant_width = min(target, width)
+        variant_height = max(1, round(height * variant_width / width))
+        resized = image
+        if variant_width != width:
+            resized = image.resize((variant_width, variant_height), Image.Resampling.LANCZOS)
+
+        fallback = io.BytesIO()
+        if has_alpha:
+            resized.save(fallback, 'PNG', optimize=True)
+        else:
+            resized.save(fallback, 'JPEG', quality=quality, optimize=True, progressive=True)
+        webp = io.BytesIO()
+        resized.save(webp, 'WEBP', quality=quality, method=4)
+        variants[name] = {
+            'width': variant_width,
+            'height': variant_height,
+            'fallback': fallback.getvalue(),
+            'fallback_ext': 'png' if has_alpha else 'jpg',
+            'webp': webp.getvalue(),
+        }
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def _get_pool(workers):
+    # spawn, not fork: forking a threaded server process can deadlock the child
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return pool
+
+def _default_workers():
+    return getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+
+def _render_all(jobs, workers):
+    """{name: rendered or exception} for {name: bytes}; workers=0 renders inline"""
+    sizes = derivative_sizes()
+    quality = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 82)
+    results = {}
+    if not workers:
+        for name, data in jobs.items():
+            try:
+                results[name] = render_derivatives(data, sizes, quality)
+            except Exception as e:
+                results[name] = e
+        return results
+
+    pool = _get_pool(workers)
+    futures = {name: pool.submit(render_derivatives, data, sizes, quality) for name, data in jobs.items()}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = e
+    return results
+
+
+def derivative_path(original, digest, size, ext):
+    stem = os.path.splitext(original)[0]
+    return f'derivatives/{stem}-{digest}/{size}.{ext}'
+
+def _store(original, digest, rendered):
+    """Write the encoded files and return the manifest's variants dict"""
+    variants = {}
+    for size, variant in rendered['variants'].items():
+        paths = {}
+        for key, ext, content in (
+            ('src', variant['fallback_ext'], variant['fallback']),
+            ('webp', 'webp', variant['webp']),
+        ):
+            path = derivative_path(original, digest, size, ext)
+            # Paths embed the content hash, so an existing file is already right
+            if not default_storage.exists(path):
+                path = default_storage.save(path, ContentFile(content))
+            paths[key] = path
+        variants[size] = {'width': variant['width'], 'height': variant['height'], **paths}
+    return variants
+
+def _delete_replaced(old_variants, new_variants):
+    keep = {path for variant in new_variants.values() for path in (variant['src'], variant['webp'])}
+    for variant in old_variants.values():
+        for path in (variant.get('src'), variant.get('webp')):
+            if path and path not in keep:
+                default_storage.delete(path)
+
+def generate_derivatives(names, force=False, workers=None):
+    """
+    Render and record derivatives for the given original image names.
+    Originals whose content hash matches the manifest are skipped unless
+    force is set. Returns the number of originals (re)rendered.
+    """
+    from ..models import ImageDerivatives
+
+    names = sorted({name for name in names if name})
+    if not names:
+        return 0
+    workers = _default_workers() if workers is None else workers
+
+    originals = {}
+    for name in names:
+        try:
+            with default_storage.open(name, 'rb') as original:
+                originals[name] = original.read()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot read image {name} for derivatives: {e}")
+    if not originals:
+        return 0
+
+    manifest = {row.original: row for row in ImageDerivatives.objects.filter(original__in=originals)}
+    jobs, digests = {}, {}
+    for name, data in originals.items():
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        current = manifest.get(name)
+        if current is not None and current.source_hash == digest and not force:
+            continue
+        jobs[name] = data
+        digests[name] = digest
+
+    rendered = 0
+    for name, result in _render_all(jobs, workers).items():
+        if isinstance(result, Exception):
+            logger.warning(f"Cannot render derivatives of {name}: {result}")
+            continue
+        variants = _store(name, digests[name], result)
+        ImageDerivatives.objects.update_or_create(original=name, defaults={
+            'source_hash': digests[name],
+            'width': result['width'],
+            'height': result['height'],
+            'variants': variants,
+        })
+        previous = manifest.get(name)
+        if previous is not None:
+            _delete_replaced(previous.variants, variants)
+        rendered += 1
+    return rendered
+
+def schedule_derivatives(names):
+    """Generate derivatives off the request thread (inline when IMAGE_DERIVATIVES_ASYNC is off)"""
+    names = [name for name in names if name]
+    if not names:
+        return
+    if not getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        generate_derivatives(names)
+        return
+
+    def run():
+        try:
+            generate_derivatives(names)
+        except Exception as e:
+            logger.error(f"Image derivative generation failed for {names}: {e}")
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=run, name='image-derivatives', daemon=True).start()
+
+
+def _srcset(variants, key):
+    by_width = {}
+    for variant in variants.values():
+        by_width.setdefault(variant['width'], variant[key])
+    return ', '.join(f'{default_storage.url(path)} {width}w' for width, path in sorted(by_width.items()))
+
+def picture_sources(name, variants, size='card'):
+    """Template data for one image: src plus srcsets when derivatives exist"""
+    if not name:
+        return None
+    if not variants:
+        return {'src': default_storage.url(name)}
+    chosen = variants.get(size) or max(variants.values(), key=lambda variant: variant['width'])
+    return {
+        'src': default_storage.url(chosen['src']),
+        'width': chosen['width'],
+        'height': chosen['height'],
+        'srcset': _srcset(variants, 'src'),
+        'webp_srcset': _srcset(variants, 'webp'),
+        'sizes': SIZE_HINTS.get(size, '100vw'),
+    }
+
+def image_sources(names, size='card'):
+    """{name: picture_sources} for many images from one manifest query"""
+    from ..models import ImageDerivatives
+    names = {name for name in names if name}
+    if not names:
+        return {}
+    manifest = dict(ImageDerivatives.objects.filter(original__in=names).values_list('original', 'variants'))
+    return {name: picture_sources(name, manifest.get(name), size) for name in names}
+
+def backfill_derivatives(force=False, workers=None, batch_size=100):
+    """Generate derivatives for every product, gallery and category image"""
+    from ..models import Category, Product, ProductImage
+
+    names = set()
+    for model in (Product, ProductImage, Category):
+        names.update(model.objects.exclude(image='').values_list('image', flat=True))
+    names = sorted(names)
+    rendered = 0
+    for start in range(0, len(names), batch_size):
+        rendered += generate_derivatives(names[start:start + batch_size], force=force, workers=workers)
+    return len(names), rendered
@@ -0,0 +1,195 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from .cache import CacheKeyBuilder
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; one extra bucket catches everything slower
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INDEX_KEY = 'metrics:index'
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms.
+
+    Recording only touches local dicts under a lock. Pending deltas are
+    pushed to the shared cache every flush_interval seconds as atomic
+    cache.incr calls (one per changed series bucket), so all workers add
+    up without read-modify-write races and requests pay no round trips
+    between flushes.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, flush_interval=10.0):
+        self.buckets = tuple(buckets)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._histograms = {}
+        self._series = {}
+        self._indexed = set()
+        self._next_flush = time.monotonic() + flush_interval
+
+    @staticmethod
+    def _series_id(name, labels):
+        return CacheKeyBuilder.stable_hash([name, sorted(labels.items())])
+
+    def _register(self, kind, name, labels):
+        series_id = self._series_id(name, labels)
+        if series_id not in self._series:
+            self._series[series_id] = {'type': kind, 'name': name, 'labels': dict(labels)}
+        return series_id
+
+    def inc(self, name, labels=None, amount=1):
+        labels = labels or {}
+        with self._lock:
+            self._counters[self._register('counter', name, labels)] += amount
+
+    def observe(self, name, seconds, labels=None):
+        labels = labels or {}
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series_id = self._register('histogram', name, labels)
+            pending = self._histograms.get(series_id)
+            if pending is None:
+                # One slot per bucket, the +Inf bucket, then the sum
+                pending = self._histograms[series_id] = [0] * (len(self.buckets) + 2)
+            pending[index] += 1
+            # Last slot: sum of observations in microseconds
+            pending[-1] += int(seconds * 1_000_000)
+
+    def maybe_flush(self):
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """Push pending deltas to the cache and clear them"""
+        with self._lock:
+            counters, self._counters = self._counters, defaultdict(int)
+            histograms, self._histograms = self._histograms, {}
+            unindexed = (set(counters) | set(histograms)) - self._indexed
+            new_series = {series_id: self._series[series_id] for series_id in unindexed}
+            self._next_flush = time.monotonic() + self.flush_interval
+
+        try:
+            if new_series:
+                self._update_index(new_series)
+            for series_id, amount in counters.items():
+                if amount:
+                    self._incr(f'metrics:{series_id}', amount)
+            for series_id, pending in histograms.items():
+                for index, count in enumerate(pending[:-1]):
+                    if count:
+                        self._incr(f'metrics:{series_id}:{index}', count)
+                self._incr(f'metrics:{series_id}:sum', pending[-1])
+        except Exception as e:
+            logger.error(f"Error flushing metrics: {e}")
+
+    @staticmethod
+    def _incr(key, amount):
+        if not cache.add(key, amount, timeout=None):
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                cache.add(key, amount, timeout=None)
+
+    def _update_index(self, new_series, attempts=3):
+        """Merge series descriptions into the shared index, re-checking for lost writes"""
+        for _ in range(attempts):
+            index = cache.get(INDEX_KEY) or {}
+            index.update(new_series)
+            cache.set(INDEX_KEY, index, timeout=None)
+            if set(new_series) <= set(cache.get(INDEX_KEY) or {}):
+                with self._lock:
+                    self._indexed.update(new_series)
+                return
+
+    def collect(self):
+        """Cluster-wide totals from the cache, as {series_id: (description, values)}"""
+        index = cache.get(INDEX_KEY) or {}
+        keys = []
+        for series_id, series in index.items():
+            if series['type'] == 'counter':
+                keys.append(f'metrics:{series_id}')
+            else:
+                keys.extend(f'metrics:{series_id}:{i}' for i in range(len(self.buckets) + 1))
+                keys.append(f'metrics:{series_id}:sum')
+        values = cache.get_many(keys)
+
+        collected = {}
+        for series_id, series in index.items():
+            if series['type'] == 'counter':
+                collected[series_id] = (series, values.get(f'metrics:{series_id}', 0))
+            else:
+                counts = [values.get(f'metrics:{series_id}:{i}', 0) for i in range(len(self.buckets) + 1)]
+                total_us = values.get(f'metrics:{series_id}:sum', 0)
+                collected[series_id] = (series, (counts, total_us / 1_000_000))
+        return collected
+
+    def render_text(self):
+        """
+        Prometheus text exposition of the collected totals. Histograms are
+        exposed as _bucket, _sum and _count only; quantiles are for the
+        scraper to compute with histogram_quantile() over the buckets.
+        """
+        lines = []
+        typed = set()
+        for series, value in sorted(self.collect().values(), key=lambda item: (item[0]['name'], str(item[0]['labels']))):
+            name = series['name']
+            labels = series['labels']
+            if name not in typed:
+                lines.append(f"# TYPE {name} {series['type']}")
+                typed.add(name)
+            if series['type'] == 'counter':
+                lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+class QueryCounter:
+    """
+    Counts the SQL statements run on every database connection while
+    active. Installed as an execute_wrapper, so it works with DEBUG off.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def active(self):
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in sorted(labels.items())) + '}'
+
+
+registry = MetricsRegistry(flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 10.0))
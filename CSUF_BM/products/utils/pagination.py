@@ -0,0 +1,128 @@
+from django.core import signing
+from django.db.models import Q
+from django.urls import reverse
+from .images import image_sources
+
+# Keyset order for every ProductSortForm choice; id breaks ties so rows never repeat
+STORE_SORT_ORDERINGS = {
+    '': ('-created_date', '-id'),
+    '-created_date': ('-created_date', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'name': ('name', 'id'),
+    '-name': ('-name', '-id'),
+    'recommendations': ('-recommendation_count', '-id'),
+}
+
+# Only the columns the store product card renders
+STORE_CARD_FIELDS = (
+    'id', 'name', 'slug', 'price', 'image', 'average_rating', 'created_date',
+    'category__slug', 'recommendation_count', 'recent_recommenders',
+)
+
+CURSOR_SALT = 'store.cursor'
+
+
+def store_ordering(sort_by):
+    return STORE_SORT_ORDERINGS.get(sort_by, STORE_SORT_ORDERINGS[''])
+
+def encode_cursor(sort_by, row):
+    """Opaque token holding the sort values of the last row on a page"""
+    values = [str(row[field.lstrip('-')]) for field in store_ordering(sort_by)]
+    return signing.dumps({'s': sort_by, 'v': values}, salt=CURSOR_SALT, compress=True)
+
+def decode_cursor(sort_by, token):
+    """Sort values from a cursor, or None when it is missing, forged or from another sort"""
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('s') != sort_by or len(data.get('v', ())) != len(store_ordering(sort_by)):
+        return None
+    return data['v']
+
+def keyset_filter(ordering, values):
+    """
+    Rows strictly after values in ordering, as
+    (a > x) OR (a = x AND b > y) OR ...
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+def fetch_store_page(queryset, sort_by='', cursor=None, page_size=24, order_by=None):
+    """
+    Evaluate one page of store cards with keyset pagination.
+
+    order_by replaces the sort's plain columns in the ORDER BY with
+    expressions of the same columns (see utils/store_filters.py).
+    Returns a plain dict of rows plus the cursor of the next page, so the
+    result can be cached as-is.
+    """
+    ordering = store_ordering(sort_by)
+    values = decode_cursor(sort_by, cursor)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+
+    rows = list(queryset.order_by(*(order_by or ordering)).values(*STORE_CARD_FIELDS)[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    return {
+        'products': build_store_cards(rows),
+        'next_cursor': encode_cursor(sort_by, rows[-1]) if has_next else None,
+    }
+
+def fetch_snapshot_page(snapshot, sort_by='', cursor=None, page_size=24, category_id=None):
+    """fetch_store_page over the catalog snapshot instead of the product table"""
+    rows = snapshot.page(sort_by, decode_cursor(sort_by, cursor), page_size + 1, category_id)
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    return {
+        'products': build_store_cards(rows),
+        'next_cursor': encode_cursor(sort_by, rows[-1]) if has_next else None,
+    }
+
+def build_store_cards(rows):
+    """Card dicts for STORE_CARD_FIELDS rows, with up to two recommenders each"""
+    from ..models import Product
+
+    recommenders = {row['id']: row['recent_recommenders'] for row in rows if 'recent_recommenders' in row}
+    # Snapshot rows carry only the count; fetch the names of recommended products by primary key
+    missing = [row['id'] for row in rows if row['id'] not in recommenders and row['recommendation_count']]
+    if missing:
+        recommenders.update(Product.objects.filter(id__in=missing).values_list('id', 'recent_recommenders'))
+
+    storage = Product._meta.get_field('image').storage
+    images = image_sources([row['image'] for row in rows], 'card')
+    cards = []
+    for row in rows:
+        product_recommenders = recommenders.get(row['id'], [])
+        cards.append({
+            'id': row['id'],
+            'name': row['name'],
+            'price': row['price'],
+            'average_rating': row['average_rating'],
+            'url': reverse('product_detail', args=[row['category__slug'], row['slug']]),
+            'image_url': storage.url(row['image']) if row['image'] else '',
+            'image': images.get(row['image']),
+            'recommendation_count': row['recommendation_count'],
+            'recommenders': product_recommenders[:2],
+            # Matches the old badge: the most recent recommendation decides
+            'is_essential': bool(product_recommenders) and product_recommenders[0]['is_essential'],
+        })
+    return cards
+
+def store_cards_for_ids(queryset, product_ids):
+    """Cards for the given products, in the order of product_ids"""
+    rows = queryset.filter(id__in=product_ids).values(*STORE_CARD_FIELDS)
+    by_id = {row['id']: row for row in rows}
+    return build_store_cards([by_id[pid] for pid in product_ids if pid in by_id])
@@ -0,0 +1,159 @@
+"""
+Per-request SQL inspection for development and tests.
+
+QueryRecorder keeps every statement a request runs with its duration and
+the innermost project frame that triggered it: for a lazy relation read
+in a model property, e.g. cart/models.py in subtotal, and for one read by
+a template, the view's render call plus the template line. Statements
+are grouped by shape: literals and parameter lists are collapsed, so the
+same lookup for different rows counts as one shape. A shape repeated
+QUERY_REPEAT_THRESHOLD times or more is flagged as a likely N+1.
+
+QUERY_BUDGETS maps URL names to the most queries their view may run.
+RequestMetricsMiddleware checks it in inspection mode, and
+QueryBudgetMixin.assertQueryBudget checks it in tests.
+"""
+from collections import Counter
+from django.conf import settings
+from django.urls import reverse
+from pathlib import Path
+from .metrics import QueryCounter
+import re
+import sys
+import sysconfig
+import time
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+_LIBRARY_PATHS = tuple(
+    str(Path(path).resolve()) for path in {sysconfig.get_paths()['stdlib'], sysconfig.get_paths()['purelib']}
+)
+_THIS_FILE = str(Path(__file__).resolve())
+
+# Observed on the views' tests with cold caches, plus a little headroom
+DEFAULT_QUERY_BUDGETS = {
+    'store': 12,
+    'products_by_category': 12,
+    'product_detail': 15,
+    'cart_detail': 9,
+    'checkout': 9,
+    'dashboard': 10,
+}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def query_budgets():
+    return {**DEFAULT_QUERY_BUDGETS, **getattr(settings, 'QUERY_BUDGETS', {})}
+
+def repeat_threshold():
+    return getattr(settings, 'QUERY_REPEAT_THRESHOLD', 3)
+
+def inspection_enabled():
+    return getattr(settings, 'QUERY_INSPECTION', settings.DEBUG)
+
+
+def normalize_sql(sql):
+    """The statement's shape: literals become ?, IN lists become (...)"""
+    shape = _STRING.sub('?', sql)
+    shape = _NUMBER.sub('?', shape).replace('%s', '?')
+    shape = _PLACEHOLDER_LIST.sub('(...)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+def _template_site(frame):
+    # Template nodes render through Node.render_annotated(self, context)
+    node = frame.f_locals.get('self')
+    origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+    if origin is None or token is None:
+        return None
+    return f'{origin.template_name}:{token.lineno}'
+
+def _call_site():
+    """Innermost project frame as 'path:line in function', plus the template line if one was rendering"""
+    frame = sys._getframe(2)
+    template = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            template = _template_site(frame)
+        if (filename.startswith(str(PROJECT_ROOT)) and filename != _THIS_FILE
+                and not filename.startswith(_LIBRARY_PATHS)):
+            site = f'{Path(filename).relative_to(PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}'
+            return f'{site} via {template}' if template else site
+        frame = frame.f_back
+    return '<unknown>'
+
+
+class QueryRecorder(QueryCounter):
+    """QueryCounter that also keeps (sql, milliseconds, call site) per statement"""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        site = _call_site()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - started) * 1000, site))
+
+    @property
+    def total_ms(self):
+        return sum(milliseconds for _, milliseconds, _ in self.queries)
+
+    def repeated(self, threshold=None):
+        """
+        [(shape, count, total ms, Counter of call sites)] for shapes run at
+        least threshold times, most frequent first
+        """
+        threshold = repeat_threshold() if threshold is None else threshold
+        groups = {}
+        for sql, milliseconds, site in self.queries:
+            group = groups.setdefault(normalize_sql(sql), [0, 0.0, Counter()])
+            group[0] += 1
+            group[1] += milliseconds
+            group[2][site] += 1
+        return sorted(
+            ((shape, count, total, sites) for shape, (count, total, sites) in groups.items() if count >= threshold),
+            key=lambda group: -group[1],
+        )
+
+    def report(self, threshold=None):
+        """Readable listing of every statement, then the repeated shapes"""
+        lines = [f'{self.count} queries in {self.total_ms:.1f} ms']
+        lines += [f'  {milliseconds:7.2f} ms  {site}\n      {sql}' for sql, milliseconds, site in self.queries]
+        for shape, count, total, sites in self.repeated(threshold):
+            lines.append(f'Repeated {count}x ({total:.1f} ms): {shape}')
+            lines += [f'    {times}x from {site}' for site, times in sites.most_common()]
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin asserting how many queries a URL may run"""
+
+    def assertQueryBudget(self, url_name, budget=None, *, args=None, kwargs=None, method='get', data=None,
+                          client=None, max_repeats=None):
+        """
+        Request url_name and fail if it ran more than budget queries
+        (QUERY_BUDGETS[url_name] by default) or, when max_repeats is given,
+        any statement shape more than max_repeats times. Returns the response.
+        """
+        budget = query_budgets()[url_name] if budget is None else budget
+        client = client or self.client
+        recorder = QueryRecorder()
+        with recorder.active():
+            response = getattr(client, method)(reverse(url_name, args=args, kwargs=kwargs), data)
+        self.assertLessEqual(
+            recorder.count, budget, f'{url_name} ran over its budget of {budget} queries:\n{recorder.report()}'
+        )
+        if max_repeats is not None:
+            self.assertFalse(
+                recorder.repeated(max_repeats + 1),
+                f'{url_name} repeated a query more than {max_repeats} times:\n{recorder.report(max_repeats + 1)}',
+            )
+        return response
@@ -0,0 +1,40 @@
+from django.db.models import Count, Q, Sum
+
+
+def reconcile_ratings(product_model=None, review_model=None, batch_size=500):
+    """
+    Recompute every product's rating counters from its reviews.
+
+    Runs one grouped aggregate over the reviews and bulk-updates only the
+    products whose stored counters drifted. The model arguments let data
+    migrations pass their historical models.
+
+    Returns the number of products corrected.
+    """
+    if product_model is None or review_model is None:
+        from ..models import Product, ProductReview
+        product_model, review_model = Product, ProductReview
+
+    histogram = [f'rating_{stars}_count' for stars in range(1, 6)]
+    aggregates = review_model.objects.values('product_id').annotate(
+        rating_sum=Sum('rating'),
+        rating_count=Count('id'),
+        **{field: Count('id', filter=Q(rating=stars)) for stars, field in enumerate(histogram, 1)}
+    ).order_by()
+    expected = {row.pop('product_id'): row for row in aggregates}
+
+    fields = ['rating_sum', 'rating_count', 'average_rating'] + histogram
+    empty = dict.fromkeys(['rating_sum', 'rating_count'] + histogram, 0)
+    stale = []
+    for product in product_model.objects.only(*fields).iterator(chunk_size=batch_size):
+        counters = expected.get(product.id, empty)
+        average = round(counters['rating_sum'] / counters['rating_count'], 2) if counters['rating_count'] else 0
+        if any(getattr(product, name) != value for name, value in counters.items()) or \
+                float(product.average_rating) != average:
+            for name, value in counters.items():
+                setattr(product, name, value)
+            product.average_rating = average
+            stale.append(product)
+
+    product_model.objects.bulk_update(stale, fields, batch_size=batch_size)
+    return len(stale)
@@ -0,0 +1,83 @@
+"""
+Per-product summary of faculty recommendations, stored on Product.
+
+Store listings filter, sort and render badges from these columns alone:
+recommendation_count, has_essential_recommendation, the '|'-delimited
+recommendation_departments, the recommender_names search string and the
+two newest recommenders. products.signals recomputes a product's summary
+whenever one of its recommendations, or a recommender's name or
+department, changes.
+"""
+from collections import defaultdict
+
+SEPARATOR = '|'
+RECENT_RECOMMENDERS = 2
+
+
+def department_token(department):
+    """Substring matching exactly one department in recommendation_departments"""
+    return f'{SEPARATOR}{department}{SEPARATOR}'
+
+def summarize(recommendations):
+    """Summary fields for one product's (is_essential, department, first name, last name) rows, newest first"""
+    departments = sorted({department for _, department, _, _ in recommendations if department})
+    recommenders = [
+        {'name': f'{first_name} {last_name}'.strip(), 'department': department, 'is_essential': is_essential}
+        for is_essential, department, first_name, last_name in recommendations
+    ]
+    return {
+        'recommendation_count': len(recommendations),
+        'has_essential_recommendation': any(is_essential for is_essential, _, _, _ in recommendations),
+        'recommendation_departments': (
+            SEPARATOR + SEPARATOR.join(departments) + SEPARATOR if departments else ''
+        ),
+        'recommender_names': SEPARATOR.join(dict.fromkeys(
+            recommender['name'] for recommender in recommenders if recommender['name']
+        )),
+        'recent_recommenders': recommenders[:RECENT_RECOMMENDERS],
+    }
+
+def refresh_recommendation_summaries(product_ids=None, product_model=None, recommendation_model=None,
+                                     batch_size=500):
+    """
+    Recompute the summary of the given products (every product when None)
+    and bulk-update the ones that drifted. Costs two reads per batch.
+    The model arguments let data migrations pass their historical models.
+
+    Returns the number of products updated.
+    """
+    from ..models import RECOMMENDATION_SUMMARY_FIELDS as SUMMARY_FIELDS
+
+    if product_model is None or recommendation_model is None:
+        from ..models import Product, ProductRecommendation
+        product_model, recommendation_model = Product, ProductRecommendation
+
+    if product_ids is None:
+        product_ids = product_model.objects.order_by('id').values_list('id', flat=True)
+    product_ids = list(product_ids)
+
+    updated = 0
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        rows = defaultdict(list)
+        for product_id, *row in recommendation_model.objects.filter(product_id__in=chunk).order_by(
+            'product_id', '-created_at', '-id'
+        ).values_list(
+            'product_id', 'is_essential', 'faculty__department', 'faculty__user__first_name', 'faculty__user__last_name'
+        ):
+            rows[product_id].append(row)
+
+        stale = []
+        for product_id, *stored in product_model.objects.filter(id__in=chunk).values_list('id', *SUMMARY_FIELDS):
+            summary = summarize(rows[product_id])
+            if list(summary.values()) != stored:
+                stale.append(product_model(id=product_id, **summary))
+        product_model.objects.bulk_update(stale, SUMMARY_FIELDS, batch_size=batch_size)
+        updated += len(stale)
+    return updated
+
+def recommended_by(faculty_user_id):
+    """Ids of the products one faculty member recommends"""
+    from ..models import ProductRecommendation
+
+    return ProductRecommendation.objects.filter(faculty_id=faculty_user_id).values_list('product_id', flat=True)
@@ -0,0 +1,60 @@
+"""
+Read-mostly reference data shown on most pages: categories, departments
+and the faculty directory. Served from the two-tier cache and invalidated
+through the CacheTags.CATEGORY / CacheTags.FACULTY tags.
+"""
+from django.conf import settings
+from .cache import CacheTags
+from .tiered_cache import TieredCache
+
+reference_cache = TieredCache(
+    'reference',
+    maxsize=getattr(settings, 'REFERENCE_CACHE_MAX_ENTRIES', 256),
+    ttl=getattr(settings, 'REFERENCE_CACHE_TTL', 300),
+)
+
+CATEGORY_TAGS = (CacheTags.CATEGORY,)
+FACULTY_TAGS = (CacheTags.FACULTY,)
+
+
+def get_categories():
+    from ..models import Category
+    return reference_cache.get_or_set(
+        'all_categories',
+        lambda: tuple(Category.objects.order_by('name')),
+        CATEGORY_TAGS,
+        stale_ttl=600  # A slightly old sidebar beats every worker querying at once
+    )
+
+def get_category(slug):
+    """Category by slug; raises Category.DoesNotExist like objects.get()"""
+    from ..models import Category
+    return reference_cache.get_or_set(
+        f'category_{slug}',
+        lambda: Category.objects.get(slug=slug),
+        CATEGORY_TAGS
+    )
+
+def get_departments():
+    from accounts.models.faculty import Faculty
+    return reference_cache.get_or_set(
+        'all_departments',
+        lambda: tuple(Faculty.objects.order_by('department').values_list('department', flat=True).distinct()),
+        FACULTY_TAGS,
+        stale_ttl=600
+    )
+
+def get_faculty_directory():
+    """(full name, department) of every faculty member, by last name"""
+    from accounts.models.faculty import Faculty
+    return reference_cache.get_or_set(
+        'faculty_directory',
+        lambda: tuple(
+            (f'{first_name} {last_name}', department)
+            for first_name, last_name, department in Faculty.objects.order_by(
+                'user__last_name', 'user__first_name'
+            ).values_list('user__first_name', 'user__last_name', 'department')
+        ),
+        FACULTY_TAGS,
+        stale_ttl=600
+    )
@@ -0,0 +1,341 @@
+from bisect import bisect_left
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from .cache import bump_version
+import logging
+import re
+import secrets
+import threading
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_KEY = 'product_search_index_version'
+TITLE_WEIGHT = 3
+# Fields whose change requires re-indexing a product
+SEARCH_FIELDS = frozenset({'name', 'brand', 'description', 'category'})
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_TOKEN_RE = re.compile(r'[\w*]+')
+
+
+def index_version():
+    """
+    Current index version. Seeded randomly so a flushed cache can never
+    hand out a version some process already holds a stale index for.
+    """
+    version = cache.get(INDEX_VERSION_KEY)
+    if version is None:
+        cache.add(INDEX_VERSION_KEY, secrets.randbits(48), timeout=None)
+        version = cache.get(INDEX_VERSION_KEY)
+    return version
+
+def publish_index_change():
+    index_version()
+    return bump_version(INDEX_VERSION_KEY)
+
+
+def tokenize(text):
+    """Lowercased word tokens of text"""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class QueryTerm:
+    """
+    One word of a search query. Plain words match as prefixes
+    ("calc" finds "calculator"); '*' matches any run of word characters
+    ("c*lator", "*book").
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.prefix = raw.split('*', 1)[0]
+        self.is_wildcard = '*' in raw.rstrip('*')
+        pattern = ''.join(r'\w*' if part == '*' else re.escape(part) for part in re.split(r'(\*)', raw))
+        self.regex = re.compile(f'^{pattern}' if not self.is_wildcard else f'^{pattern}$')
+
+    def matches(self, term):
+        return self.regex.match(term) is not None
+
+
+def parse_query(query):
+    terms = []
+    for raw in QUERY_TOKEN_RE.findall((query or '').lower()):
+        raw = re.sub(r'\*+', '*', raw)
+        if raw.strip('*'):
+            terms.append(QueryTerm(raw))
+    return terms
+
+
+def build_document(name, brand='', category_name='', description=''):
+    """(title, document) token strings stored for one product"""
+    title = tokenize(f'{name} {brand}')
+    return ' '.join(title), ' '.join(title + tokenize(f'{category_name} {description}'))
+
+
+class InvertedIndex:
+    """
+    In-process term -> {product_id: weight} postings with a sorted term
+    list, so prefixes resolve with a binary search instead of a scan.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.postings = {}
+        self.doc_terms = {}
+        self._sorted_terms = None
+        self._lock = threading.Lock()
+
+    def add(self, product_id, title, document):
+        weights = {}
+        for term in title.split():
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+        for term in document.split():
+            weights[term] = weights.get(term, 0) + 1
+        with self._lock:
+            self._remove(product_id)
+            for term, weight in weights.items():
+                self.postings.setdefault(term, {})[product_id] = weight
+            self.doc_terms[product_id] = tuple(weights)
+            self._sorted_terms = None
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        for term in self.doc_terms.pop(product_id, ()):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self.postings[term]
+                    self._sorted_terms = None
+
+    def expand(self, query_term):
+        """Indexed terms matching one query term"""
+        with self._lock:
+            if self._sorted_terms is None:
+                self._sorted_terms = sorted(self.postings)
+            terms = self._sorted_terms
+        start = bisect_left(terms, query_term.prefix)
+        for term in terms[start:]:
+            if not term.startswith(query_term.prefix):
+                break
+            if query_term.matches(term):
+                yield term
+
+    def search(self, query_terms):
+        """Scores of products matching every query term"""
+        scores = None
+        for query_term in query_terms:
+            term_scores = {}
+            for term in self.expand(query_term):
+                for product_id, weight in self.postings.get(term, {}).items():
+                    term_scores[product_id] = term_scores.get(product_id, 0) + weight
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+class InvertedIndexBackend:
+    """
+    Fallback for SQLite and other local databases. The index lives in
+    process memory, loaded from ProductSearchDocument rows and patched in
+    place by this process's own updates. Updates from other processes
+    bump a cache counter that makes the next search here reload.
+    """
+    _index = None
+    _load_lock = threading.Lock()
+
+    @classmethod
+    def get_index(cls):
+        version = index_version()
+        index = cls._index
+        if index is None or index.version != version:
+            with cls._load_lock:
+                index = cls._index
+                if index is None or index.version != version:
+                    index = cls._index = cls._load(version)
+        return index
+
+    @staticmethod
+    def _load(version):
+        from ..models import ProductSearchDocument
+        index = InvertedIndex(version)
+        rows = ProductSearchDocument.objects.values_list('product_id', 'title', 'document')
+        for product_id, title, document in rows.iterator(chunk_size=2000):
+            index.add(product_id, title, document)
+        return index
+
+    @classmethod
+    def changed(cls, previous_version, new_version, documents=(), removed=()):
+        """Patch the local index if it was current before this change"""
+        index = cls._index
+        if index is None or index.version != previous_version:
+            return
+        for product_id, title, document in documents:
+            index.add(product_id, title, document)
+        for product_id in removed:
+            index.remove(product_id)
+        index.version = new_version
+
+    def search(self, query_terms, limit=None):
+        scores = self.get_index().search(query_terms)
+        ranked = sorted(scores, key=lambda pid: (-scores[pid], pid))
+        return ranked[:limit] if limit else ranked
+
+    def documents(self, query_terms):
+        """Matching documents as a queryset; the database tests each term with REGEXP"""
+        from ..models import ProductSearchDocument
+        documents = ProductSearchDocument.objects.all()
+        for term in query_terms:
+            documents = documents.filter(document__regex=term_regex(term))
+        return documents
+
+
+class FulltextBackend:
+    """
+    MySQL FULLTEXT search over ProductSearchDocument. Every query word must
+    match (boolean mode, prefix "word*"); title matches weigh more.
+    Wildcards inside a word narrow the FULLTEXT hits with REGEXP.
+    """
+
+    @staticmethod
+    def _required(query_terms):
+        return ' '.join(f'+{term.prefix}*' for term in query_terms if term.prefix)
+
+    def search(self, query_terms, limit=None):
+        documents = self.documents(query_terms)
+        required = self._required(query_terms)
+        if required:
+            optional = required.replace('+', '')
+            documents = documents.annotate(score=RawSQL(
+                'MATCH (document) AGAINST (%s IN BOOLEAN MODE)'
+                f' + {TITLE_WEIGHT} * MATCH (title) AGAINST (%s IN BOOLEAN MODE)',
+                (required, optional),
+                output_field=FloatField()
+            )).order_by('-score', 'product_id')
+        else:
+            documents = documents.order_by('product_id')
+        ids = documents.values_list('product_id', flat=True)
+        return list(ids[:limit] if limit else ids)
+
+    def documents(self, query_terms):
+        """Matching documents as an unranked queryset"""
+        from ..models import ProductSearchDocument
+        documents = ProductSearchDocument.objects.all()
+        required = self._required(query_terms)
+        if required:
+            documents = documents.alias(matched=RawSQL(
+                'MATCH (document) AGAINST (%s IN BOOLEAN MODE)', (required,), output_field=FloatField()
+            )).filter(matched__gt=0)
+        for term in query_terms:
+            if term.is_wildcard or not term.prefix:
+                documents = documents.filter(document__regex=term_regex(term))
+        return documents
+
+
+def term_regex(term):
+    """Regex matching a query term against a space separated token string"""
+    pattern = term.regex.pattern.lstrip('^').rstrip('$')
+    if not term.is_wildcard:
+        pattern += r'\w*'
+    return f'(^| ){pattern}( |$)'
+
+
+def get_search_backend():
+    choice = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto')
+    if choice == 'fulltext' or (choice == 'auto' and connection.vendor == 'mysql'):
+        return FulltextBackend()
+    return InvertedIndexBackend()
+
+def search_product_ids(query, limit=None):
+    """Product ids matching every word of query, best match first"""
+    query_terms = parse_query(query)
+    if not query_terms:
+        return []
+    return get_search_backend().search(query_terms, limit)
+
+
+def search_documents(query):
+    """
+    Documents matching every word of query, unranked, as a queryset to
+    filter other queries with in the database, e.g. by
+    id__in=search_documents(query).values('product_id')
+    """
+    from ..models import ProductSearchDocument
+    query_terms = parse_query(query)
+    if not query_terms:
+        return ProductSearchDocument.objects.none()
+    return get_search_backend().documents(query_terms)
+
+
+def _document_rows(products):
+    for product in products:
+        title, document = build_document(product.name, product.brand, product.category.name, product.description)
+        yield product.id, title, document
+
+def index_products(product_ids):
+    """Rebuild the search documents of the given products"""
+    from ..models import Product, ProductSearchDocument
+    product_ids = set(product_ids)
+    products = Product.objects.filter(id__in=product_ids).select_related('category').only(
+        'id', 'name', 'brand', 'description', 'category__name'
+    )
+    rows = list(_document_rows(products))
+    with transaction.atomic():
+        ProductSearchDocument.objects.filter(product_id__in=product_ids).delete()
+        ProductSearchDocument.objects.bulk_create([
+            ProductSearchDocument(product_id=pid, title=title, document=document)
+            for pid, title, document in rows
+        ])
+    missing = product_ids - {row[0] for row in rows}
+    _publish(rows, missing)
+    return len(rows)
+
+def remove_products(product_ids):
+    from ..models import ProductSearchDocument
+    product_ids = list(product_ids)
+    ProductSearchDocument.objects.filter(product_id__in=product_ids).delete()
+    _publish((), product_ids)
+
+def _publish(documents, removed):
+    new_version = publish_index_change()
+    InvertedIndexBackend.changed(new_version - 1, new_version, documents, removed)
+
+def rebuild_index(batch_size=500, product_model=None, document_model=None, publish=True):
+    """
+    Rewrite every search document from scratch. The model arguments let
+    data migrations pass their historical models; publish=False skips the
+    cache version bump. Returns the number of products indexed.
+    """
+    if product_model is None or document_model is None:
+        from ..models import Product, ProductSearchDocument
+        product_model, document_model = Product, ProductSearchDocument
+
+    products = product_model.objects.select_related('category').only(
+        'id', 'name', 'brand', 'description', 'category__name'
+    ).order_by('id')
+    indexed = 0
+    batch = []
+    with transaction.atomic():
+        document_model.objects.all().delete()
+        for product_id, title, document in _document_rows(products.iterator(chunk_size=batch_size)):
+            batch.append(document_model(product_id=product_id, title=title, document=document))
+            if len(batch) >= batch_size:
+                document_model.objects.bulk_create(batch)
+                indexed += len(batch)
+                batch = []
+        document_model.objects.bulk_create(batch)
+        indexed += len(batch)
+    if publish:
+        publish_index_change()
+    logger.info(f"Rebuilt product search index with {indexed} documents")
+    return indexed
@@ -0,0 +1,412 @@
+"""
+Memory-mapped columnar snapshot of the available catalog.
+
+build_snapshot() writes the listing fields of every available product
+into one binary file: fixed-width columns, string columns as offsets
+into a UTF-8 blob, and precomputed sort orders. The new file is written
+next to the live one and swapped in with os.replace(), so readers never
+see a partial file. Each worker maps the file read-only and reads the
+columns through memoryviews, so the pages are shared between processes
+and nothing is unpickled per request. Columns use the host's native
+byte order; build and read the file on the same machine. Stock is left
+out: checkout and cart holds change it with queryset updates that send
+no signal, so product pages read it live.
+
+Enabled by setting CATALOG_SNAPSHOT_PATH; without it get_snapshot()
+returns None and callers read the database as before.
+"""
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.urls import reverse
+import bisect
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CATSNAP1'
+HEADER = struct.Struct('<8sQQI')  # magic, generation, product count, section count
+SECTION = struct.Struct('<24ssQQ')  # name, typecode ('s' for raw bytes), offset, length
+ALIGNMENT = 8
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+FLAG_FEATURED = 4
+FLAG_DIGITAL = 8
+
+# Served order of each ProductSortForm choice: (ascending order column, read it backwards)
+SNAPSHOT_ORDERS = {
+    '': ('order_created', True),
+    '-created_date': ('order_created', True),
+    'price': ('order_price', False),
+    '-price': ('order_price', True),
+    'name': ('order_name', False),
+    '-name': ('order_name', True),
+    'recommendations': ('order_recommendations', True),
+}
+
+_current = {'path': None, 'identity': None, 'snapshot': None, 'checked_at': 0.0}
+_current_lock = threading.Lock()
+_rebuild = {'running': False, 'dirty': False}
+_rebuild_lock = threading.Lock()
+REBUILD_LOCK_KEY = 'catalog_snapshot:rebuilding'
+REBUILD_PENDING_KEY = 'catalog_snapshot:pending'
+
+
+def snapshot_path():
+    return getattr(settings, 'CATALOG_SNAPSHOT_PATH', None)
+
+def _micros(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def _datetime(micros):
+    value = EPOCH + timedelta(microseconds=micros)
+    # Same awareness as the DateTimeField values the database path returns
+    return value if settings.USE_TZ else value.replace(tzinfo=None)
+
+def _hundredths(value):
+    return int((Decimal(value) * 100).to_integral_value())
+
+def _name_key(name):
+    return name.casefold()
+
+
+class SnapshotProduct:
+    """A product row read from the snapshot; enough for listings and links"""
+    __slots__ = (
+        'id', 'slug', 'name', 'price', 'discount', 'average_rating', 'image',
+        'category_id', 'category_slug', 'created_date', 'recommendation_count', 'flags',
+    )
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @property
+    def is_digital(self):
+        return bool(self.flags & FLAG_DIGITAL)
+
+    def get_url(self):
+        return reverse('product_detail', args=[self.category_slug, self.slug])
+
+
+class CatalogSnapshot:
+    """Read-only view over one snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        magic, self.generation, self.count, sections = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        self._columns = {}
+        for number in range(sections):
+            name, typecode, offset, length = SECTION.unpack_from(buffer, HEADER.size + number * SECTION.size)
+            view = buffer[offset:offset + length]
+            self._columns[name.rstrip(b'\0').decode()] = view if typecode == b's' else view.cast(typecode.decode())
+
+        # A few dozen rows at most; plain dicts are simpler than searching columns
+        self.category_ids = {
+            self._text('category_slug', index): self._columns['category_id'][index]
+            for index in range(len(self._columns['category_id']))
+        }
+        self._category_slugs = {category_id: slug for slug, category_id in self.category_ids.items()}
+
+    def __len__(self):
+        return self.count
+
+    def _text(self, column, index):
+        offsets = self._columns[f'{column}_offsets']
+        return str(self._columns[f'{column}_data'][offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def _raw_text(self, column, index):
+        offsets = self._columns[f'{column}_offsets']
+        return self._columns[f'{column}_data'][offsets[index]:offsets[index + 1]].tobytes()
+
+    def row(self, index):
+        """STORE_CARD_FIELDS-style dict for the product at index"""
+        columns = self._columns
+        return {
+            'id': columns['id'][index],
+            'name': self._text('name', index),
+            'slug': self._text('slug', index),
+            'price': Decimal(columns['price'][index]).scaleb(-2),
+            'image': self._text('image', index),
+            'average_rating': Decimal(columns['rating'][index]).scaleb(-2),
+            'created_date': _datetime(columns['created'][index]),
+            'category__slug': self._category_slugs.get(columns['category'][index], ''),
+            'recommendation_count': columns['recommendations'][index],
+        }
+
+    def product(self, index):
+        row = self.row(index)
+        return SnapshotProduct(
+            id=row['id'], slug=row['slug'], name=row['name'], price=row['price'],
+            discount=Decimal(self._columns['discount'][index]).scaleb(-2),
+            average_rating=row['average_rating'], image=row['image'],
+            category_id=self._columns['category'][index], category_slug=row['category__slug'],
+            created_date=row['created_date'], recommendation_count=row['recommendation_count'],
+            flags=self._columns['flags'][index],
+        )
+
+    def _sort_key(self, column):
+        """Key of a product index in an ascending order column"""
+        columns = self._columns
+        ids = columns['id']
+        if column == 'order_name':
+            return lambda index: (_name_key(self._text('name', index)), ids[index])
+        values = columns[{
+            'order_created': 'created', 'order_price': 'price', 'order_recommendations': 'recommendations',
+        }[column]]
+        return lambda index: (values[index], ids[index])
+
+    @staticmethod
+    def _cursor_key(column, values):
+        """The cursor's sort values (strings, as encode_cursor wrote them) as a sort key"""
+        value, last_id = values
+        if column == 'order_created':
+            value = _micros(datetime.fromisoformat(value))
+        elif column == 'order_price':
+            value = _hundredths(value)
+        elif column == 'order_name':
+            value = _name_key(value)
+        else:
+            value = int(value)
+        return value, int(last_id)
+
+    def page(self, sort_by='', cursor_values=None, limit=24, category_id=None):
+        """
+        Up to limit rows in the store's order for sort_by, after the row
+        the cursor values describe, optionally within one category.
+        """
+        column, descending = SNAPSHOT_ORDERS.get(sort_by, SNAPSHOT_ORDERS[''])
+        order = self._columns[column]
+        if cursor_values is None:
+            start = len(order) if descending else 0
+        else:
+            cursor_key = self._cursor_key(column, cursor_values)
+            search = bisect.bisect_left if descending else bisect.bisect_right
+            start = search(order, cursor_key, key=self._sort_key(column))
+        positions = range(start - 1, -1, -1) if descending else range(start, len(order))
+
+        categories = self._columns['category']
+        rows = []
+        for position in positions:
+            index = order[position]
+            if category_id is not None and categories[index] != category_id:
+                continue
+            rows.append(self.row(index))
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def products(self, sort_by=''):
+        """Every product in the store's order for sort_by"""
+        column, descending = SNAPSHOT_ORDERS.get(sort_by, SNAPSHOT_ORDERS[''])
+        order = self._columns[column]
+        positions = range(len(order) - 1, -1, -1) if descending else range(len(order))
+        return [self.product(order[position]) for position in positions]
+
+    def find(self, category_slug, slug):
+        """Id of the product at /<category_slug>/<slug>/, or None"""
+        slug_index = self._columns['slug_index']
+        wanted = slug.encode()
+        position = bisect.bisect_left(slug_index, wanted, key=lambda index: self._raw_text('slug', index))
+        if position == len(slug_index):
+            return None
+        index = slug_index[position]
+        if self._raw_text('slug', index) != wanted:
+            return None
+        if self.category_ids.get(category_slug) != self._columns['category'][index]:
+            return None
+        return self._columns['id'][index]
+
+
+def _text_column(values):
+    offsets = array('I', [0])
+    data = bytearray()
+    for value in values:
+        data += value.encode()
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+def _collect():
+    """Columns for every available product, in id order"""
+    from django.db.models import BooleanField, ExpressionWrapper
+    from ..models import Category, Product
+    from .admin_listing import IS_DIGITAL
+
+    rows = list(Product.objects.filter(is_available=True).annotate(
+        digital=ExpressionWrapper(IS_DIGITAL, output_field=BooleanField())
+    ).order_by('id').values_list(
+        'id', 'slug', 'name', 'price', 'discount', 'average_rating', 'featured',
+        'digital', 'category_id', 'created_date', 'image', 'recommendation_count',
+    ))
+    categories = list(Category.objects.order_by('id').values_list('id', 'slug'))
+
+    sections = {
+        'id': array('q', (row[0] for row in rows)),
+        'price': array('q', (_hundredths(row[3]) for row in rows)),
+        'discount': array('i', (_hundredths(row[4]) for row in rows)),
+        'rating': array('i', (_hundredths(row[5]) for row in rows)),
+        'flags': array('B', ((FLAG_FEATURED if row[6] else 0) | (FLAG_DIGITAL if row[7] else 0) for row in rows)),
+        'category': array('q', (row[8] for row in rows)),
+        'created': array('q', (_micros(row[9]) for row in rows)),
+        'recommendations': array('i', (row[11] for row in rows)),
+        'category_id': array('q', (category_id for category_id, _ in categories)),
+    }
+    for column, values in (
+        ('slug', [row[1] for row in rows]),
+        ('name', [row[2] for row in rows]),
+        ('image', [row[10] or '' for row in rows]),
+        ('category_slug', [slug for _, slug in categories]),
+    ):
+        sections[f'{column}_offsets'], sections[f'{column}_data'] = _text_column(values)
+
+    indexes = range(len(rows))
+    sections['order_created'] = array('i', sorted(indexes, key=lambda i: (sections['created'][i], rows[i][0])))
+    sections['order_price'] = array('i', sorted(indexes, key=lambda i: (sections['price'][i], rows[i][0])))
+    sections['order_name'] = array('i', sorted(indexes, key=lambda i: (_name_key(rows[i][2]), rows[i][0])))
+    sections['order_recommendations'] = array('i', sorted(indexes, key=lambda i: (rows[i][11], rows[i][0])))
+    sections['slug_index'] = array('i', sorted(indexes, key=lambda i: rows[i][1].encode()))
+    return len(rows), sections
+
+def _write(path, generation, count, sections):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            layout = []
+            offset = HEADER.size + SECTION.size * len(sections)
+            for name, values in sections.items():
+                data = values if isinstance(values, bytes) else values.tobytes()
+                typecode = b's' if isinstance(values, bytes) else values.typecode.encode()
+                offset += -offset % ALIGNMENT
+                layout.append((name, typecode, offset, data))
+                offset += len(data)
+
+            out.write(HEADER.pack(MAGIC, generation, count, len(layout)))
+            for name, typecode, offset, data in layout:
+                out.write(SECTION.pack(name.encode(), typecode, offset, len(data)))
+            for name, typecode, offset, data in layout:
+                out.write(b'\0' * (offset - out.tell()))
+                out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def build_snapshot(path=None):
+    """Write a fresh snapshot and swap it in; returns the number of products"""
+    path = path or snapshot_path()
+    count, sections = _collect()
+    _write(path, time.time_ns(), count, sections)
+    logger.info(f"Catalog snapshot rebuilt with {count} products at {path}")
+    return count
+
+def rebuild_snapshot():
+    """
+    Rebuild in one process at a time: whichever holds the cache lock
+    keeps rebuilding while requests are pending, and a request made while
+    another process holds it is left to that one. Needs a cache shared by
+    every process to hold across them. Returns the number of builds run
+    here.
+    """
+    if not snapshot_path():
+        return 0
+    cache.set(REBUILD_PENDING_KEY, True, timeout=None)
+    built = 0
+    lock_timeout = getattr(settings, 'CATALOG_SNAPSHOT_LOCK_TIMEOUT', 600)
+    while cache.add(REBUILD_LOCK_KEY, True, timeout=lock_timeout):
+        try:
+            # delete() reports the pending mark to one process only
+            while cache.delete(REBUILD_PENDING_KEY):
+                build_snapshot()
+                built += 1
+        finally:
+            cache.delete(REBUILD_LOCK_KEY)
+        # A request that found the lock taken after the last pass
+        if not cache.get(REBUILD_PENDING_KEY):
+            break
+    return built
+
+def schedule_rebuild():
+    """
+    rebuild_snapshot() off the request thread. Requests arriving while a
+    rebuild runs fold into one more rebuild after it (inline when
+    CATALOG_SNAPSHOT_ASYNC is off). Commands call rebuild_snapshot()
+    instead, so they do not exit before the snapshot is written.
+    """
+    if not snapshot_path():
+        return
+    if not getattr(settings, 'CATALOG_SNAPSHOT_ASYNC', True):
+        rebuild_snapshot()
+        return
+    with _rebuild_lock:
+        if _rebuild['running']:
+            _rebuild['dirty'] = True
+            return
+        _rebuild['running'] = True
+
+    def run():
+        try:
+            while True:
+                try:
+                    rebuild_snapshot()
+                except Exception as e:
+                    logger.error(f"Catalog snapshot rebuild failed: {e}")
+                with _rebuild_lock:
+                    if not _rebuild['dirty']:
+                        _rebuild['running'] = False
+                        return
+                    _rebuild['dirty'] = False
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=run, name='catalog-snapshot', daemon=True).start()
+
+def get_snapshot():
+    """
+    This process's mapping of the current snapshot, or None when it is
+    disabled, missing or unreadable. The file is re-stat'ed at most every
+    CATALOG_SNAPSHOT_CHECK_INTERVAL seconds and remapped when it changed.
+    """
+    path = snapshot_path()
+    if not path:
+        return None
+    now = time.monotonic()
+    interval = getattr(settings, 'CATALOG_SNAPSHOT_CHECK_INTERVAL', 1.0)
+    with _current_lock:
+        if _current['path'] == path and now - _current['checked_at'] < interval:
+            return _current['snapshot']
+        _current['checked_at'] = now
+        try:
+            stat = os.stat(path)
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            identity = None
+        if _current['path'] != path or _current['identity'] != identity:
+            snapshot = None
+            if identity is not None:
+                try:
+                    snapshot = CatalogSnapshot(path)
+                except (OSError, ValueError, struct.error) as e:
+                    logger.warning(f"Cannot map catalog snapshot {path}: {e}")
+            # The previous mapping closes once the last reader drops it
+            _current.update(path=path, identity=identity, snapshot=snapshot)
+        return _current['snapshot']
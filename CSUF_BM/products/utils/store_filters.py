@@ -0,0 +1,79 @@
+"""
+Compiles the store's filters and sort choice into one product query.
+
+Each filter maps to a predicate on the product row itself, using the
+recommendation summary columns from utils/recommendations.py, so nothing
+multiplies rows and pages need no DISTINCT. Two plan shapes result:
+
+- unfiltered: walk the sort's index (product_created_idx, product_price_idx,
+  the unique name index or product_recommended_idx) and stop after a page;
+- filtered: every filter implies recommendation_count > 0, so read that
+  range of product_recommended_idx, test each row and sort the matches.
+
+Planners will not pick the second shape on their own: they cannot tell
+how selective a LIKE on the summary is, and walking the sort index
+looks cheaper than sorting. For filtered queries the ORDER BY therefore
+sorts on COALESCE(column, column), which returns the column but matches
+no index. This works the same on SQLite, MySQL and PostgreSQL. Each one
+uses an index for ORDER BY only when it names the indexed columns or
+an expression index on that exact expression. Django has no index hints,
+so this is the portable way to steer the planner. The store filter
+tests check both the ORDER BY and the plans.
+"""
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from .pagination import store_ordering
+from .recommendations import department_token
+
+# Filter name -> predicate for a truthy value
+STORE_FILTERS = {
+    'department': lambda value: Q(recommendation_departments__contains=department_token(value)),
+    'faculty_search': lambda value: Q(recommender_names__icontains=value),
+    'essential_only': lambda value: Q(has_essential_recommendation=True),
+    'recommended_only': lambda value: Q(recommendation_count__gt=0),
+}
+
+
+def read_store_filters(params):
+    """The filters dict of a store request's query parameters"""
+    return {
+        'department': params.get('department', ''),
+        'faculty_search': params.get('faculty_search', '').strip(),
+        'essential_only': params.get('essential_only') == 'on',
+        'recommended_only': params.get('recommended_only') == 'on',
+    }
+
+def compile_store_filters(filters):
+    """One Q of the active filters; unknown names raise KeyError"""
+    condition = Q()
+    for name, value in filters.items():
+        if value:
+            condition &= STORE_FILTERS[name](value)
+    if condition:
+        # Every filter implies a recommendation. Stating it lets the planner
+        # start from the few recommended products on product_recommended_idx
+        # instead of walking the whole catalog in sort order.
+        condition &= STORE_FILTERS['recommended_only'](True)
+    return condition
+
+def _unindexed(field):
+    name = field.lstrip('-')
+    expression = Coalesce(F(name), F(name))
+    return expression.desc() if field.startswith('-') else expression.asc()
+
+def store_order_by(filters, sort_by):
+    """ORDER BY of a store page: the sort's columns, hidden from the planner when filtered"""
+    ordering = store_ordering(sort_by)
+    if not compile_store_filters(filters) or ordering[0].lstrip('-') == 'recommendation_count':
+        # product_recommended_idx serves both the filter range and this order
+        return ordering
+    return [_unindexed(field) for field in ordering]
+
+def store_queryset(filters, category_slug=None):
+    """Available products matching filters, unordered; see store_order_by() for the sort"""
+    from ..models import Product
+
+    queryset = Product.objects.filter(is_available=True)
+    if category_slug:
+        queryset = queryset.filter(category__slug=category_slug)
+    return queryset.filter(compile_store_filters(filters))
@@ -0,0 +1,465 @@
+"""
+Deterministic synthetic data at production scale, for benchmarks.
+
+Every id is assigned up front from the table's current maximum and rows
+go in as plain executemany() INSERTs of tuples: no model instances, no
+save() or signals, nothing read back. What the per-row receivers would
+have maintained (rating counters, search documents, caches, the catalog
+snapshot) is brought up to date once at the end. The same seed on the
+same starting ids yields the same rows.
+"""
+from array import array
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+from itertools import accumulate
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_NAMES = [
+    'Textbooks', 'Lab Supplies', 'Apparel', 'Electronics', 'Software', 'Art Supplies',
+    'Stationery', 'Athletics', 'Music', 'Engineering', 'Study Guides', 'Dorm Essentials',
+]
+ADJECTIVES = ['Compact', 'Deluxe', 'Essential', 'Classic', 'Advanced', 'Recycled', 'Pocket', 'Premium', 'Basic', 'Pro']
+NOUNS = ['Notebook', 'Calculator', 'Hoodie', 'Backpack', 'Lab Coat', 'Sketchbook', 'Headphones', 'Planner', 'License', 'Kit']
+BRANDS = ['Titan', 'Elephant Press', 'Campus Co', 'Orange Grove', 'Fullerton Works', '']
+FIRST_NAMES = ['Alex', 'Sam', 'Jordan', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Avery', 'Jamie', 'Quinn']
+LAST_NAMES = ['Nguyen', 'Garcia', 'Smith', 'Kim', 'Patel', 'Lopez', 'Chen', 'Johnson', 'Martinez', 'Brown']
+DEPARTMENTS = ['Computer Science', 'Biology', 'Mathematics', 'Art', 'Music', 'Business', 'Engineering', 'History']
+POSITIONS = ['Lecturer', 'Assistant Professor', 'Associate Professor', 'Professor']
+REVIEW_WEIGHTS = [5, 5, 15, 35, 40]  # one to five stars
+ORDER_STATUSES = (['DELIVERED'] * 8) + ['SHIPPED', 'PROCESSING']
+
+
+class TableWriter:
+    """
+    executemany() INSERTs for one model's own table. Rows are dicts keyed
+    by attname; missing columns take the field default, and datetimes and
+    decimals go through the backend's adapters like the ORM's would.
+    adapted is a cache shared between writers: timestamps repeat across an
+    order and its lines, prices across the catalog.
+    """
+
+    def __init__(self, model, adapted):
+        fields = model._meta.local_concrete_fields
+        self.columns = [(field.attname, field.get_default(), self._adapter(field, adapted)) for field in fields]
+        quote = connection.ops.quote_name
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(model._meta.db_table),
+            ', '.join(quote(field.column) for field in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+
+    @staticmethod
+    def _adapter(field, adapted):
+        ops = connection.ops
+        if isinstance(field, models.DateTimeField):
+            kind, convert = 'datetime', ops.adapt_datetimefield_value
+        elif isinstance(field, models.DecimalField):
+            kind = (field.max_digits, field.decimal_places)
+
+            def convert(value):
+                return ops.adapt_decimalfield_value(field.to_python(value), field.max_digits, field.decimal_places)
+        elif isinstance(field, models.JSONField):
+            return lambda value: field.get_db_prep_save(value, connection)
+        else:
+            return None
+
+        def adapt(value):
+            key = (kind, value)
+            if key not in adapted:
+                if len(adapted) > 100000:
+                    adapted.clear()
+                adapted[key] = convert(value)
+            return adapted[key]
+        return adapt
+
+    def write(self, rows):
+        if not rows:
+            return
+        values = [
+            tuple(
+                adapt(row.get(column, default)) if adapt else row.get(column, default)
+                for column, default, adapt in self.columns
+            )
+            for row in rows
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(self.sql, values)
+
+
+def _next_id(model):
+    return (model._base_manager.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+class SyntheticDataGenerator:
+    """
+    Writes categories, products, accounts with faculty/student profiles,
+    recommendations, reviews, carts and order history. Order lines,
+    reviews and carts favour popular products (Zipf-distributed); rows
+    are written chunk_size at a time, one transaction per chunk.
+    """
+
+    def __init__(self, seed=0, chunk_size=5000, days=365, skew=1.1, password='synthetic-password', progress=None):
+        self.rng = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.skew = skew
+        self.password = make_password(password)  # hashed once, shared by every account
+        self.progress = progress or (lambda label, count: None)
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=days)
+        self.span = self.now - self.start
+        self.category_ids = []
+        self.product_ids = array('q')
+        self.product_cents = {}
+        self.new_catalog = False
+        self.faculty_ids = []
+        self.student_ids = []
+        self._writers = {}
+        self._adapted = {}
+        self._ranking = None
+
+    def _write(self, model, rows):
+        writer = self._writers.get(model)
+        if writer is None:
+            writer = self._writers[model] = TableWriter(model, self._adapted)
+        writer.write(rows)
+
+    def _moment(self, position=None):
+        """A timestamp in the generated history; position in [0, 1] runs oldest to newest"""
+        return self.start + self.span * (self.rng.random() if position is None else position)
+
+    def _chunks(self, model, count, build, label=None):
+        """
+        Write build(id, index) for count consecutive new ids of model. build
+        returns the row, optionally followed by (model, row) pairs written in
+        the same transaction. Returns the ids.
+        """
+        first = _next_id(model)
+        for start in range(first, first + count, self.chunk_size):
+            rows, related = [], defaultdict(list)
+            for row_id in range(start, min(start + self.chunk_size, first + count)):
+                row, *extra = build(row_id, row_id - first)
+                rows.append(row)
+                for related_model, related_row in extra:
+                    related[related_model].append(related_row)
+            with transaction.atomic():
+                self._write(model, rows)
+                for related_model, related_rows in related.items():
+                    self._write(related_model, related_rows)
+            self.progress(label or model._meta.verbose_name_plural, start + len(rows) - first)
+        return range(first, first + count)
+
+    def _popular(self, count):
+        """
+        count catalog ids drawn with Zipf popularity. The ranking is a seeded
+        shuffle made once, so every kind of row favours the same products.
+        """
+        if self._ranking is None:
+            ranking = list(self._catalog())
+            self.rng.shuffle(ranking)
+            self._ranking = ranking, list(accumulate(1 / rank ** self.skew for rank in range(1, len(ranking) + 1)))
+        ranking, cum_weights = self._ranking
+        return self.rng.choices(ranking, cum_weights=cum_weights, k=count)
+
+    def _basket_size(self, mean):
+        # Geometric: mostly small baskets with a long tail
+        return 1 + int(self.rng.expovariate(1 / max(mean - 1, 0.01)))
+
+    def categories(self, count):
+        from ..models import Category
+
+        def build(category_id, index):
+            name = f'{CATEGORY_NAMES[category_id % len(CATEGORY_NAMES)]} {category_id}'
+            return ({'id': category_id, 'name': name, 'slug': slugify(name), 'description': f'Synthetic {name.lower()}'},)
+        self.category_ids = list(self._chunks(Category, count, build))
+
+    def products(self, count, digital_ratio=0.2):
+        from ..models import Category, DigitalProduct, Product, version_sort_key
+
+        if not self.category_ids:
+            self.category_ids = list(Category.objects.values_list('id', flat=True))
+
+        def build(product_id, index):
+            is_digital = self.rng.random() < digital_ratio
+            name = f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {product_id}'
+            cents = self.rng.randrange(99, 30000)
+            stock = -1 if is_digital else self.rng.randrange(0, 500)
+            created = self._moment()
+            self.product_ids.append(product_id)
+            self.product_cents[product_id] = cents
+            row = {
+                'id': product_id, 'name': name, 'slug': slugify(name), 'description': f'Synthetic {name.lower()}',
+                'price': Decimal(cents).scaleb(-2), 'image': 'photos/products/synthetic.jpg', 'stock': stock,
+                'is_available': stock != 0, 'category_id': self.rng.choice(self.category_ids),
+                'created_date': created, 'modified_date': created, 'brand': self.rng.choice(BRANDS),
+                'discount': self.rng.choice([0, 0, 0, 5, 10, 20]), 'featured': self.rng.random() < 0.01,
+                'product_type': 'digital' if is_digital else 'physical',
+            }
+            if not is_digital:
+                return (row,)
+            version = f'{self.rng.randrange(1, 10)}.{self.rng.randrange(0, 20)}.{self.rng.randrange(0, 50)}'
+            return row, (DigitalProduct, {
+                'product_ptr_id': product_id, 'version': version, 'version_sort_key': version_sort_key(version),
+                'download_link': f'https://downloads.example.com/{slugify(name)}',
+                'file_size': f'{self.rng.randrange(1, 900)} MB',
+            })
+        self._chunks(Product, count, build)
+        self.new_catalog = True
+
+    def accounts(self, faculty, students):
+        from accounts.models import Account, Faculty, Student
+
+        def account(account_id, is_faculty):
+            joined = self._moment()
+            return {
+                'id': account_id, 'first_name': self.rng.choice(FIRST_NAMES), 'last_name': self.rng.choice(LAST_NAMES),
+                'username': f'synthetic{account_id}', 'email': f'synthetic{account_id}@example.edu',
+                'password': self.password, 'is_faculty': is_faculty, 'is_student': not is_faculty,
+                'registration_complete': True, 'date_joined': joined, 'last_login': joined,
+            }
+
+        def build_faculty(account_id, index):
+            return account(account_id, True), (Faculty, {
+                'user_id': account_id, 'faculty_id': f'F{account_id:09d}', 'department': self.rng.choice(DEPARTMENTS),
+                'position': self.rng.choice(POSITIONS),
+            })
+
+        def build_student(account_id, index):
+            return account(account_id, False), (Student, {
+                'user_id': account_id, 'student_id': f'S{account_id:09d}', 'major': self.rng.choice(DEPARTMENTS),
+                'year': self.rng.randrange(1, 5),
+            })
+
+        self.faculty_ids = list(self._chunks(Account, faculty, build_faculty, 'faculty'))
+        self.student_ids = list(self._chunks(Account, students, build_student, 'students'))
+
+    def _catalog(self):
+        """This run's products, or the existing catalog when none were generated"""
+        if not self.product_ids:
+            from ..models import Product
+            rows = Product.objects.values_list('id', 'price').order_by('id')
+            for product_id, price in rows.iterator(chunk_size=self.chunk_size):
+                self.product_ids.append(product_id)
+                self.product_cents[product_id] = int(price * 100)
+        return self.product_ids
+
+    def _users(self):
+        if not (self.faculty_ids or self.student_ids):
+            from accounts.models import Account
+            self.faculty_ids = list(Account.objects.filter(is_faculty=True).values_list('id', flat=True))
+            self.student_ids = list(Account.objects.filter(is_faculty=False).values_list('id', flat=True))
+        return self.faculty_ids + self.student_ids
+
+    def _pairs(self, count, people, existing):
+        """
+        Up to count distinct (popular product, person) pairs. Pairs already
+        in existing (a values_list queryset) are avoided; they can only occur
+        on a catalog this run did not create.
+        """
+        taken = set() if self.new_catalog else set(existing)
+        products = self._popular(count * 2)
+        pairs = dict.fromkeys(
+            pair for pair in zip(products, self.rng.choices(people, k=len(products))) if pair not in taken
+        )
+        return list(pairs)[:count]
+
+    def recommendations(self, count):
+        """Recommendations, then the summaries of the products they landed on"""
+        from ..models import ProductRecommendation
+        from .recommendations import refresh_recommendation_summaries
+
+        self._users()
+        if not (self._catalog() and self.faculty_ids):
+            return
+        existing = ProductRecommendation.objects.values_list('product_id', 'faculty_id')
+        pairs = self._pairs(count, self.faculty_ids, existing)
+
+        def build(recommendation_id, index):
+            product_id, faculty_id = pairs[index]
+            created = self._moment()
+            return ({
+                'id': recommendation_id, 'product_id': product_id, 'faculty_id': faculty_id,
+                'recommendation_text': 'Recommended for my students.', 'is_essential': self.rng.random() < 0.2,
+                'created_at': created, 'updated_at': created,
+            },)
+        self._chunks(ProductRecommendation, len(pairs), build)
+        refresh_recommendation_summaries(sorted({product_id for product_id, _ in pairs}))
+
+    def reviews(self, count):
+        """
+        Reviews plus their products' rating counters. Counters of a catalog
+        generated in this run are written directly, one UPDATE per distinct
+        histogram; an existing catalog is left to reconcile_ratings.
+        """
+        from ..models import Product, ProductReview
+
+        users = self._users()
+        if not (self._catalog() and users):
+            return
+        pairs = self._pairs(count, users, ProductReview.objects.values_list('product_id', 'user_id'))
+        ratings = self.rng.choices(range(1, 6), weights=REVIEW_WEIGHTS, k=len(pairs))
+
+        def build(review_id, index):
+            product_id, user_id = pairs[index]
+            return ({
+                'id': review_id, 'product_id': product_id, 'user_id': user_id, 'rating': ratings[index],
+                'review': f'{ratings[index]} stars.', 'created_at': self._moment(),
+            },)
+        self._chunks(ProductReview, len(pairs), build)
+
+        if not self.new_catalog:
+            return
+        histograms = defaultdict(lambda: [0] * 5)
+        for (product_id, _), rating in zip(pairs, ratings):
+            histograms[product_id][rating - 1] += 1
+        by_histogram = defaultdict(list)
+        for product_id, histogram in histograms.items():
+            by_histogram[tuple(histogram)].append(product_id)
+        with transaction.atomic():
+            for histogram, product_ids in by_histogram.items():
+                rating_sum = sum(stars * n for stars, n in enumerate(histogram, 1))
+                rating_count = sum(histogram)
+                for start in range(0, len(product_ids), 1000):
+                    Product.objects.filter(id__in=product_ids[start:start + 1000]).update(
+                        rating_sum=rating_sum, rating_count=rating_count,
+                        average_rating=round(rating_sum / rating_count, 2),
+                        **{f'rating_{stars}_count': n for stars, n in enumerate(histogram, 1)}
+                    )
+
+    def carts(self, count, mean_items=3):
+        from cart.models import Cart, CartItem
+
+        users = self._users()
+        catalog = self._catalog()
+        if not catalog:
+            return
+        picks = iter(self._popular(int(count * mean_items * 2) + 10))
+        next_item = _next_id(CartItem)
+
+        def build(cart_id, index):
+            nonlocal next_item
+            # Carts are recent: the last 5% of the history
+            created = self._moment(1 - self.rng.random() * 0.05)
+            user_id = self.rng.choice(users) if users and self.rng.random() < 0.7 else None
+            items = []
+            for product_id in dict.fromkeys(next(picks, catalog[0]) for _ in range(self._basket_size(mean_items))):
+                items.append((CartItem, {
+                    'id': next_item, 'cart_id': cart_id, 'product_id': product_id,
+                    'quantity': self.rng.randrange(1, 4), 'created_at': created, 'updated_at': created,
+                }))
+                next_item += 1
+            return ({
+                'id': cart_id, 'user_id': user_id, 'session_key': None if user_id else f'synthetic{cart_id}',
+                'created_at': created, 'updated_at': created,
+            }, *items)
+        self._chunks(Cart, count, build)
+
+    def orders(self, lines, mean_basket=3):
+        """Paid orders adding up to about lines order lines, oldest first"""
+        from checkout.models import Order, OrderProduct
+
+        users = self._users()
+        catalog = self._catalog()
+        if not catalog:
+            return
+        order_id, line_id = _next_id(Order), _next_id(OrderProduct)
+        written = 0
+        while written < lines:
+            picks = iter(self._popular(self.chunk_size * 2))
+            orders, order_lines = [], []
+            while written < lines and len(order_lines) < self.chunk_size:
+                created = self._moment(written / lines)
+                size = min(self._basket_size(mean_basket), lines - written)
+                subtotal = 0
+                for product_id in dict.fromkeys(next(picks, catalog[0]) for _ in range(size)):
+                    quantity = self.rng.randrange(1, 4)
+                    cents = self.product_cents[product_id]
+                    subtotal += cents * quantity
+                    order_lines.append({
+                        'id': line_id, 'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                        'product_price': Decimal(cents).scaleb(-2), 'ordered': True,
+                        'created_at': created, 'updated_at': created,
+                    })
+                    line_id += 1
+                    written += 1
+                user_id = self.rng.choice(users) if users else None
+                total = Decimal(subtotal).scaleb(-2)
+                orders.append({
+                    'id': order_id, 'user_id': user_id, 'order_number': f'SYN{order_id:012d}',
+                    'first_name': self.rng.choice(FIRST_NAMES), 'last_name': self.rng.choice(LAST_NAMES),
+                    'email': f'synthetic{user_id or order_id}@example.edu', 'phone': '5555550100',
+                    'address_line_1': f'{self.rng.randrange(1, 9999)} College Ave', 'city': 'Fullerton',
+                    'state': 'CA', 'country': 'US', 'zipcode': '92831', 'order_total': total,
+                    'tax': (total / 10).quantize(Decimal('0.01')), 'status': self.rng.choice(ORDER_STATUSES),
+                    'ip': '127.0.0.1', 'is_ordered': True, 'created_at': created, 'updated_at': created,
+                    'payment_status': 'PAID', 'transaction_id': f'SYN-{order_id}',
+                    'payment_method': 'VISA **** **** **** 4242', 'last_four': '4242',
+                })
+                order_id += 1
+            with transaction.atomic():
+                self._write(Order, orders)
+                self._write(OrderProduct, order_lines)
+            self.progress('order lines', written)
+
+
+def generate(categories=20, products=10000, digital_ratio=0.2, faculty=100, students=2000, recommendations=2000,
+             reviews=20000, carts=1000, order_lines=100000, mean_basket=3, seed=0, chunk_size=5000, rebuild=True,
+             progress=None):
+    """
+    Write one synthetic data set. Kinds with a zero count are skipped and
+    later kinds draw from what is already in the database, so e.g.
+    products=0 adds order history to the existing catalog.
+    """
+    from accounts.models import Account
+    from cart.models import Cart, CartItem
+    from checkout.models import Order, OrderProduct
+    from ..models import Category, Product, ProductRecommendation, ProductReview
+
+    generator = SyntheticDataGenerator(seed=seed, chunk_size=chunk_size, progress=progress)
+    if categories:
+        generator.categories(categories)
+    if products:
+        generator.products(products, digital_ratio)
+    if faculty or students:
+        generator.accounts(faculty, students)
+    if recommendations:
+        generator.recommendations(recommendations)
+    if reviews:
+        generator.reviews(reviews)
+    if carts:
+        generator.carts(carts)
+    if order_lines:
+        generator.orders(order_lines, mean_basket)
+
+    # Explicit ids leave sequences (PostgreSQL) behind; MySQL and SQLite catch up on their own
+    sequenced = [Category, Product, Account, ProductRecommendation, ProductReview, Cart, CartItem, Order, OrderProduct]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), sequenced):
+            cursor.execute(sql)
+
+    if rebuild:
+        rebuild_derived(reconcile=bool(reviews) and not generator.new_catalog)
+    logger.info(f"Generated synthetic data with seed {seed}")
+
+def rebuild_derived(reconcile=True):
+    """Everything the per-row receivers would have maintained during the load"""
+    from .cache import CacheTags, queue_invalidation
+    from .ratings import reconcile_ratings
+    from .search import rebuild_index
+    from .snapshot import rebuild_snapshot
+
+    if reconcile:
+        reconcile_ratings()
+    rebuild_index()
+    queue_invalidation([], [CacheTags.CATALOG, CacheTags.CATEGORY], bump_global=True)
+    # Inline: a thread would die with the command before writing the file
+    rebuild_snapshot()
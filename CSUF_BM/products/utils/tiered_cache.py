@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from .cache import CacheKeyBuilder, get_or_set_cache
+from .metrics import registry
+import secrets
+import threading
+import time
+
+TIERS = ('l1', 'l2')
+
+
+class LocalLRUCache:
+    """Bounded in-process LRU with a per-entry TTL"""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """(value, stamp) for a live entry, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, stamp, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value, stamp
+
+    def set(self, key, value, stamp=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def seeded_tag_versions(tags):
+    """
+    Like get_tag_versions, but missing counters are created with a random
+    value. After a cache flush a default of 1 could match versions an L1
+    entry was built from; a fresh random seed never does.
+    """
+    version_keys = {CacheKeyBuilder.tag_version_key(tag): tag for tag in tags}
+    found = cache.get_many(list(version_keys))
+    missing = [key for key in version_keys if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, secrets.randbits(48), timeout=None)
+        found.update(cache.get_many(missing))
+    return {tag: found.get(key, 1) for key, tag in version_keys.items()}
+
+
+class TieredCache:
+    """
+    A per-process LRU (L1) in front of the shared Django cache (L2) for
+    small, read-mostly datasets.
+
+    Entries are registered under cache tags like get_or_set_tagged. Each
+    L1 entry remembers the tag versions it was built from, and a read only
+    serves it while those versions are still current, so a bump from any
+    worker reaches every process. To keep L1 hits free of round trips, the
+    versions themselves are re-read at most every check_interval seconds
+    per process, which bounds how stale an L1 read can be.
+    """
+
+    def __init__(self, name, maxsize=256, ttl=300, check_interval=None):
+        self.name = name
+        self.local = LocalLRUCache(maxsize, ttl)
+        self.check_interval = check_interval
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.stats = {f'{tier}_{result}': 0 for tier in TIERS for result in ('hits', 'misses')}
+
+    def _check_interval(self):
+        if self.check_interval is not None:
+            return self.check_interval
+        return getattr(settings, 'REFERENCE_CACHE_CHECK_INTERVAL', 1.0)
+
+    def _current_versions(self, tags):
+        """Tag versions, re-read from the shared cache once per check interval"""
+        now = time.monotonic()
+        checked = self._versions.get(tags)
+        if checked is not None and now - checked[0] < self._check_interval():
+            return checked[1]
+        versions = CacheKeyBuilder.stable_hash(seeded_tag_versions(tags))
+        with self._lock:
+            self._versions[tags] = (now, versions)
+        return versions
+
+    def _record(self, tier, hit):
+        with self._lock:
+            self.stats[f"{tier}_{'hits' if hit else 'misses'}"] += 1
+        registry.inc('reference_cache_requests_total', {
+            'cache': self.name, 'tier': tier, 'result': 'hit' if hit else 'miss'
+        })
+
+    def get_or_set(self, key, func, tags, timeout=3600, **policy):
+        """Value of key from L1, then L2, then func()"""
+        tags = tuple(sorted(set(tags)))
+        versions = self._current_versions(tags)
+        entry = self.local.get(key)
+        if entry is not None and entry[1] == versions:
+            self._record('l1', True)
+            return entry[0]
+        self._record('l1', False)
+
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return func()
+
+        value = get_or_set_cache(f'{key}:t{versions}', compute, timeout=timeout, **policy)
+        self._record('l2', not computed)
+        if value is not None:
+            self.local.set(key, value, versions)
+        return value
+
+    def clear(self):
+        """Drop this process's L1 entries and remembered versions"""
+        self.local.clear()
+        with self._lock:
+            self._versions.clear()
@@ -3,21 +3,34 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from .models import Product, Category, DigitalProduct, ProductReview, ProductRecommendation
 from django.contrib import messages #added 10/22
 from .forms import ProductSortForm, CategoryForm, ProductForm, DigitalProductForm, ProductReviewForm # Added 10/22 CategoryForm and ProductForm, 10/26 digital product
-from django.db.models import Q, Count
+from django.db.models import Q
 from accounts.models.faculty import Faculty
-from django.http import JsonResponse
+from accounts.cache.ratelimit import check_rate_limit
+from django.http import HttpResponse, JsonResponse
 from django.template.loader import render_to_string
 from django.http import Http404
 # Create your views here.
 from django.core.cache import cache
 import logging
+import re
 from django.views.decorators.http import require_http_methods, require_POST
 from functools import wraps
 from django.db import transaction
 from datetime import datetime
-from .utils.cache import CacheKeyBuilder, get_or_set_cache
+from .utils import db_routing
+from .utils.copurchase import bought_together
+from .utils.cache import CacheKeyBuilder, CacheTags, get_or_set_cache, get_or_set_tagged
+from .utils.admin_listing import admin_product_page, product_statistics
+from .utils.images import image_sources
+from .utils.pagination import fetch_snapshot_page, fetch_store_page, store_cards_for_ids
+from .utils.reference import get_categories, get_category, get_departments, get_faculty_directory
+from .utils.metrics import registry
+from .utils.search import search_documents, search_product_ids
+from .utils.snapshot import get_snapshot
+from .utils.store_filters import read_store_filters, store_order_by, store_queryset
 from django.conf import settings
 from django.views.decorators.csrf import ensure_csrf_cookie
+from django.utils.crypto import constant_time_compare
 
 logger = logging.getLogger(__name__)
 
@@ -31,28 +44,15 @@ def rate_limit(key_prefix, limit, period=60):
         @wraps(view_func)
         def wrapped(request, *args, **kwargs):
             user_id = request.user.faculty.user_id
-            cache_key = f"rate_limit_{key_prefix}_{user_id}"
-            
-            try:
-                # Get current count
-                count = cache.get(cache_key, 0)
-                
-                # Check limit
-                if count >= limit:
-                    logger.warning(f'Rate limit exceeded for {key_prefix} by faculty {user_id}')
-                    return JsonResponse({
-                        'error': f'Too many attempts. Please wait {period} seconds.'
-                    }, status=429)
-                
-                # Increment count
-                cache.set(cache_key, count + 1, period)
-                
-                return view_func(request, *args, **kwargs)
-                
-            except Exception as e:
-                logger.error(f'Rate limiting error: {str(e)}')
-                return view_func(request, *args, **kwargs)
-                
+            result = check_rate_limit(key_prefix, user_id, limit, period)
+            if not result:
+                logger.warning(f'Rate limit exceeded for {key_prefix} by faculty {user_id}')
+                response = JsonResponse({
+                    'error': f'Too many attempts. Please wait {result.retry_after} seconds.'
+                }, status=429)
+                response['Retry-After'] = str(result.retry_after)
+                return response
+            return view_func(request, *args, **kwargs)
         return wrapped
     return decorator
 
@@ -62,20 +62,17 @@ def rate_limit_faculty_delete(view_func):
     @wraps(view_func)
     def wrapped(request, *args, **kwargs):
         faculty_id = request.user.faculty.user_id  # or request.user.faculty.pk
-        cache_key = f'faculty_delete_{faculty_id}'
-        
+
         # Allow 10 deletions per minute
-        if cache.get(cache_key, 0) >= 10:
+        result = check_rate_limit('faculty_delete', faculty_id, 10, 60)
+        if not result:
             logger.warning(f'Delete rate limit exceeded for faculty {faculty_id}')
-            return JsonResponse({
+            response = JsonResponse({
                 'error': 'Too many deletion attempts. Please wait a minute.'
             }, status=429)
-            
-        cache.incr(cache_key, 1)
-        # Set expiry to 60 seconds if not set
-        if not cache.ttl(cache_key):
-            cache.expire(cache_key, 60)
-        
+            response['Retry-After'] = str(result.retry_after)
+            return response
+
         return view_func(request, *args, **kwargs)
     return wrapped
 
@@ -105,29 +102,10 @@ def remove_recommendation(request, product_id):
                     'message': 'Recommendation not found'
                 }, status=404)
             
-            # Store cache info before deletion
-            cache_keys = [
-                f"recommendations_product_{product_id}",
-                f"recommendations_faculty_{request.user.faculty.user_id}",
-                "store_page_*",
-                f"product_{product_id}_*"
-            ]
-            
-            if request.user.faculty.department:
-                cache_keys.append(
-                    f"recommendations_department_{request.user.faculty.department.replace(' ', '_')}"
-                )
-            
-            # Delete recommendation
+            # Delete recommendation; products.signals invalidates the
+            # product, faculty, department and store caches on commit
             recommendation.delete()
             
-            # Clear caches
-            for key in cache_keys:
-                try:
-                    cache.delete(key)
-                except Exception as e:
-                    logger.warning(f"Error deleting cache key {key}: {str(e)}")
-            
             logger.info(
                 f'Recommendation removed successfully - Product: {product_id}, '
                 f'Faculty: {request.user.faculty.user_id}'
@@ -226,27 +204,8 @@ def toggle_recommendation(request, product_id):
                 }
             )
             
-            # Clear ALL related caches
-            cache_keys = [
-                CacheKeyBuilder.product_recommendations_key(product_id),
-                CacheKeyBuilder.faculty_recommendations_key(faculty.user_id),
-                "store_page_*",  # Clear all store view caches
-                f"product_{product_id}_*",  # Clear product detail caches
-            ]
-            
-            if faculty.department:
-                cache_keys.append(
-                    CacheKeyBuilder.department_recommendations_key(faculty.department)
-                )
-            
-            # Log cache operations
-            logger.debug(f"Clearing cache keys: {cache_keys}")
-            
-            for key in cache_keys:
-                try:
-                    cache.delete(key)
-                except Exception as e:
-                    logger.warning(f"Error deleting cache key {key}: {str(e)}")
+            # Related caches are invalidated by tag in products.signals
+            # once this transaction commits
             
             # Log successful operation
             logger.info(
@@ -287,28 +246,22 @@ def warmup_store_cache():
     """Warm up cache for frequently accessed store data"""
     try:
         # Warm up categories with products
-        categories = Category.objects.all().order_by('name')
-        cache.set('all_categories', categories, timeout=3600)  # 1 hour
+        get_categories()
 
         # Warm up featured and popular products
-        products = Product.objects.select_related('category').prefetch_related(
-            'recommendations', 
-            'recommendations__faculty', 
-            'recommendations__faculty__user'
-        ).filter(is_available=True)
+        # Recommendation badges come from the product's own summary columns
+        products = Product.objects.select_related('category').filter(is_available=True)
         
         # Cache featured products
         featured_products = products.filter(featured=True)
         cache.set('featured_products', featured_products, timeout=3600)
 
         # Cache popular products (those with most recommendations)
-        popular_products = products.annotate(
-            rec_count=Count('recommendations')
-        ).filter(rec_count__gt=0).order_by('-rec_count')[:20]
+        popular_products = products.filter(recommendation_count__gt=0).order_by('-recommendation_count', '-id')[:20]
         cache.set('popular_products', popular_products, timeout=3600)
 
         # Warm up department recommendations
-        departments = Faculty.objects.values_list('department', flat=True).distinct()
+        departments = get_departments()
         for dept in departments:
             recommendations = ProductRecommendation.objects.select_related(
                 'faculty', 
@@ -331,93 +284,74 @@ def warmup_store_cache():
 def store(request, category_slug=None):    
     try:
         # Get filter parameters
-        filters = {
-            'department': request.GET.get('department', ''),
-            'faculty_search': request.GET.get('faculty_search', ''),
-            'essential_only': request.GET.get('essential_only') == 'on',
-            'recommended_only': request.GET.get('recommended_only') == 'on',
-        }
+        filters = read_store_filters(request.GET)
         
         # Handle sorting separately
         sort_form = ProductSortForm(request.GET)
-        sort_by = request.GET.get('sort_by', '')
+        sort_by = sort_form.cleaned_data['sort_by'] if sort_form.is_valid() else ''
+        cursor = request.GET.get('cursor', '')
+        page_size = getattr(settings, 'STORE_PAGE_SIZE', 24)
 
         # Create cache key based on all parameters
         cache_params = {
             **filters,
             'sort_by': sort_by,
-            'category_slug': category_slug
+            'category_slug': category_slug,
+            'cursor': cursor,
+            'page_size': page_size,
         }
-        cache_key = f"store_view:{hash(frozenset(cache_params.items()))}"
-
-        def get_cached_data():
-            """Get or compute filtered products"""
-            # Base queryset with related fields
-            queryset = Product.objects.select_related('category').prefetch_related(
-                'recommendations', 
-                'recommendations__faculty', 
-                'recommendations__faculty__user'
-            ).filter(is_available=True)
-
-            # Apply category filter
-            if category_slug:
-                queryset = queryset.filter(category__slug=category_slug)
-
-            # Apply faculty filters
-            if filters['essential_only']:
-                queryset = queryset.filter(recommendations__is_essential=True)
-            
-            if filters['recommended_only']:
-                queryset = queryset.filter(recommendations__isnull=False)
-            
-            if filters['department']:
-                queryset = queryset.filter(
-                    recommendations__faculty__department=filters['department']
-                )
-            
-            if filters['faculty_search']:
-                queryset = queryset.filter(
-                    Q(recommendations__faculty__user__first_name__icontains=filters['faculty_search']) |
-                    Q(recommendations__faculty__user__last_name__icontains=filters['faculty_search'])
-                )
-
-            # Apply sorting
-            if sort_form.is_valid() and sort_by:
-                if sort_by == 'recommendations':
-                    queryset = queryset.annotate(
-                        recommendation_count=Count('recommendations')
-                    ).order_by('-recommendation_count')
-                else:
-                    queryset = queryset.order_by(sort_by)
-
-            return queryset.distinct()
-
-        # Get cached data or compute it
-        products = get_or_set_cache(cache_key, get_cached_data, timeout=900)
-        departments = get_or_set_cache(
-            'all_departments',
-            lambda: list(Faculty.objects.values_list('department', flat=True).distinct()),
-            timeout=3600
-        )
-        categories = get_or_set_cache(
-            'all_categories',
-            lambda: list(Category.objects.all().order_by('name')),
-            timeout=3600
-        )
+        # Unfiltered listings come from the catalog snapshot when one is mapped;
+        # its generation keys the page so a rebuilt snapshot is never hidden
+        snapshot = None if any(filters.values()) else get_snapshot()
+        snapshot_category = None
+        if snapshot is not None and category_slug:
+            snapshot_category = snapshot.category_ids.get(category_slug)
+            if snapshot_category is None:
+                snapshot = None
+        cache_params['snapshot'] = snapshot.generation if snapshot is not None else None
+        cache_key = CacheKeyBuilder.store_page_key(category_slug, cache_params)
+        cache_tags = [CacheTags.category(category_slug) if category_slug else CacheTags.CATALOG]
+        if filters['department']:
+            cache_tags.append(CacheTags.department(filters['department']))
+
+        def get_page_data():
+            """Evaluate one page of filtered products"""
+            if snapshot is not None:
+                return fetch_snapshot_page(snapshot, sort_by, cursor, page_size, snapshot_category)
+
+            return fetch_store_page(
+                store_queryset(filters, category_slug), sort_by, cursor, page_size,
+                order_by=store_order_by(filters, sort_by),
+            )
+
+        # Only evaluated, page-sized rows go into the cache
+        page = get_or_set_tagged(cache_key, get_page_data, cache_tags, timeout=900)
+        departments = get_departments()
+        categories = get_categories()
 
         # Get current category
         current_category = None
         if category_slug:
-            current_category = get_or_set_cache(
-                f'category_{category_slug}',
-                lambda: Category.objects.get(slug=category_slug),
-                timeout=3600
-            )
+            current_category = get_category(category_slug)
+
+        next_page_query = None
+        if page['next_cursor']:
+            query = request.GET.copy()
+            query['cursor'] = page['next_cursor']
+            next_page_query = query.urlencode()
+        first_page_query = None
+        if cursor:
+            query = request.GET.copy()
+            query.pop('cursor')
+            first_page_query = query.urlencode()
 
         context = {
-            'products': products,
+            'products': page['products'],
+            'next_page_query': next_page_query,
+            'first_page_query': first_page_query,
             'categories': categories,
             'departments': departments,
+            'faculty_directory': get_faculty_directory(),
             'sort_form': sort_form,
             'selected_department': filters['department'],
             'faculty_search': filters['faculty_search'],
@@ -443,10 +377,50 @@ def store(request, category_slug=None):
         messages.error(request, f'Category "{category_slug}" not found.')
         return redirect('store')
     except Exception as e:
+        if db_routing.failed_on_replica(e):
+            raise  # ReplicaRoutingMiddleware runs the view again on the primary
         logger.error(f'Error in store view: {str(e)}')
         messages.error(request, 'An error occurred while loading the store.')
         return redirect('home')
 
+def search(request):
+    """Public storefront search backed by the product search index"""
+    search_query = request.GET.get('q', '').strip()
+    products = []
+    if search_query:
+        limit = getattr(settings, 'PRODUCT_SEARCH_LIMIT', 48)
+        # Over-fetch a little since unavailable products are dropped afterwards
+        product_ids = search_product_ids(search_query, limit=limit * 2)
+        products = store_cards_for_ids(Product.objects.filter(is_available=True), product_ids)[:limit]
+
+    return render(request, 'store/search.html', {
+        'products': products,
+        'search_query': search_query,
+    })
+
+def metrics(request):
+    """
+    Prometheus text endpoint for the request metrics. Off (404) unless a
+    scraper is let in by METRICS_TOKEN, sent as "Authorization: Bearer
+    <token>", or by METRICS_ALLOWED_IPS. Behind a same-host reverse proxy
+    every request comes from 127.0.0.1, so never list it there while the
+    proxy forwards /metrics/.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if not (
+        (token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'))
+        or request.META.get('REMOTE_ADDR') in allowed
+    ):
+        raise Http404
+    registry.flush()
+    budget = getattr(settings, 'METRICS_OVERHEAD_BUDGET_US', 50) / 1_000_000
+    body = registry.render_text() + (
+        '# TYPE metrics_record_overhead_budget_seconds gauge\n'
+        f'metrics_record_overhead_budget_seconds {budget:.6f}\n'
+    )
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def periodic_cache_warmup(request):
     """Check and perform cache warmup if needed"""
     last_warmup = cache.get('last_cache_warmup')
@@ -458,22 +432,14 @@ def periodic_cache_warmup(request):
         
 def product_detail(request, category_slug, product_slug):
     try:
-        # First check if the category exists
-        category = get_object_or_404(Category, slug=category_slug)
-        
-        # Then try to get the product
-        try:
-            single_product = Product.objects.get(
-                category=category,
-                slug=product_slug
-            )
-        except Product.DoesNotExist:
-            # Check if it's a digital product
-            single_product = get_object_or_404(
-                DigitalProduct,
-                category=category,
-                slug=product_slug
-            )
+        # Resolve the slugs from the snapshot when possible, so the query is a pk lookup
+        snapshot = get_snapshot()
+        product_id = snapshot.find(category_slug, product_slug) if snapshot is not None else None
+        lookup = {'id': product_id} if product_id is not None else {
+            'category__slug': category_slug, 'slug': product_slug
+        }
+        # Physical or digital, loaded as the right model in one query
+        single_product = get_object_or_404(Product.objects.polymorphic().select_related('category'), **lookup)
 
         # Handle review submission - enforce authentication
         if request.method == 'POST':
@@ -533,7 +499,7 @@ def product_detail(request, category_slug, product_slug):
                 ).first()
         
         # Get all reviews ordered by most recent
-        reviews = single_product.reviews.all().order_by('-created_at')
+        reviews = single_product.reviews.select_related('user').order_by('-created_at')
         
         # Get all faculty recommendations
         recommendations = single_product.recommendations.select_related(
@@ -541,6 +507,8 @@ def product_detail(request, category_slug, product_slug):
             'faculty__user'
         ).order_by('-created_at')
 
+        together = bought_together(single_product.id)
+
         context = {
             'single_product': single_product,
             'product_id': single_product.id,
@@ -549,6 +517,8 @@ def product_detail(request, category_slug, product_slug):
             'reviews': reviews,
             'recommendations': recommendations,
             'user_recommendation': user_recommendation,
+            'bought_together': together,
+            'bought_together_images': image_sources([product.image.name for product in together], 'thumbnail'),
             'is_faculty': request.user.is_faculty if request.user.is_authenticated else False,
         }
         return render(request, 'store/product_detail.html', context)
@@ -558,13 +528,15 @@ def product_detail(request, category_slug, product_slug):
         return redirect('store')
         
     except Exception as e:
+        if db_routing.failed_on_replica(e):
+            raise  # ReplicaRoutingMiddleware runs the view again on the primary
         logger.error(f"Error in product_detail view: {str(e)}")
         messages.error(request, "An error occurred while loading the product.")
         return redirect('store')
 
 def categories_processor(request):
     return {
-        'categories': Category.objects.all()
+        'categories': get_categories()
     }
 
 @login_required
@@ -595,10 +567,7 @@ def manage_category(request, category_id=None):
 def manage_product(request, product_id=None):
     product = None
     if product_id:
-        try:
-            product = DigitalProduct.objects.get(id=product_id)
-        except DigitalProduct.DoesNotExist:
-            product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.polymorphic(), id=product_id)
     
     # Determine which form to use based on the product type
     product_type = request.GET.get('type', 'physical')
@@ -626,213 +595,104 @@ def manage_product(request, product_id=None):
     }
     return render(request, 'admin/product_form.html', context)
 
-@login_required
-def manage_items(request):
-    def convert_wildcard_to_regex(search_term):
-        return '^' + search_term.replace('*', '.*') + '$'
-    
+def search_categories(categories, search_term):
+    """Filter categories by name/description; '*' is a wildcard over the whole value"""
+    if '*' in search_term:
+        regex_pattern = '^' + re.escape(search_term).replace(r'\*', '.*') + '$'
+        return categories.filter(
+            Q(name__iregex=regex_pattern) |
+            Q(description__iregex=regex_pattern)
+        )
+    return categories.filter(
+        Q(name__icontains=search_term) |
+        Q(description__icontains=search_term)
+    )
+
+def _admin_listing(request):
+    """Shared state of the manage_items screen: categories, one product page and the counters"""
     search_term = request.GET.get('search', '').strip()
     sort_by = request.GET.get('sort', 'name')  # Default sort by name
     sort_dir = request.GET.get('dir', 'asc')   # Default ascending
-    
-    # Initialize querysets with sorting
+
     categories = Category.objects.all()
-    
-    # Get both regular products and digital products
-    base_products = Product.objects.select_related('category').filter(digitalproduct__isnull=True)
-    digital_products = DigitalProduct.objects.select_related('category')
-    
     # Handle category sorting
     if sort_by == 'name':
         categories = categories.order_by('name' if sort_dir == 'asc' else '-name')
     elif sort_by == 'description':
         categories = categories.order_by('description' if sort_dir == 'asc' else '-description')
-    
-    # Calculate counts before filtering
-    digital_count = digital_products.count()
-    physical_count = base_products.count()
-    out_of_stock = base_products.filter(stock=0).count()
-    
-    if search_term:
-        # Handle wildcard searches
-        if '*' in search_term:
-            regex_pattern = convert_wildcard_to_regex(search_term)
-            categories = categories.filter(
-                Q(name__iregex=regex_pattern) |
-                Q(description__iregex=regex_pattern)
-            )
-            
-            # Filter both querysets separately
-            base_products = base_products.filter(
-                Q(name__iregex=regex_pattern) |
-                Q(description__iregex=regex_pattern) |
-                Q(category__name__iregex=regex_pattern) |
-                Q(brand__iregex=regex_pattern)
-            )
-            digital_products = digital_products.filter(
-                Q(name__iregex=regex_pattern) |
-                Q(description__iregex=regex_pattern) |
-                Q(category__name__iregex=regex_pattern) |
-                Q(brand__iregex=regex_pattern)
-            )
-        else:
-            # Regular search
-            categories = categories.filter(
-                Q(name__icontains=search_term) |
-                Q(description__icontains=search_term)
-            )
-            
-            # Filter both querysets separately
-            base_products = base_products.filter(
-                Q(name__icontains=search_term) |
-                Q(description__icontains=search_term) |
-                Q(category__name__icontains=search_term) |
-                Q(brand__icontains=search_term)
-            )
-            digital_products = digital_products.filter(
-                Q(name__icontains=search_term) |
-                Q(description__icontains=search_term) |
-                Q(category__name__icontains=search_term) |
-                Q(brand__icontains=search_term)
-            )
 
-    # Convert to lists and add digital_type flag
-    base_products = list(base_products)
-    digital_products = list(digital_products)
-    
-    for product in base_products:
-        product.digital_type = False
-        
-    for product in digital_products:
-        product.digital_type = True
-    
-    # Combine the lists
-    products = base_products + digital_products
-    
-    # Sort products
-    def get_sort_key(product):
-        if sort_by == 'name':
-            return product.name.lower()
-        elif sort_by == 'type':
-            return str(product.digital_type)
-        elif sort_by == 'category':
-            return product.category.name.lower()
-        elif sort_by == 'price':
-            return float(product.price)
-        return product.name.lower()  # default
-    
-    products.sort(
-        key=get_sort_key,
-        reverse=(sort_dir == 'desc')
+    search = None
+    if search_term:
+        categories = search_categories(categories, search_term)
+        search = search_documents(search_term)
+
+    stats = product_statistics(search)
+    page = admin_product_page(
+        sort_by, sort_dir, request.GET.get('page'), stats['total_products'],
+        page_size=getattr(settings, 'MANAGE_ITEMS_PAGE_SIZE', 50),
+        search=search
     )
-    
-    # Calculate total after filtering
-    total_products = len(products)
-    
-    # Sort combined products by created date for recent products
-    products.sort(key=lambda x: x.created_date, reverse=True)
-    recent_products = products[:5]
-    
-    context = {
+    query = request.GET.copy()
+    query.pop('page', None)
+    return {
         'categories': categories,
-        'products': products,
+        'products': page,
+        'page_obj': page,
+        'page_query': query.urlencode(),
         'search_term': search_term,
-        'title': 'Manage Items',
         'sort_by': sort_by,
         'sort_dir': sort_dir,
+        'stats': stats,
+    }
+
+@login_required
+def manage_items(request):
+    listing = _admin_listing(request)
+    stats = listing.pop('stats')
+    context = {
+        **listing,
+        'title': 'Manage Items',
         # Statistics
-        'total_products': total_products,
-        'digital_products': digital_count,
-        'physical_products': physical_count,
-        'out_of_stock': out_of_stock,
+        **stats,
     }
     
     return render(request, 'admin/manage_items.html', context)
 
 @login_required
 def fetch_sorted_data(request):
-    sort_by = request.GET.get('sort', 'name')
-    sort_dir = request.GET.get('dir', 'asc')
-    search_term = request.GET.get('search', '').strip()
-    
-    # Get both regular products and digital products
-    base_products = Product.objects.select_related('category').filter(digitalproduct__isnull=True)
-    digital_products = DigitalProduct.objects.select_related('category')
-    categories = Category.objects.all()
-    
-    # Handle category sorting
-    if sort_by == 'name':
-        categories = categories.order_by('name' if sort_dir == 'asc' else '-name')
-    elif sort_by == 'description':
-        categories = categories.order_by('description' if sort_dir == 'asc' else '-description')
-        
-    # Convert to lists and add digital_type flag
-    base_products = list(base_products)
-    digital_products = list(digital_products)
-    
-    for product in base_products:
-        product.digital_type = False
-        
-    for product in digital_products:
-        product.digital_type = True
-    
-    # Combine the lists
-    products = base_products + digital_products
-    
-    # Sort products
-    def get_sort_key(product):
-        if sort_by == 'name':
-            return product.name.lower()
-        elif sort_by == 'type':
-            return str(product.digital_type)
-        elif sort_by == 'category':
-            return product.category.name.lower()
-        elif sort_by == 'price':
-            return float(product.price)
-        elif sort_by == 'stock':
-            if product.digital_type:
-                # For digital products, sort by version
-                # Convert version string to tuple of numbers for proper sorting
-                # Example: "1.2.3" becomes (1, 2, 3)
-                try:
-                    return tuple(map(int, product.version.split('.')))
-                except (AttributeError, ValueError):
-                    return (0,)  # Default if version is invalid
-            else:
-                # For physical products, sort by stock number
-                return product.stock
-        return product.name.lower()  # default
-    
-    try:
-        products.sort(
-            key=get_sort_key,
-            reverse=(sort_dir == 'desc')
-        )
-    except TypeError:
-        # Fallback sorting if there's an error comparing different types
-        products.sort(
-            key=lambda x: str(get_sort_key(x)),
-            reverse=(sort_dir == 'desc')
-        )
-    
+    listing = _admin_listing(request)
+    table_context = {
+        'sort_by': listing['sort_by'],
+        'sort_dir': listing['sort_dir'],
+        'search_term': listing['search_term'],
+    }
+
     # Render just the table contents
     categories_html = render_to_string('admin/partials/categories_table.html', {
-        'categories': categories,
-        'sort_by': sort_by,
-        'sort_dir': sort_dir,
-        'search_term': search_term
+        'categories': listing['categories'],
+        **table_context
     }, request)
     
     products_html = render_to_string('admin/partials/products_table.html', {
-        'products': products,
-        'sort_by': sort_by,
-        'sort_dir': sort_dir,
-        'search_term': search_term
+        'products': listing['products'],
+        **table_context
+    }, request)
+
+    # Only this page's rows have delete dialogs in the DOM
+    modals_html = render_to_string('admin/partials/product_delete_modals.html', {
+        'products': listing['products'],
+    }, request)
+
+    pagination_html = render_to_string('admin/partials/products_pagination.html', {
+        'page_obj': listing['page_obj'],
+        'page_query': listing['page_query'],
     }, request)
     
     return JsonResponse({
         'categories_html': categories_html,
-        'products_html': products_html
+        'products_html': products_html,
+        'modals_html': modals_html,
+        'pagination_html': pagination_html,
     })
     
 @login_required
@@ -846,10 +706,7 @@ def delete_category(request, category_id):
 @login_required
 def delete_product(request, product_id):
     if request.method == 'POST':
-        try:
-            product = DigitalProduct.objects.get(id=product_id)
-        except DigitalProduct.DoesNotExist:
-            product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.polymorphic(), id=product_id)
         
         product_name = product.name
         product.delete()